@@ -0,0 +1,293 @@
+"""Core library API: validated, non-interactive operations for every front end.
+
+The console menus and the Streamlit pages only collect input and show
+results; the work is done here.  Every function takes an open connection,
+validates its arguments, and returns a plain result (a namedtuple, a tuple
+or a value) or raises an errors.LibraryError - a ValueError whose message
+can be shown as is.  Nothing here prompts or prints, so scripts, batch jobs
+and load tests drive the library the same way the apps do:
+
+    import api
+    from db import get_connection
+    conn = get_connection()
+    member = api.add_member(conn, "Ana", "Rao", "R. Rao", "12 Park St", "123412341234", "2025-01-01", "1 year")
+    first, last = api.add_item(conn, "Book", "Dune", "Frank Herbert", "Fiction", 250, "2025-01-01", qty=2)
+    name, _, due = api.issue_item(conn, first, member.id, "2025-01-01")   # due date from the loan policy
+
+Circulation (circulation.py), the hold queue (holds.py) and membership
+expiry and renewal (memberships.py) are re-exported, so callers only need
+this module.
+"""
+import hashlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import availability
+from catalog import add_copies, serial_prefix
+from circulation import (BatchResult, issue_batch, issue_item, parse_serials, pay_fine, preview_return,
+                         return_batch, return_item)
+from codes import ACTIVE, AVAILABLE, COPY_STATUSES, INACTIVE, code, name_sql
+from db import transaction
+from errors import InvalidInput, LibraryError, NotFound, Unavailable
+from holds import cancel as cancel_hold, estimate as hold_estimate, place as place_hold, queue as hold_queue
+from memberships import expire as expire_memberships, renew as renew_memberships, renew_many
+from policy import DEFAULT_TIER, TIERS
+
+# Category mapping for serial numbers
+category_map = {
+    'Science': 'SC',
+    'Economics': 'EC',
+    'Fiction': 'FC',
+    'Children': 'CH',
+    'Personal Development': 'PD'
+}
+
+# Membership durations in days
+membership_days = {'6 months': 180, '1 year': 365, '2 years': 730}
+
+# Item types and their serial codes
+product_types = {'Book': 'B', 'Movie': 'M'}
+
+# Statuses an admin can set by hand
+ITEM_STATUSES = ('Available', 'Issued')
+_STATUS_IDS = {name: status_id for status_id, name in COPY_STATUSES.items()}
+
+MIN_PASSWORD_LENGTH = 4
+
+Member = namedtuple('Member', 'id first_name last_name contact_name contact_address aadhar_no '
+                              'start_date end_date status pending_fine tier')
+User = namedtuple('User', 'id username is_admin is_active')
+Item = namedtuple('Item', 'serial_no type name author category status due_date')
+Availability = namedtuple('Availability', 'title copies available serials')
+
+# Available copies listed by available_items()
+AVAILABLE_SHOWN = 500
+
+
+def parse_date(date_str, field_name="Date"):
+    """Parse YYYY-MM-DD; raises InvalidInput if missing or out of range."""
+    if not date_str:
+        raise InvalidInput(f"{field_name} is required.")
+    try:
+        dt = datetime.strptime(str(date_str), "%Y-%m-%d")
+    except ValueError:
+        dt = None
+    if dt is None or dt.year < 2000 or dt.year > 2035:
+        raise InvalidInput(f"Invalid {field_name}. Use YYYY-MM-DD (example: 2025-04-15)")
+    return dt
+
+
+def _required(**fields):
+    missing = [name.replace('_', ' ') for name, value in fields.items() if not str(value or '').strip()]
+    if missing:
+        raise InvalidInput(f"Required: {', '.join(missing)}.")
+
+
+# ────────────────────────────────────────────────
+# Members
+# ────────────────────────────────────────────────
+def get_member(conn, member_id):
+    """Member by id; raises NotFound."""
+    row = conn.execute(f"""SELECT id, first_name, last_name, contact_name, contact_address, aadhar_no,
+                                  start_date, end_date, status, pending_fine, {name_sql('member_tiers', 'tier_id')}
+                           FROM members WHERE id = ?""", (member_id,)).fetchone()
+    if not row:
+        raise NotFound(f"Member ID {member_id} not found.")
+    return Member(*row)
+
+
+def _check_tier(tier):
+    if tier not in TIERS:
+        raise InvalidInput(f"Tier must be one of {', '.join(TIERS)}.")
+
+
+def add_member(conn, first, last, contact, address, aadhar, start_date, duration, tier=DEFAULT_TIER):
+    """Add an Active member for `duration` (a membership_days key) on a TIERS tier; returns the Member."""
+    _required(first_name=first, last_name=last, contact_person=contact, address=address, aadhar_no=aadhar)
+    if duration not in membership_days:
+        raise InvalidInput(f"Membership must be one of {', '.join(membership_days)}.")
+    _check_tier(tier)
+    start = parse_date(start_date, "Start Date")
+    end_date = (start + timedelta(days=membership_days[duration])).strftime("%Y-%m-%d")
+
+    def work(conn):
+        c = conn.execute("""INSERT INTO members (first_name, last_name, contact_name, contact_address, aadhar_no,
+                                                 start_date, end_date, status_id, tier_id)
+                            VALUES (?,?,?,?,?,?,?,?,?)""",
+                         (first, last, contact, address, aadhar, start.strftime("%Y-%m-%d"), end_date, ACTIVE,
+                          code(conn, 'member_tiers', tier)))
+        return get_member(conn, c.lastrowid)
+    return transaction(conn, work)
+
+
+def extend_membership(conn, member_id, duration, today=None):
+    """Renew the membership for `duration` from its end date, or today if it has lapsed.
+
+    The member is Active again; returns the new end date.  Raises NotFound.
+    """
+    if duration not in membership_days:
+        raise InvalidInput(f"Extension must be one of {', '.join(membership_days)}.")
+    today = today or datetime.now().strftime("%Y-%m-%d")
+
+    def work(conn):
+        mid = get_member(conn, member_id).id
+        renew_many(conn, [(mid, membership_days[duration], None)], today)
+        return conn.execute("SELECT end_date FROM members WHERE id = ?", (mid,)).fetchone()[0]
+    return transaction(conn, work)
+
+
+def set_member_tier(conn, member_id, tier):
+    """Move the member to a TIERS tier (their loan policy follows); raises NotFound."""
+    _check_tier(tier)
+
+    def work(conn):
+        if conn.execute("UPDATE members SET tier_id = ? WHERE id = ?",
+                        (code(conn, 'member_tiers', tier), member_id)).rowcount == 0:
+            raise NotFound(f"Member ID {member_id} not found.")
+    transaction(conn, work)
+
+
+def cancel_membership(conn, member_id):
+    """Mark the member Inactive; raises NotFound."""
+    def work(conn):
+        if conn.execute("UPDATE members SET status_id = ? WHERE id = ?", (INACTIVE, member_id)).rowcount == 0:
+            raise NotFound(f"Member ID {member_id} not found.")
+    transaction(conn, work)
+
+
+# ────────────────────────────────────────────────
+# Catalog
+# ────────────────────────────────────────────────
+def add_item(conn, ptype, name, author, category, cost, proc_date, qty=1):
+    """Add qty copies of a book or movie; returns (first, last) serial."""
+    if ptype not in product_types:
+        raise InvalidInput(f"Type must be {' or '.join(product_types)}.")
+    if category not in category_map:
+        raise InvalidInput(f"Category must be one of {', '.join(category_map)}.")
+    _required(title=name, author=author)
+    try:
+        cost, qty = float(cost), int(qty)
+    except (TypeError, ValueError):
+        raise InvalidInput("Cost and quantity must be numbers.") from None
+    if qty < 1 or cost < 0:
+        raise InvalidInput("Quantity must be at least 1 and cost not negative.")
+    proc = parse_date(proc_date, "Procurement Date").strftime("%Y-%m-%d")
+    # Serials are reserved as one block, all copies inserted in one transaction
+    return add_copies(conn, ptype, name, author, category, cost, proc, qty,
+                      serial_prefix(category_map[category], product_types[ptype]))
+
+
+def get_item(conn, serial):
+    """Copy by serial, with the due date of its open loan (None if on the shelf); raises NotFound."""
+    row = conn.execute("""SELECT p.serial_no, p.type, p.name, p.author, p.category,
+                                 COALESCE(p.status, 'Available'), i.return_date
+                          FROM products p
+                          LEFT JOIN issues i ON i.product_id = p.id AND i.actual_return_date IS NULL
+                          WHERE p.serial_no = ?""", (serial,)).fetchone()
+    if not row:
+        raise NotFound(f"Serial {serial} not found.")
+    return Item(*row)
+
+
+def set_item_status(conn, serial, status):
+    """Set a copy's status by hand (ITEM_STATUSES); raises NotFound."""
+    if status not in ITEM_STATUSES:
+        raise InvalidInput(f"Status must be {' or '.join(ITEM_STATUSES)}.")
+
+    def work(conn):
+        if conn.execute("UPDATE copies SET status_id = ? WHERE serial_no = ?",
+                        (_STATUS_IDS[status], serial)).rowcount == 0:
+            raise NotFound(f"Serial {serial} not found.")
+    transaction(conn, work)
+
+
+def _on_shelf(conn, ids, columns):
+    # Details of copies the availability index lists, re-checked against the
+    # table (by id: "+status_id" keeps idx_copies_status out of the plan)
+    if not ids:
+        return []
+    return conn.execute(f"""SELECT {columns} FROM products
+                            WHERE id IN ({','.join('?' * len(ids))}) AND +status_id = {AVAILABLE}
+                            ORDER BY serial_no""", ids).fetchall()
+
+
+def title_availability(conn, title):
+    """Copies of a title and the serials of those on the shelf (availability index); raises NotFound."""
+    copies, available = availability.title_copies(conn, title)
+    if not copies:
+        raise NotFound(f"No item titled '{title}'.")
+    serials = [row[0] for row in _on_shelf(conn, available, "serial_no")]
+    return Availability(title, len(copies), len(serials), serials)
+
+
+def available_items(conn, limit=AVAILABLE_SHOWN):
+    """(copies on the shelf, the first `limit` of them as [(serial, name, author, type)])."""
+    total = availability.counts(conn).get(availability.AVAILABLE, 0)
+    return total, _on_shelf(conn, availability.available_ids(conn, limit), "serial_no, name, author, type")
+
+
+# ────────────────────────────────────────────────
+# User accounts
+# ────────────────────────────────────────────────
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def login(conn, username, password):
+    """The active User with these credentials (username is case-insensitive), or None."""
+    row = conn.execute("""SELECT id, username, is_admin, is_active FROM users
+                          WHERE LOWER(username) = LOWER(?) AND password = ? AND is_active = 1""",
+                       (username.strip(), hash_password(password.strip()))).fetchone()
+    return User(*row) if row else None
+
+
+def list_users(conn):
+    return [User(*row) for row in conn.execute("SELECT id, username, is_admin, is_active FROM users ORDER BY username")]
+
+
+def get_user(conn, username):
+    """User by name (case-insensitive); raises NotFound."""
+    row = conn.execute("SELECT id, username, is_admin, is_active FROM users WHERE LOWER(username) = LOWER(?)",
+                       (username,)).fetchone()
+    if not row:
+        raise NotFound(f"User '{username}' not found.")
+    return User(*row)
+
+
+def _check_password(password):
+    if len(password or '') < MIN_PASSWORD_LENGTH:
+        raise InvalidInput(f"Password must be at least {MIN_PASSWORD_LENGTH} characters.")
+
+
+def create_user(conn, username, password, is_admin=False):
+    """Add an active user; raises InvalidInput for a short password or a taken name."""
+    _required(username=username, password=password)
+    _check_password(password)
+
+    def work(conn):
+        if conn.execute("SELECT 1 FROM users WHERE LOWER(username) = LOWER(?)", (username,)).fetchone():
+            raise InvalidInput(f"Username '{username}' already exists!")
+        conn.execute("INSERT INTO users (username, password, is_admin, is_active) VALUES (?, ?, ?, 1)",
+                     (username, hash_password(password), 1 if is_admin else 0))
+        return get_user(conn, username)
+    return transaction(conn, work)
+
+
+def _update_user(conn, user_id, column, value):
+    def work(conn):
+        if conn.execute(f"UPDATE users SET {column} = ? WHERE id = ?", (value, user_id)).rowcount == 0:
+            raise NotFound(f"User ID {user_id} not found.")
+    transaction(conn, work)
+
+
+def set_password(conn, user_id, password):
+    _check_password(password)
+    _update_user(conn, user_id, 'password', hash_password(password))
+
+
+def set_admin(conn, user_id, is_admin):
+    _update_user(conn, user_id, 'is_admin', 1 if is_admin else 0)
+
+
+def set_active(conn, user_id, is_active):
+    _update_user(conn, user_id, 'is_active', 1 if is_active else 0)
@@ -0,0 +1,177 @@
+"""Archival of closed loan history into yearly partitions.
+
+Closed loans (actual_return_date set) older than RETENTION_DAYS are moved
+out of issues into issues_archive_<year> tables in the same database, one
+table per year of issue_date, so issues keeps only open loans and recent
+history.  Active Issues, Overdue, returns and the nightly accrual, which
+only read open loans, never see the archive.
+
+Loans move in batches of BATCH_SIZE, each batch in its own short write
+transaction, with a PAUSE between batches so circulation desks get the
+write lock in between.  The archive is resumable: an interrupted run has
+committed whole batches and the next run carries on.  loan_archives lists
+the partitions with the range of issue dates each one holds, so a report
+over a period only unions the partitions that overlap it
+(loans_source()).  Loan ids are never reused (AUTOINCREMENT), so fine
+ledger entries still point at their loan wherever it lives.
+
+    python archive.py [--days 730] [--date D] [--batch 5000]    # run from cron
+    python archive.py --status
+"""
+import argparse
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+from db import transaction
+
+# Closed loans returned longer ago than this are archived
+RETENTION_DAYS = 730
+
+# Loans moved per transaction, and seconds to wait between transactions
+BATCH_SIZE = 5000
+PAUSE = 0.05
+
+PREFIX = "issues_archive_"
+
+
+def create_catalog(conn):
+    """Migration step: the partition catalog and the index the archiver scans."""
+    conn.execute("""CREATE TABLE IF NOT EXISTS loan_archives
+                    (year INTEGER PRIMARY KEY, table_name TEXT NOT NULL,
+                     first_issue TEXT, last_issue TEXT, loans INTEGER NOT NULL DEFAULT 0)""")
+    # Closed loans by return date: the next batch to archive is one range scan
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_issues_closed
+                    ON issues (actual_return_date) WHERE actual_return_date IS NOT NULL""")
+    # Loan History over a period, on the live table as on the partitions
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_issues_issue_date ON issues (issue_date)")
+
+
+def _columns(conn, table):
+    return [(r[1], r[2]) for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _partition(conn, year):
+    # Same columns as issues; columns added to issues later are added here too
+    table = f"{PREFIX}{year:04d}"
+    existing = {name for name, _ in _columns(conn, table)}
+    if not existing:
+        cols = ", ".join(f"{name} {ctype}" + (" PRIMARY KEY" if name == 'id' else "")
+                         for name, ctype in _columns(conn, 'issues'))
+        conn.execute(f"CREATE TABLE {table} ({cols})")
+        conn.execute(f"CREATE INDEX {table}_issue_date ON {table} (issue_date)")
+        conn.execute(f"CREATE INDEX {table}_member ON {table} (member_id)")
+        conn.execute("INSERT INTO loan_archives (year, table_name) VALUES (?, ?)", (year, table))
+    else:
+        for name, ctype in _columns(conn, 'issues'):
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {ctype}")
+    return table
+
+
+def _year(issue_date):
+    try:
+        return int(str(issue_date)[:4])
+    except ValueError:
+        return 0
+
+
+def _move_batch(conn, cutoff, batch):
+    rows = conn.execute("""SELECT id, issue_date FROM issues
+                           WHERE actual_return_date IS NOT NULL AND actual_return_date < ?
+                           ORDER BY actual_return_date LIMIT ?""", (cutoff, batch)).fetchall()
+    by_year = {}
+    for issue_id, issue_date in rows:
+        by_year.setdefault(_year(issue_date), []).append(issue_id)
+    cols = ", ".join(name for name, _ in _columns(conn, 'issues'))
+    for year, ids in by_year.items():
+        table = _partition(conn, year)
+        marks = ",".join("?" * len(ids))
+        conn.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM issues WHERE id IN ({marks})", ids)
+        conn.execute(f"""UPDATE loan_archives SET
+                             loans = loans + ?,
+                             first_issue = MIN(COALESCE(first_issue, d.lo), d.lo),
+                             last_issue = MAX(COALESCE(last_issue, d.hi), d.hi)
+                         FROM (SELECT MIN(issue_date) AS lo, MAX(issue_date) AS hi
+                               FROM issues WHERE id IN ({marks})) AS d
+                         WHERE year = ?""", [len(ids)] + ids + [year])
+        conn.execute(f"DELETE FROM issues WHERE id IN ({marks})", ids)
+    return len(rows)
+
+
+def archive(conn, today=None, days=RETENTION_DAYS, batch=BATCH_SIZE, pause=PAUSE):
+    """Move closed loans returned more than `days` before today; returns the number moved."""
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    cutoff = (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=days)).strftime("%Y-%m-%d")
+    moved = 0
+    while True:
+        n = transaction(conn, _move_batch, cutoff, batch)
+        moved += n
+        if n < batch:
+            return moved
+        time.sleep(pause)
+
+
+def partitions(conn, since=None, until=None):
+    """[(year, table, first_issue, last_issue, loans)] holding loans issued in [since, until]."""
+    try:
+        rows = conn.execute("SELECT year, table_name, first_issue, last_issue, loans FROM loan_archives "
+                            "WHERE loans > 0 ORDER BY year").fetchall()
+    except sqlite3.OperationalError:
+        return []          # not migrated yet
+    return [r for r in rows
+            if (since is None or r[3] is None or r[3] >= since) and (until is None or r[2] is None or r[2] <= until)]
+
+
+def loans_source(conn, since=None, until=None):
+    """FROM-clause expression for loans issued in [since, until] (None = open-ended).
+
+    Just "issues" when no archive partition overlaps the period; otherwise
+    issues UNION ALL the overlapping partitions, each narrowed to the period
+    (:since / :until) so its issue_date index is used.
+    """
+    parts = partitions(conn, since, until)
+    if not parts:
+        return "issues"
+    cols = ", ".join(name for name, _ in _columns(conn, 'issues'))
+    where = " AND ".join(cond for cond, value in (("issue_date >= :since", since), ("issue_date <= :until", until))
+                         if value is not None)
+    return "(" + " UNION ALL ".join(f"SELECT {cols} FROM {table}" + (f" WHERE {where}" if where else "")
+                                    for table in ['issues'] + [part[1] for part in parts]) + ")"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old closed loans into yearly archive tables.")
+    parser.add_argument('--days', type=int, default=RETENTION_DAYS,
+                        help=f"archive loans returned more than this many days ago (default {RETENTION_DAYS})")
+    parser.add_argument('--date', help="today's date (YYYY-MM-DD)")
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE, help="loans moved per transaction")
+    parser.add_argument('--status', action='store_true', help="list archive partitions and exit")
+    args = parser.parse_args(argv)
+
+    from api import parse_date
+    from db import get_connection
+    from library_management import bootstrap
+    if args.date:
+        try:
+            parse_date(args.date, "Date")
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+    bootstrap()
+    conn = get_connection()
+    try:
+        if not args.status:
+            started = time.perf_counter()
+            moved = archive(conn, args.date, args.days, args.batch)
+            print(f"{moved} closed loan(s) archived in {time.perf_counter() - started:.1f}s.")
+        for year, table, first, last, loans in partitions(conn):
+            print(f"  {table}: {loans} loan(s) issued {first} to {last}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""In-process availability index.
+
+Answers "is this copy on the shelf" and "which copies of this title are
+available" from memory: a bytearray of status codes indexed by product id
+and a title -> copy ids map, loaded once per process from products.
+
+Triggers append every change to a copy's status or title to
+availability_log, whichever process or code path made it (issue, return,
+holds, the status form, imports).  The index replays the log from the last
+sequence number it has seen: right away when this process has committed a
+write since (db.commit_count()), otherwise at most every SYNC_INTERVAL
+seconds, so changes made by other processes show up within that interval.
+The log keeps the last LOG_KEEP changes; an index that falls further behind
+reloads from products.  check() compares the index with the table.
+
+Writes never rely on the index: issue still validates the copy's status
+inside its transaction.
+"""
+import threading
+import time
+from array import array
+
+from db import commit_count, get_db_path
+
+# Seconds an answer may lag behind writes made by other processes
+SYNC_INTERVAL = 0.5
+
+# Changes kept in availability_log
+LOG_KEEP = 100000
+
+AVAILABLE = 'Available'
+
+
+_PRUNE = f"DELETE FROM availability_log WHERE seq <= (SELECT MAX(seq) FROM availability_log) - {LOG_KEEP};"
+
+
+def _log(row, name=None, status=None):
+    return f"""INSERT INTO availability_log (product_id, status, name)
+               VALUES ({row}.id, {status or f"COALESCE({row}.status, '{AVAILABLE}')"}, {name or row + '.name'});
+               {_PRUNE}"""
+
+
+TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS availability_products_ai AFTER INSERT ON products BEGIN
+            {_log('new')}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS availability_products_au AFTER UPDATE OF status, name ON products
+        WHEN old.status IS NOT new.status OR old.name IS NOT new.name BEGIN
+            {_log('new')}
+        END""",
+    # A deleted copy is logged with no status
+    """CREATE TRIGGER IF NOT EXISTS availability_products_ad AFTER DELETE ON products BEGIN
+           INSERT INTO availability_log (product_id, status, name) VALUES (old.id, NULL, NULL);
+       END""",
+]
+
+
+# The same for the catalog as titles and copies (migration 11)
+COPY_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS availability_copies_ai AFTER INSERT ON copies BEGIN
+            {_log('new', '(SELECT name FROM titles WHERE id = new.title_id)')}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS availability_copies_au AFTER UPDATE OF status, title_id ON copies
+        WHEN old.status IS NOT new.status OR old.title_id IS NOT new.title_id BEGIN
+            {_log('new', '(SELECT name FROM titles WHERE id = new.title_id)')}
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS availability_copies_ad AFTER DELETE ON copies BEGIN
+           INSERT INTO availability_log (product_id, status, name) VALUES (old.id, NULL, NULL);
+       END""",
+    # A renamed title renames all its copies
+    f"""CREATE TRIGGER IF NOT EXISTS availability_titles_au AFTER UPDATE OF name ON titles
+        WHEN old.name IS NOT new.name BEGIN
+            INSERT INTO availability_log (product_id, status, name)
+            SELECT id, COALESCE(status, '{AVAILABLE}'), new.name FROM copies WHERE title_id = new.id;
+            {_PRUNE}
+        END""",
+]
+
+
+# The same with status as a lookup id (migration 12)
+_TITLE_NAME = "(SELECT name FROM titles WHERE id = new.title_id)"
+_STATUS_NAME = f"COALESCE((SELECT name FROM copy_statuses WHERE id = {{0}}.status_id), '{AVAILABLE}')"
+
+CODED_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS availability_copies_ai AFTER INSERT ON copies BEGIN
+            {_log('new', _TITLE_NAME, _STATUS_NAME.format('new'))}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS availability_copies_au AFTER UPDATE OF status_id, title_id ON copies
+        WHEN old.status_id IS NOT new.status_id OR old.title_id IS NOT new.title_id BEGIN
+            {_log('new', _TITLE_NAME, _STATUS_NAME.format('new'))}
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS availability_copies_ad AFTER DELETE ON copies BEGIN
+           INSERT INTO availability_log (product_id, status, name) VALUES (old.id, NULL, NULL);
+       END""",
+    f"""CREATE TRIGGER IF NOT EXISTS availability_titles_au AFTER UPDATE OF name ON titles
+        WHEN old.name IS NOT new.name BEGIN
+            INSERT INTO availability_log (product_id, status, name)
+            SELECT id, {_STATUS_NAME.format('copies')}, new.name FROM copies WHERE title_id = new.id;
+            {_PRUNE}
+        END""",
+]
+
+
+def create_log(conn):
+    """Migration step: availability_log and the triggers that fill it."""
+    conn.execute("""CREATE TABLE IF NOT EXISTS availability_log
+                    (seq INTEGER PRIMARY KEY, product_id INTEGER NOT NULL, status TEXT, name TEXT)""")
+    for trigger in TRIGGERS:
+        conn.execute(trigger)
+
+
+def create_copy_triggers(conn):
+    """Migration step: availability_log triggers on titles and copies."""
+    for trigger in COPY_TRIGGERS:
+        conn.execute(trigger)
+
+
+def create_coded_triggers(conn):
+    """Migration step: availability_log triggers on titles and copies with status ids."""
+    for trigger in CODED_TRIGGERS:
+        conn.execute(trigger)
+
+
+class Index:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commits = -1
+        self.synced_at = 0.0
+        self.seq = None               # last availability_log entry applied
+        self.status = bytearray()     # product id -> status code (0 = no such copy)
+        self.title_of = array('i')    # product id -> title number (-1 = none)
+        self.codes = {}               # status -> code
+        self.statuses = [None]        # code -> status
+        self.titles = {}              # title -> number
+        self.copies = []              # title number -> array of product ids
+
+    def code(self, status):
+        code = self.codes.get(status)
+        if code is None:
+            code = self.codes[status] = len(self.statuses)
+            self.statuses.append(status)
+        return code
+
+    def _grow(self, size):
+        if size > len(self.status):
+            extra = size - len(self.status)
+            self.status.extend(bytes(extra))
+            self.title_of.extend([-1] * extra)
+
+    def _set(self, pid, status, name):
+        self._grow(pid + 1)
+        old = self.title_of[pid]
+        if status is None:
+            self.status[pid] = 0
+            if old >= 0:
+                self.copies[old].remove(pid)
+            self.title_of[pid] = -1
+            return
+        self.status[pid] = self.code(status)
+        title = self.titles.get(name)
+        if title is None:
+            title = self.titles[name] = len(self.copies)
+            self.copies.append(array('i'))
+        if title != old:
+            if old >= 0:
+                self.copies[old].remove(pid)
+            self.copies[title].append(pid)
+            self.title_of[pid] = title
+
+    def _load(self, conn):
+        # Built aside and swapped in, so readers never see a half-loaded index
+        fresh = Index()
+        began = not conn.in_transaction
+        if began:
+            conn.execute("BEGIN")          # log position and table from one snapshot
+        try:
+            fresh.seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM availability_log").fetchone()[0]
+            fresh._grow((conn.execute("SELECT MAX(id) FROM products").fetchone()[0] or 0) + 1)
+            for pid, status, name in conn.execute(f"SELECT id, COALESCE(status, '{AVAILABLE}'), name FROM products"):
+                fresh._set(pid, status, name)
+        finally:
+            if began:
+                conn.commit()
+        for field in ('seq', 'status', 'title_of', 'codes', 'statuses', 'titles', 'copies'):
+            setattr(self, field, getattr(fresh, field))
+
+    def sync(self, conn, force=False):
+        commits, now = commit_count(), time.monotonic()
+        if not force and self.seq is not None and commits == self.commits and now - self.synced_at < SYNC_INTERVAL:
+            return
+        with self.lock:
+            if self.seq is None:
+                self._load(conn)
+            else:
+                changes = conn.execute("""SELECT seq, product_id, status, name FROM availability_log
+                                          WHERE seq > ? ORDER BY seq""", (self.seq,)).fetchall()
+                if changes and changes[0][0] > self.seq + 1:
+                    self._load(conn)            # fell behind the pruned log
+                else:
+                    for seq, pid, status, name in changes:
+                        self._set(pid, status, name)
+                        self.seq = seq
+            self.commits, self.synced_at = commits, now
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _index(conn, force=False):
+    key = get_db_path()
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = Index()
+    index.sync(conn, force)
+    return index
+
+
+def warm(conn):
+    """Load (or reload) the index for the current database; returns the number of copies."""
+    index = _index(conn, force=True)
+    return len(index.status) - index.status.count(0)
+
+
+def status_of(conn, product_id):
+    """Status of a copy, or None if there is no such copy."""
+    index = _index(conn)
+    return index.statuses[index.status[product_id]] if 0 <= product_id < len(index.status) else None
+
+
+def title_copies(conn, title):
+    """(all copy ids, available copy ids) of a title, in id order."""
+    index = _index(conn)
+    number = index.titles.get(title)
+    if number is None:
+        return [], []
+    ids = sorted(index.copies[number])
+    available = index.codes.get(AVAILABLE)
+    return ids, [pid for pid in ids if index.status[pid] == available]
+
+
+def available_ids(conn, limit=None):
+    """Ids of available copies in id order (the first `limit` of them)."""
+    index = _index(conn)
+    code = index.codes.get(AVAILABLE)
+    if code is None:
+        return []
+    found, status, marker, at = [], index.status, bytes([code]), 0
+    while limit is None or len(found) < limit:
+        at = status.find(marker, at)
+        if at < 0:
+            break
+        found.append(at)
+        at += 1
+    return found
+
+
+def counts(conn):
+    """{status: copies}."""
+    index = _index(conn)
+    found = {status: index.status.count(code) for status, code in index.codes.items()}
+    return {status: n for status, n in found.items() if n}
+
+
+def check(conn):
+    """Copies whose indexed status or title differs from products: [(id, index, table)]."""
+    index = _index(conn, force=True)
+    with index.lock:
+        table = {pid: (status, name) for pid, status, name in
+                 conn.execute(f"SELECT id, COALESCE(status, '{AVAILABLE}'), name FROM products")}
+        names = {number: title for title, number in index.titles.items()}
+        mismatches = []
+        for pid in range(len(index.status)):
+            mine = None
+            if index.status[pid]:
+                mine = (index.statuses[index.status[pid]], names.get(index.title_of[pid]))
+            if mine != table.get(pid):
+                mismatches.append((pid, mine, table.get(pid)))
+        mismatches += [(pid, None, row) for pid, row in table.items() if pid >= len(index.status)]
+    return mismatches
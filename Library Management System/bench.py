@@ -0,0 +1,323 @@
+"""Benchmarks for the circulation workload on seeded synthetic data.
+
+generate() builds a library database with members, copies across the
+category_map categories and a multi-year loan history, from a seed, so two
+runs at the same scale and seed produce the same rows.  Dates are laid out
+around a fixed anchor day instead of today, which keeps overdue counts and
+fines reproducible too.
+
+run() then drives the same functions the console and web app call, with no
+input(): catalog search, title availability, the Issue flow's available
+items, issue, return, the paged reports (master list, active, overdue) and
+the dashboard.  Each operation is timed per call and reported as JSON
+(count, p50/p99/mean/max latency in ms, throughput in operations per
+second), together with concurrent issue/return throughput across several
+desks and the peak RSS of the process.
+
+    python bench.py --scale 10k                     # generates bench-10k-42.db on first use
+    python bench.py --scale 1m --seed 7 --out bench-1m.json
+    python bench.py --scale 10m --db /data/bench-10m.db --iterations 500
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:
+    resource = None  # not on Windows; peak RSS is reported as null
+
+# Loans in the history per scale; the other tables are sized from it
+SCALES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+MEMBERS_PER_LOAN = 1 / 20
+COPIES_PER_LOAN = 1 / 10
+COPIES_PER_TITLE = 4
+MOVIE_SHARE = 0.2
+OPEN_SHARE = 0.3           # copies out on loan at the anchor date
+HISTORY_YEARS = 3
+LOAN_DAYS = 14
+
+ANCHOR = '2025-01-01'
+SEED = 42
+ITERATIONS = 200
+DESKS = 4
+CHUNK = 100_000
+
+_SYLLABLES = ["ka", "ri", "mo", "ta", "len", "sor", "vi", "an", "qu", "el", "dra", "no", "pe", "sha", "tor",
+              "mi", "lu", "ber", "co", "fa", "gin", "ho", "ja", "xe", "zu", "op", "rem", "sti", "wa", "yo"]
+
+
+def _word(rng):
+    return "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+
+
+def _days(start, count):
+    day = datetime.strptime(start, "%Y-%m-%d")
+    return [(day + timedelta(days=n)).strftime("%Y-%m-%d") for n in range(count)]
+
+
+def _insert(conn, sql, rows):
+    # rows is a generator; written in CHUNK-sized transactions
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == CHUNK:
+            conn.executemany(sql, batch)
+            conn.commit()
+            batch = []
+    conn.executemany(sql, batch)
+    conn.commit()
+
+
+# ────────────────────────────────────────────────
+# Synthetic data
+# ────────────────────────────────────────────────
+def generate(path, scale, seed=SEED, anchor=ANCHOR):
+    """Create a benchmark database at path."""
+    from catalog import format_serial
+    from codes import ACTIVE
+    from db import get_connection, set_db_path
+    from fines import accrue
+    from api import category_map
+    from library_management import bootstrap
+    from policy import DEFAULT_TIER, DEFAULTS
+
+    loans = SCALES[scale]
+    n_members = max(10, int(loans * MEMBERS_PER_LOAN))
+    n_copies = max(20, int(loans * COPIES_PER_LOAN))
+    rng = random.Random(seed)
+    span = HISTORY_YEARS * 365
+    days = _days((datetime.strptime(anchor, "%Y-%m-%d") - timedelta(days=span)).strftime("%Y-%m-%d"),
+                 span + LOAN_DAYS + 30)
+    today = span                            # index of the anchor in days
+
+    set_db_path(path)
+    bootstrap()
+    conn = get_connection()
+    conn.execute("PRAGMA synchronous = OFF")
+    categories = list(category_map)
+
+    _insert(conn, f"""INSERT INTO members (id, first_name, last_name, contact_name, contact_address, aadhar_no,
+                                           start_date, end_date, status_id, pending_fine, tier_id)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, {ACTIVE}, 0,
+                              (SELECT id FROM member_tiers WHERE name = '{DEFAULT_TIER}'))""",
+            ((m, _word(rng), _word(rng), _word(rng), f"{rng.randint(1, 999)} {_word(rng)} Road",
+              f"{rng.randrange(10 ** 11, 10 ** 12)}", days[today - rng.randint(0, span)],
+              days[min(len(days) - 1, today + rng.randint(1, 365))]) for m in range(1, n_members + 1)))
+
+    # Titles get several copies each; a copy is on loan with probability OPEN_SHARE
+    out = set(rng.sample(range(1, n_copies + 1), int(n_copies * OPEN_SHARE)))
+
+    def copies():
+        pid = 0
+        while pid < n_copies:
+            ptype = 'Movie' if rng.random() < MOVIE_SHARE else 'Book'
+            name = " ".join(_word(rng) for _ in range(rng.randint(1, 4)))
+            author, category = f"{_word(rng)} {_word(rng)}", rng.choice(categories)
+            cost, bought = round(rng.uniform(100, 2000), 2), days[rng.randint(0, today)]
+            for _ in range(rng.randint(1, 2 * COPIES_PER_TITLE - 1)):
+                pid += 1
+                if pid > n_copies:
+                    break
+                yield (pid, ptype, name, author, category, 'Issued' if pid in out else 'Available', cost, bought,
+                       format_serial('', pid))
+    _insert(conn, """INSERT INTO products (id, type, name, author, category, status, cost, procurement_date, serial_no)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", copies())
+    conn.execute("UPDATE serial_counters SET last_value = ? WHERE prefix = ''", (n_copies,))
+    conn.commit()
+
+    # Closed loans spread evenly over the history, oldest first
+    closed = loans - len(out)
+
+    def history():
+        for n in range(closed):
+            start = n * (span - LOAN_DAYS - 20) // max(1, closed)
+            back = start + rng.randint(3, LOAN_DAYS + 10)
+            late = max(0, back - start - LOAN_DAYS)
+            yield (rng.randint(1, n_copies), rng.randint(1, n_members), days[start], days[start + LOAN_DAYS],
+                   days[back], late * DEFAULTS['fine_per_day'])
+        # Open loans issued in the last few weeks; the older ones are overdue
+        for pid in sorted(out):
+            start = today - rng.randint(0, 3 * LOAN_DAYS)
+            yield (pid, rng.randint(1, n_members), days[start], days[start + LOAN_DAYS], None, 0)
+    _insert(conn, """INSERT INTO issues (product_id, member_id, issue_date, return_date, actual_return_date, fine_amount)
+                     VALUES (?, ?, ?, ?, ?, ?)""", history())
+
+    # Overdue open loans accrue fines, which also fills the ledger and balances
+    accrue(conn, anchor)
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+# ────────────────────────────────────────────────
+# Timing
+# ────────────────────────────────────────────────
+def _percentile(sorted_ms, q):
+    return sorted_ms[min(len(sorted_ms) - 1, int(round(q * (len(sorted_ms) - 1))))]
+
+
+def _summary(timings_ns, elapsed):
+    ms = sorted(t / 1e6 for t in timings_ns)
+    if not ms:
+        return {'count': 0}
+    return {
+        'count': len(ms),
+        'p50_ms': round(_percentile(ms, 0.50), 3),
+        'p99_ms': round(_percentile(ms, 0.99), 3),
+        'mean_ms': round(sum(ms) / len(ms), 3),
+        'max_ms': round(ms[-1], 3),
+        'ops_per_s': round(len(ms) / elapsed, 1) if elapsed else None,
+    }
+
+
+def _timed(calls):
+    # calls is a list of zero-argument callables, timed one by one
+    timings = []
+    start = time.perf_counter()
+    for call in calls:
+        t0 = time.perf_counter_ns()
+        call()
+        timings.append(time.perf_counter_ns() - t0)
+    return _summary(timings, time.perf_counter() - start)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+# ────────────────────────────────────────────────
+# Workload
+# ────────────────────────────────────────────────
+def row_counts(path):
+    conn = sqlite3.connect(path)
+    counts = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+              for t in ('members', 'products', 'issues', 'fine_ledger', 'requests')}
+    conn.close()
+    return counts
+
+
+def run(path, iterations=ITERATIONS, seed=SEED, anchor=ANCHOR, desks=DESKS):
+    """Time each operation `iterations` times against the database at path."""
+    import api
+    import circulation
+    import stats
+    from codes import AVAILABLE
+    from db import get_connection, set_db_path, transaction
+    from library_management import bootstrap
+    from reports import REPORTS, fetch_page
+    from search import search_products
+
+    set_db_path(path)
+    bootstrap()
+    rng = random.Random(seed)
+    conn = get_connection()
+    due = (datetime.strptime(anchor, "%Y-%m-%d") + timedelta(days=LOAN_DAYS)).strftime("%Y-%m-%d")
+    n_members = conn.execute("SELECT MAX(id) FROM members").fetchone()[0]
+    # Candidates are read in a fixed order and sampled with rng, so a seed always times the same calls
+    names = [r[0] for r in conn.execute("SELECT name FROM titles ORDER BY id")]
+    titles = rng.sample(names, min(iterations, len(names)))
+    terms = [rng.choice(t.split()) for t in titles]
+    # Copies on the shelf, issued and then returned again; the loans are deleted afterwards, so
+    # the database ends as it started
+    shelf = [r[0] for r in conn.execute(f"SELECT serial_no FROM copies WHERE status_id = {AVAILABLE} ORDER BY id")]
+    shelf = rng.sample(shelf, min(iterations * (1 + desks), len(shelf)))
+    mine, others = shelf[:iterations], shelf[iterations:]
+    first_loan = conn.execute("SELECT COALESCE(MAX(id), 0) FROM issues").fetchone()[0]
+    members = [rng.randint(1, n_members) for _ in mine]
+
+    results = {}
+    results['check_availability'] = _timed([lambda t=t: search_products(conn, t) for t in terms])
+    results['title_availability'] = _timed([lambda t=t: api.title_availability(conn, t) for t in titles])
+    results['available_items'] = _timed([lambda: api.available_items(conn)] * iterations)
+    results['issue_item'] = _timed([lambda s=s, m=m: circulation.issue_item(conn, s, m, anchor, due)
+                                    for s, m in zip(mine, members)])
+    results['return_item'] = _timed([lambda s=s: circulation.return_item(conn, s, anchor) for s in mine])
+    for name, report, sorts in (('master_list', REPORTS['books'], REPORTS['books'].labels),
+                                ('active_issues', REPORTS['active'], [REPORTS['active'].sort]),
+                                ('overdue_items', REPORTS['overdue'], [REPORTS['overdue'].sort])):
+        def first_pages(report=report, sort=None):
+            rows, cursor = fetch_page(conn, report, sort=sort, today=anchor)
+            if cursor is not None:
+                fetch_page(conn, report, sort=sort, after=cursor, today=anchor)
+        results[name] = _timed([lambda s=rng.choice(sorts), f=first_pages: f(sort=s) for _ in range(iterations)])
+    results['dashboard'] = _timed([lambda: stats.dashboard(conn, anchor)] * iterations)
+    results['concurrent_issue_return'] = _concurrent(others, n_members, anchor, due, desks, rng)
+    transaction(conn, lambda conn: conn.execute("DELETE FROM issues WHERE id > ?", (first_loan,)))
+    conn.close()
+    return results
+
+
+def _concurrent(serials, n_members, anchor, due, desks, rng):
+    # Each desk issues and returns its own copies on its own connection
+    from circulation import issue_item, return_item
+    from db import get_connection
+    timings, lock = [], threading.Lock()
+
+    def desk(mine, members):
+        conn = get_connection()
+        local = []
+        for serial, member in zip(mine, members):
+            for call in (lambda: issue_item(conn, serial, member, anchor, due),
+                         lambda: return_item(conn, serial, anchor)):
+                t0 = time.perf_counter_ns()
+                call()
+                local.append(time.perf_counter_ns() - t0)
+        conn.close()
+        with lock:
+            timings.extend(local)
+    threads = [threading.Thread(target=desk, args=(serials[i::desks], [rng.randint(1, n_members)
+                                                                       for _ in serials[i::desks]]))
+               for i in range(desks)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    summary = _summary(timings, time.perf_counter() - start)
+    summary['desks'] = desks
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the circulation workload on synthetic data.")
+    parser.add_argument('--scale', choices=list(SCALES), default='10k', help="loans in the history")
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--db', help="benchmark database (default bench-<scale>-<seed>.db, generated if missing)")
+    parser.add_argument('--iterations', type=int, default=ITERATIONS, help="calls timed per operation")
+    parser.add_argument('--desks', type=int, default=DESKS, help="threads in the concurrent issue/return run")
+    parser.add_argument('--out', help="write the JSON report here as well as to stdout")
+    args = parser.parse_args(argv)
+
+    path = args.db or f"bench-{args.scale}-{args.seed}.db"
+    report = {'scale': args.scale, 'seed': args.seed, 'anchor': ANCHOR, 'db': os.path.abspath(path),
+              'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+              'started': datetime.now().isoformat(timespec='seconds')}
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        generate(path, args.scale, args.seed)
+        report['generate_s'] = round(time.perf_counter() - start, 1)
+    report['rows'] = row_counts(path)
+    report['operations'] = run(path, args.iterations, args.seed, desks=args.desks)
+    report['peak_rss_mb'] = peak_rss_mb()
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + "\n")
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+"""Catalog storage and writes: titles, copies, serial-number allocation.
+
+The catalog is two tables: titles (type_id, name, author, category_id - one
+row per distinct item) and copies (title_id, serial_no, status_id, cost,
+procurement_date - one row per physical copy), with type, category and
+status as lookup ids (codes.py).  products is a view joining them, and the
+lookup names, with the columns of the old products table, so reads written
+against products keep working; INSTEAD OF triggers map inserts, updates and
+deletes on it onto the tables.  catalog_titles is the same per title.  Hot
+paths (issue, return, holds, adding copies) write copies directly.
+
+Serials come from the serial_counters table instead of MAX(serial_no): a
+block of N numbers is reserved with a single UPDATE inside the same
+IMMEDIATE transaction that inserts the copies, so two desks adding items at
+once can never be handed the same serial.
+"""
+from codes import AVAILABLE, ISSUED, code, lookup_sql, name_sql
+from db import transaction
+
+# Serial scheme: plain numbers (01, 02, ...) shared by all items, or, when
+# True, per-category/type counters using category_map prefixes (SCB000001).
+PREFIXED_SERIALS = False
+
+GLOBAL_COUNTER = ''
+
+COUNTER_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS serial_counters
+       (prefix TEXT PRIMARY KEY, last_value INTEGER NOT NULL) WITHOUT ROWID""",
+    # Continue from the highest plain serial already handed out
+    """INSERT OR IGNORE INTO serial_counters (prefix, last_value)
+       SELECT '', COALESCE(MAX(CAST(serial_no AS INTEGER)), 0) FROM products""",
+]
+
+
+def create_counters(conn):
+    """Migration step: create and seed serial_counters."""
+    for stmt in COUNTER_SCHEMA:
+        conn.execute(stmt)
+
+
+# ────────────────────────────────────────────────
+# Titles and copies
+# ────────────────────────────────────────────────
+# A title is one (type, name, author, category); type and category are held
+# as lookup ids (codes.py)
+TITLE_KEY = ('type_id', 'name', 'author', 'category_id')
+
+
+def _same_title(pairs):
+    # Matches idx_titles_key, where NULL and '' are the same title
+    return " AND ".join(f"COALESCE({col}, '') = COALESCE({value}, '')" for col, value in pairs)
+
+
+# Per-title copy counts for a query over titles (or catalog_titles) "t"
+COPIES_SQL = "(SELECT COUNT(*) FROM copies c WHERE c.title_id = t.id)"
+AVAILABLE_SQL = f"(SELECT COUNT(*) FROM copies c WHERE c.title_id = t.id AND c.status_id = {AVAILABLE})"
+ISSUED_SQL = f"(SELECT COUNT(*) FROM copies c WHERE c.title_id = t.id AND c.status_id = {ISSUED})"
+
+
+def title_id(conn, ptype, name, author, category):
+    """Id of a title, added if it is new (inside a write transaction)."""
+    key = (code(conn, 'item_types', ptype), name, author, code(conn, 'categories', category))
+    row = conn.execute(f"SELECT id FROM titles WHERE {_same_title((col, '?') for col in TITLE_KEY)}", key).fetchone()
+    if row:
+        return row[0]
+    return conn.execute("INSERT INTO titles (type_id, name, author, category_id) VALUES (?, ?, ?, ?)",
+                        key).lastrowid
+
+
+def insert_copies(conn, rows):
+    """Add copies on the shelf (inside a write transaction).
+
+    rows are (type, name, author, category, cost, procurement_date, serial_no).
+    """
+    titles = {}
+    values = []
+    for *key, cost, proc_date, serial in rows:
+        key = tuple(key)
+        if key not in titles:
+            titles[key] = title_id(conn, *key)
+        values.append((titles[key], serial, cost, proc_date))
+    conn.executemany(f"""INSERT INTO copies (title_id, serial_no, status_id, cost, procurement_date)
+                         VALUES (?, ?, {AVAILABLE}, ?, ?)""", values)
+
+
+# ────────────────────────────────────────────────
+# Migration 11: products split into titles and copies
+# ────────────────────────────────────────────────
+# Still with type, category and status as text (migration 12 codes them)
+_SPLIT_KEY = ('type', 'name', 'author', 'category')
+
+_SPLIT_NEW_TITLE = f"(SELECT id FROM titles WHERE {_same_title((col, f'new.{col}') for col in _SPLIT_KEY)})"
+
+SPLIT_SCHEMA = [
+    """CREATE TABLE titles
+       (id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT, name TEXT, author TEXT, category TEXT)""",
+    "CREATE UNIQUE INDEX idx_titles_key ON titles (" + ", ".join(f"COALESCE({col}, '')" for col in _SPLIT_KEY) + ")",
+    # Master lists filter on type and sort on name; holds look titles up by name
+    "CREATE INDEX idx_titles_type_name ON titles (type, name)",
+    "CREATE INDEX idx_titles_name ON titles (name)",
+    """CREATE TABLE copies
+       (id INTEGER PRIMARY KEY AUTOINCREMENT, title_id INTEGER NOT NULL REFERENCES titles (id),
+        serial_no TEXT, status TEXT DEFAULT 'Available', cost REAL, procurement_date DATE)""",
+    # Per-title counts are covered by this index
+    "CREATE INDEX idx_copies_title ON copies (title_id, status)",
+    # Matches the COALESCE(status, 'Available') filter used by the Issue flow
+    "CREATE INDEX idx_copies_status ON copies (COALESCE(status, 'Available'), serial_no)",
+]
+
+COMPAT_SCHEMA = [
+    """CREATE VIEW products AS
+       SELECT c.id, t.type, t.name, t.author, t.category, c.status, c.cost, c.procurement_date, c.serial_no,
+              c.title_id
+       FROM copies c JOIN titles t ON t.id = c.title_id""",
+    f"""CREATE TRIGGER products_insert INSTEAD OF INSERT ON products BEGIN
+            INSERT OR IGNORE INTO titles (type, name, author, category)
+            VALUES (new.type, new.name, new.author, new.category);
+            INSERT INTO copies (id, title_id, serial_no, status, cost, procurement_date)
+            VALUES (new.id, {_SPLIT_NEW_TITLE}, new.serial_no, COALESCE(new.status, 'Available'), new.cost,
+                    new.procurement_date);
+        END""",
+    # Changing a copy's type, name, author or category moves it to that title
+    f"""CREATE TRIGGER products_update INSTEAD OF UPDATE ON products BEGIN
+            INSERT OR IGNORE INTO titles (type, name, author, category)
+            VALUES (new.type, new.name, new.author, new.category);
+            UPDATE copies SET id = new.id, title_id = {_SPLIT_NEW_TITLE}, serial_no = new.serial_no,
+                              status = new.status, cost = new.cost, procurement_date = new.procurement_date
+            WHERE id = old.id;
+            DELETE FROM titles WHERE id = old.title_id AND NOT EXISTS (SELECT 1 FROM copies WHERE title_id = old.title_id);
+        END""",
+    """CREATE TRIGGER products_delete INSTEAD OF DELETE ON products BEGIN
+           DELETE FROM copies WHERE id = old.id;
+           DELETE FROM titles WHERE id = old.title_id AND NOT EXISTS (SELECT 1 FROM copies WHERE title_id = old.title_id);
+       END""",
+]
+
+
+def split_products(conn):
+    """Migration step: move the products table into titles and copies, behind a products view.
+
+    Copies keep their product ids, so issues.product_id and holds still point
+    at them.  The products table's triggers and indexes go with it; the
+    modules that had them recreate theirs on titles and copies.
+    """
+    for stmt in SPLIT_SCHEMA:
+        conn.execute(stmt)
+    key = ", ".join(f"COALESCE({col}, '')" for col in _SPLIT_KEY)
+    conn.execute(f"""INSERT INTO titles (type, name, author, category)
+                     SELECT type, name, author, category FROM products GROUP BY {key} ORDER BY MIN(id)""")
+    conn.execute(f"""INSERT INTO copies (id, title_id, serial_no, status, cost, procurement_date)
+                     SELECT p.id, t.id, p.serial_no, p.status, p.cost, p.procurement_date
+                     FROM products p JOIN titles t ON {_same_title((f't.{col}', f'p.{col}') for col in _SPLIT_KEY)}""")
+    # Ids of deleted products are not handed out again
+    conn.execute("""UPDATE sqlite_sequence
+                    SET seq = MAX(seq, COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'products'), 0))
+                    WHERE name = 'copies'""")
+    # Older files (created before serial_no was UNIQUE) can hold duplicates
+    duplicated = conn.execute("SELECT 1 FROM copies GROUP BY serial_no HAVING COUNT(*) > 1 LIMIT 1").fetchone()
+    conn.execute(f"CREATE {'' if duplicated else 'UNIQUE '}INDEX idx_copies_serial ON copies (serial_no)")
+    conn.execute("DROP TABLE products")
+    for stmt in COMPAT_SCHEMA:
+        conn.execute(stmt)
+    # Planner statistics for the new tables (the products ones went with it)
+    conn.execute("ANALYZE titles")
+    conn.execute("ANALYZE copies")
+
+
+# ────────────────────────────────────────────────
+# Migration 12: integer codes for type, category and status
+# ────────────────────────────────────────────────
+# (lookup table, products column) of the coded names
+_NAMES = (('item_types', 'type'), ('categories', 'category'), ('copy_statuses', 'status'))
+
+# Ids of the names written through the products view
+_NEW_IDS = {'type_id': lookup_sql('item_types', 'new.type'), 'name': 'new.name', 'author': 'new.author',
+            'category_id': lookup_sql('categories', 'new.category')}
+_NEW_TITLE = f"(SELECT id FROM titles WHERE {_same_title((col, _NEW_IDS[col]) for col in TITLE_KEY)})"
+_NEW_STATUS = f"COALESCE({lookup_sql('copy_statuses', 'new.status')}, {AVAILABLE})"
+
+# Names the products view has not seen before get their lookup row first
+_ADD_NAMES = "\n".join(f"INSERT OR IGNORE INTO {table} (name) SELECT new.{col} WHERE new.{col} IS NOT NULL;"
+                       for table, col in _NAMES)
+_ADD_TITLE = f"""INSERT OR IGNORE INTO titles (type_id, name, author, category_id)
+                 VALUES ({_NEW_IDS['type_id']}, new.name, new.author, {_NEW_IDS['category_id']});"""
+
+CODED_SCHEMA = [
+    "CREATE UNIQUE INDEX idx_titles_key ON titles (" + ", ".join(f"COALESCE({col}, '')" for col in TITLE_KEY) + ")",
+    # Master lists filter on type and sort on name
+    "CREATE INDEX idx_titles_type_name ON titles (type_id, name)",
+    # Per-title counts are covered by this index
+    "CREATE INDEX idx_copies_title ON copies (title_id, status_id)",
+    "CREATE INDEX idx_copies_status ON copies (status_id, serial_no)",
+    # Writes go through the names; the id columns are there for filters.  The
+    # names are subqueries rather than joins, so they are only looked up for
+    # the rows a query returns, not for every row it sorts
+    f"""CREATE VIEW products AS
+        SELECT c.id, {name_sql('item_types', 't.type_id')} AS type, t.name, t.author,
+               {name_sql('categories', 't.category_id')} AS category, {name_sql('copy_statuses', 'c.status_id')} AS status,
+               c.cost, c.procurement_date, c.serial_no, c.title_id, t.type_id, t.category_id, c.status_id
+        FROM copies c JOIN titles t ON t.id = c.title_id""",
+    f"""CREATE VIEW catalog_titles AS
+        SELECT t.id, {name_sql('item_types', 't.type_id')} AS type, t.name, t.author,
+               {name_sql('categories', 't.category_id')} AS category, t.type_id, t.category_id
+        FROM titles t""",
+    f"""CREATE TRIGGER products_insert INSTEAD OF INSERT ON products BEGIN
+            {_ADD_NAMES}
+            {_ADD_TITLE}
+            INSERT INTO copies (id, title_id, serial_no, status_id, cost, procurement_date)
+            VALUES (new.id, {_NEW_TITLE}, new.serial_no, {_NEW_STATUS}, new.cost, new.procurement_date);
+        END""",
+    # Changing a copy's type, name, author or category moves it to that title
+    f"""CREATE TRIGGER products_update INSTEAD OF UPDATE ON products BEGIN
+            {_ADD_NAMES}
+            {_ADD_TITLE}
+            UPDATE copies SET id = new.id, title_id = {_NEW_TITLE}, serial_no = new.serial_no,
+                              status_id = {_NEW_STATUS}, cost = new.cost, procurement_date = new.procurement_date
+            WHERE id = old.id;
+            DELETE FROM titles WHERE id = old.title_id AND NOT EXISTS (SELECT 1 FROM copies WHERE title_id = old.title_id);
+        END""",
+    """CREATE TRIGGER products_delete INSTEAD OF DELETE ON products BEGIN
+           DELETE FROM copies WHERE id = old.id;
+           DELETE FROM titles WHERE id = old.title_id AND NOT EXISTS (SELECT 1 FROM copies WHERE title_id = old.title_id);
+       END""",
+]
+
+
+def encode_columns(conn):
+    """Migration step: titles.type and category, copies.status become lookup ids.
+
+    The products view, the indexes on those columns and every trigger on
+    titles and copies go first (the modules that had triggers recreate
+    theirs); the view comes back with the names joined in.
+    """
+    conn.execute("DROP VIEW products")
+    for (name,) in conn.execute("""SELECT name FROM sqlite_master
+                                   WHERE type = 'trigger' AND tbl_name IN ('titles', 'copies')""").fetchall():
+        conn.execute(f"DROP TRIGGER {name}")
+    for index in ('idx_titles_key', 'idx_titles_type_name', 'idx_copies_title', 'idx_copies_status'):
+        conn.execute(f"DROP INDEX {index}")
+    # Names in order of first use
+    for table, source, col in (('item_types', 'titles', 'type'), ('categories', 'titles', 'category'),
+                               ('copy_statuses', 'copies', 'status')):
+        conn.execute(f"""INSERT OR IGNORE INTO {table} (name)
+                         SELECT {col} FROM {source} WHERE {col} IS NOT NULL GROUP BY {col} ORDER BY MIN(id)""")
+    conn.execute("ALTER TABLE titles ADD COLUMN type_id INTEGER")
+    conn.execute("ALTER TABLE titles ADD COLUMN category_id INTEGER")
+    # Copies with no status have always counted as Available
+    conn.execute(f"ALTER TABLE copies ADD COLUMN status_id INTEGER NOT NULL DEFAULT {AVAILABLE}")
+    conn.execute("UPDATE titles SET type_id = ty.id FROM item_types ty WHERE ty.name = titles.type")
+    conn.execute("UPDATE titles SET category_id = cat.id FROM categories cat WHERE cat.name = titles.category")
+    conn.execute("UPDATE copies SET status_id = s.id FROM copy_statuses s WHERE s.name = copies.status")
+    # The view is back before the names go: DROP COLUMN re-checks every
+    # trigger, and those on issues read products
+    for stmt in CODED_SCHEMA:
+        conn.execute(stmt)
+    for table, col in (('titles', 'type'), ('titles', 'category'), ('copies', 'status')):
+        conn.execute(f"ALTER TABLE {table} DROP COLUMN {col}")
+    conn.execute("ANALYZE titles")
+    conn.execute("ANALYZE copies")
+
+
+def serial_prefix(category_code, type_code):
+    return f"{category_code}{type_code}" if PREFIXED_SERIALS else GLOBAL_COUNTER
+
+
+def format_serial(prefix, n):
+    return f"{prefix}{n:06d}" if prefix else f"{n:02d}"
+
+
+def allocate_serials(conn, qty, prefix=GLOBAL_COUNTER):
+    """Reserve qty consecutive serial numbers and return the first one.
+
+    Must run inside a write (IMMEDIATE) transaction.
+    """
+    c = conn.execute("UPDATE serial_counters SET last_value = last_value + ? WHERE prefix = ?", (qty, prefix))
+    if c.rowcount == 0:
+        # First item under this prefix: continue after any existing serials
+        c = conn.execute("""SELECT COALESCE(MAX(CAST(substr(serial_no, ?) AS INTEGER)), 0)
+                            FROM copies WHERE serial_no LIKE ? || '%'""", (len(prefix) + 1, prefix))
+        conn.execute("INSERT INTO serial_counters (prefix, last_value) VALUES (?, ?)",
+                     (prefix, c.fetchone()[0] + qty))
+    last = conn.execute("SELECT last_value FROM serial_counters WHERE prefix = ?", (prefix,)).fetchone()[0]
+    return last - qty + 1
+
+
+def add_copies(conn, ptype, name, author, category, cost, proc_date, qty, prefix=GLOBAL_COUNTER):
+    """Add qty copies of an item in one transaction; returns (first, last) serial."""
+    def work(conn):
+        first = allocate_serials(conn, qty, prefix)
+        serials = [format_serial(prefix, n) for n in range(first, first + qty)]
+        insert_copies(conn, [(ptype, name, author, category, cost, proc_date, s) for s in serials])
+        return serials[0], serials[-1]
+    return transaction(conn, work)
@@ -0,0 +1,299 @@
+"""Circulation service: issue, return and fine payment for both apps.
+
+Every write is a short IMMEDIATE transaction run through db.transaction(),
+which retries with backoff when another desk holds the write lock.  Inside
+it, availability is re-checked by the write itself: a copy is only marked
+Issued WHERE it is still Available, and a loan only closed WHERE it is still
+open, and the row counts are checked, so two desks can never issue the same
+copy or return the same loan twice.  No lock is held between the desk's
+lookup and its confirmation.
+
+Batch issue/return is meant for barcode-scanner checkout at the desk: serials
+are scanned one after another, then the cart is validated with one query,
+written with executemany(), and every serial gets its own outcome, so one
+bad scan does not hold up the rest of the cart.  The single-item calls are
+a cart of one.
+
+Due dates, loan limits and late fines follow the loan policy (policy.py):
+the cart's lookup query brings each item's type and category and the
+member's tier, and the terms come from the policy's in-memory table.
+Before a cart is issued the member's eligibility (memberships.py) is read
+in one primary-key lookup: an Inactive or expired member is refused, and
+the open loan count and fine balance it brings are checked against each
+item's max_loans and max_owed.
+"""
+import re
+
+import fines
+import holds
+import memberships
+import policy
+from codes import AVAILABLE, ISSUED, ON_HOLD, name_sql
+from days import day_number, day_text
+from db import Conflict, transaction
+from errors import NotFound, Unavailable
+from fines import post_many
+
+# Lookups are chunked to stay under SQLite's variable limit
+LOOKUP_CHUNK = 500
+
+# Outcome messages for serials that do not exist / have no open loan
+NOT_FOUND = "not found"
+NO_LOAN = "no active issue found"
+
+# Open loan i of copy p to member m, with the names its policy is looked up by and the member's balance
+_OPEN_LOAN_SQL = f"""SELECT p.serial_no, i.id, p.id, i.member_id, p.name, i.return_day, i.fine_accrued,
+                            p.type, p.category, {name_sql('member_tiers', 'm.tier_id')}, COALESCE(m.pending_fine, 0)
+                     FROM issues i JOIN products p ON i.product_id = p.id
+                     LEFT JOIN members m ON m.id = i.member_id"""
+
+
+class BatchResult:
+    def __init__(self, action):
+        self.action = action
+        self.outcomes = []       # (serial, ok, message) in scan order
+        self.fines = {}          # member_id -> fine added by this batch
+        self.items = {}          # serial -> details of each processed item
+        self.due = {}            # serial -> due date of each issued item
+        self.held = {}           # serial -> member the returned copy is now held for
+        self.member_name = None
+
+    @property
+    def done(self):
+        return sum(1 for _, ok, _ in self.outcomes if ok)
+
+    @property
+    def failed(self):
+        return len(self.outcomes) - self.done
+
+    @property
+    def total_fine(self):
+        return sum(self.fines.values())
+
+    def summary(self):
+        text = f"{self.done} item(s) {self.action}, {self.failed} not processed"
+        if self.total_fine > 0:
+            text += f", late fines ₹{self.total_fine:.2f}"
+        elif self.total_fine < 0:
+            # Returned before the date the nightly job had accrued up to
+            text += f", ₹{-self.total_fine:.2f} of accrued fines credited back"
+        if self.held:
+            text += f", {len(self.held)} held for waiting members"
+        return text
+
+
+def parse_serials(text):
+    """Serials from scanner input: one per line, or separated by spaces/commas."""
+    return [s for s in re.split(r"[\s,;]+", text) if s]
+
+
+def _lookup(conn, sql, serials, params=()):
+    # sql has one {} for the IN list of serials, after any other parameters
+    rows = []
+    for i in range(0, len(serials), LOOKUP_CHUNK):
+        chunk = serials[i:i + LOOKUP_CHUNK]
+        rows.extend(conn.execute(sql.format(','.join('?' * len(chunk))), list(params) + chunk))
+    return rows
+
+
+def _record(result, serials, outcome):
+    # Outcomes in scan order; a serial scanned twice is only processed once
+    seen = set()
+    for serial in serials:
+        if serial in seen:
+            result.outcomes.append((serial, False, "scanned twice, ignored"))
+        else:
+            seen.add(serial)
+            result.outcomes.append((serial,) + outcome[serial])
+
+
+def _single(result):
+    serial, ok, message = result.outcomes[0]
+    if not ok:
+        raise (NotFound if message in (NOT_FOUND, NO_LOAN) else Unavailable)(f"Serial {serial}: {message}.")
+    return result.items[serial]
+
+
+# ────────────────────────────────────────────────
+# Transaction bodies (run inside db.transaction)
+# ────────────────────────────────────────────────
+def _issue(conn, member_id, serials, issue_date, return_date, remarks):
+    result = BatchResult("issued")
+    unique = list(dict.fromkeys(serials))
+    outcome = {}
+    member = memberships.eligibility(conn, member_id)
+    if not member:
+        raise NotFound(f"Member ID {member_id} not found.")
+    # A return date given by the desk overrides the policy's loan length
+    issue_day, return_day = day_number(issue_date), day_number(return_date)
+    refused = memberships.refusal(member, issue_day)
+    if refused:
+        raise Unavailable(f"Member {member_id}: {refused}.")
+    # The apps pass the id as typed; holds and loans compare the stored integer
+    member_id = member.member_id
+    tier, open_loans, owed = member.tier, member.open_loans, member.pending_fine
+    result.member_name = member.name
+    found = {}
+    rows = _lookup(conn, """SELECT serial_no, id, status_id, status, name, type, category
+                            FROM products WHERE serial_no IN ({})""", unique)
+    for serial, pid, status_id, status, name, ptype, category in rows:
+        # Older databases can hold a serial twice; prefer the copy on the shelf
+        if serial not in found or status_id == AVAILABLE:
+            found[serial] = (pid, status_id, status, name, ptype, category)
+    issues, ids = [], []
+    for serial in unique:
+        if serial not in found:
+            outcome[serial] = (False, NOT_FOUND)
+            continue
+        pid, status_id, status, name, ptype, category = found[serial]
+        if status_id == ON_HOLD and holds.held_for(conn, pid) != member_id:
+            outcome[serial] = (False, f"{name} is on hold for another member")
+            continue
+        if status_id not in (AVAILABLE, ON_HOLD):
+            outcome[serial] = (False, f"{name} is {status}")
+            continue
+        terms = policy.lookup(ptype, category, tier)
+        if terms.max_loans is not None and open_loans >= terms.max_loans:
+            outcome[serial] = (False, f"member has {open_loans} item(s) out, the limit for {name}")
+            continue
+        if terms.max_owed is not None and owed > terms.max_owed:
+            outcome[serial] = (False, f"member owes ₹{owed:.2f}, more than the limit for {name}")
+            continue
+        due_day = return_day if return_date else issue_day + terms.loan_days
+        due = return_date or day_text(due_day)
+        issues.append((pid, member_id, issue_date, due, issue_day, due_day, remarks))
+        ids.append((pid, status_id))
+        open_loans += 1
+        result.items[serial] = (pid, name)
+        result.due[serial] = due
+        outcome[serial] = (True, f"{name} issued, due {due}")
+    # Claim the copies first: only those still in the state just checked are updated
+    c = conn.executemany(f"UPDATE copies SET status_id = {ISSUED} WHERE id = ? AND status_id = ?", ids)
+    if c.rowcount != len(ids):
+        raise Conflict("a copy was issued by another desk")
+    conn.executemany("""INSERT INTO issues (product_id, member_id, issue_date, return_date, issue_day, return_day, remarks)
+                        VALUES (?,?,?,?,?,?,?)""", issues)
+    holds.collected(conn, member_id, result.items.values(), issue_date)
+    _record(result, serials, outcome)
+    return result
+
+
+def _return(conn, serials, return_date, remarks):
+    result = BatchResult("returned")
+    unique = list(dict.fromkeys(serials))
+    outcome = {}
+    # Everything the cart's fines are computed from comes out of the same query
+    found = {}
+    return_day = day_number(return_date)
+    for row in _lookup(conn, _OPEN_LOAN_SQL + " WHERE p.serial_no IN ({}) AND i.actual_return_date IS NULL",
+                       unique):
+        found.setdefault(row[0], row[1:])
+    issues, ids, charges = [], [], []
+    for serial in unique:
+        if serial not in found:
+            outcome[serial] = (False, NO_LOAN)
+            continue
+        issue_id, pid, member_id, name, due_day, accrued, ptype, category, tier, _ = found[serial]
+        late = None if due_day is None else return_day - due_day
+        fine = policy.fine(policy.lookup(ptype, category, tier), late)
+        issues.append((return_date, return_day, fine, remarks, issue_id))
+        ids.append((pid, name))
+        # Only the part of a fine not already accrued by the nightly job is billed now
+        result.items[serial] = (issue_id, member_id, name, fine, fine - accrued)
+        if fine != accrued and member_id is not None:
+            result.fines[member_id] = result.fines.get(member_id, 0.0) + fine - accrued
+            charges.append((member_id, issue_id, return_date, 'return', fine - accrued))
+        if fine > 0:
+            outcome[serial] = (True, f"{name} returned, late fine ₹{fine:.2f}"
+                                     + (f" (₹{accrued:.2f} already accrued)" if accrued else ""))
+        else:
+            outcome[serial] = (True, f"{name} returned on time")
+    # Close only loans that are still open
+    c = conn.executemany("""UPDATE issues SET actual_return_date = ?, actual_return_day = ?, fine_amount = ?, remarks = ?
+                            WHERE id = ? AND actual_return_date IS NULL""", issues)
+    if c.rowcount != len(issues):
+        raise Conflict("a loan was returned by another desk")
+    # Copies someone is waiting for go on hold for them, the rest back on the shelf
+    held = holds.route(conn, ids, return_date)
+    conn.executemany(f"UPDATE copies SET status_id = {AVAILABLE} WHERE id = ?",
+                     [(pid,) for pid, _ in ids if pid not in held])
+    post_many(conn, charges)
+    for serial in result.items:
+        pid = found[serial][1]
+        if pid in held:
+            result.held[serial] = held[pid]
+            ok, message = outcome[serial]
+            outcome[serial] = (ok, f"{message}; held for member {held[pid]}")
+    _record(result, serials, outcome)
+    return result
+
+
+# ────────────────────────────────────────────────
+# Service calls (each commits its own transaction)
+# ────────────────────────────────────────────────
+def issue_batch(conn, member_id, serials, issue_date, return_date=None, remarks=""):
+    """Issue every available serial to member_id; returns a BatchResult.
+
+    Each item is due on return_date, or if that is None after its loan
+    policy's loan_days (the due dates are in result.due).  Items past the
+    member's loan or fine limit are not issued.  Raises NotFound if the
+    member does not exist, Unavailable if their membership is Inactive or
+    ended before issue_date.
+    """
+    return transaction(conn, _issue, member_id, serials, issue_date, return_date, remarks)
+
+
+def return_batch(conn, serials, return_date, remarks=""):
+    """Return every serial with an open loan, billing late fines; returns a BatchResult."""
+    return transaction(conn, _return, serials, return_date, remarks)
+
+
+def issue_item(conn, serial, member_id, issue_date, return_date=None, remarks=""):
+    """Issue one copy; returns (item name, member name, due date).
+
+    The due date is return_date, or if that is None the loan policy's.
+    Raises NotFound if the member or serial does not exist, Unavailable if
+    the copy is not on the shelf (or is held for someone else), the member's
+    membership is Inactive or expired, or they are at their loan or fine
+    limit.
+    """
+    result = issue_batch(conn, member_id, [serial], issue_date, return_date, remarks)
+    return _single(result)[1], result.member_name, result.due[serial]
+
+
+def return_item(conn, serial, return_date, remarks="", payment=0):
+    """Return one copy, bill its late fine and optionally take a payment.
+
+    The return and the payment commit together.  Returns (item name, late
+    fine, amount billed now, member's balance afterwards, member the copy is
+    now held for or None).  Raises NotFound if the serial has no open loan,
+    InvalidInput if the payment exceeds the balance.
+    """
+    def work(conn):
+        result = _return(conn, [serial], return_date, remarks)
+        # Raising here rolls the return back
+        issue_id, member_id, name, fine, billed = _single(result)
+        # The payment is taken against the balance as it is after this return's fine
+        balance = fines.pay(conn, member_id, payment) if payment else fines.balance(conn, member_id)
+        return name, fine, billed, balance, result.held.get(serial)
+    return transaction(conn, work)
+
+
+def preview_return(conn, serial, return_date):
+    """What return_item() would bill, without writing anything.
+
+    Returns (item name, member_id, late fine, already accrued, member's
+    current balance); raises NotFound if the serial has no open loan.
+    """
+    row = conn.execute(_OPEN_LOAN_SQL + " WHERE p.serial_no = ? AND i.actual_return_date IS NULL",
+                       (serial,)).fetchone()
+    if not row:
+        raise NotFound(f"Serial {serial}: {NO_LOAN}.")
+    _, _, _, member_id, name, due_day, accrued, ptype, category, tier, balance = row
+    late = None if due_day is None else day_number(return_date) - due_day
+    return name, member_id, policy.fine(policy.lookup(ptype, category, tier), late), accrued, balance
+
+
+def pay_fine(conn, member_id, amount):
+    """Take a payment; returns the remaining balance (errors as fines.pay)."""
+    return transaction(conn, fines.pay, member_id, amount)
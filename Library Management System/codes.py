@@ -0,0 +1,71 @@
+"""Small-integer codes for the enumerated columns.
+
+A title's type and category, a copy's status and a member's status are each
+one of a handful of names.  The names are stored once, in lookup tables
+(item_types, categories, copy_statuses, member_statuses - id, name), and
+rows hold the id: titles.type_id and category_id, copies.status_id and
+members.status_id.  Filters compare small integers over small indexes.
+
+Reads written against the names keep working: the products view (and
+catalog_titles, its per-title counterpart) join the names back in, and
+members.status is a virtual column computed from status_id.  Statuses have
+fixed ids (below), so writers set them without a lookup; a type or category
+gets its id the first time it is used (code()).
+"""
+
+AVAILABLE, ISSUED, ON_HOLD = 1, 2, 3
+COPY_STATUSES = {AVAILABLE: 'Available', ISSUED: 'Issued', ON_HOLD: 'On Hold'}
+
+ACTIVE, INACTIVE = 1, 2
+MEMBER_STATUSES = {ACTIVE: 'Active', INACTIVE: 'Inactive'}
+
+LOOKUPS = ('item_types', 'categories', 'copy_statuses', 'member_statuses')
+
+
+def create_lookups(conn):
+    """Migration step: the lookup tables, with the fixed statuses."""
+    for table in LOOKUPS:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+    conn.executemany("INSERT OR IGNORE INTO copy_statuses (id, name) VALUES (?, ?)", COPY_STATUSES.items())
+    conn.executemany("INSERT OR IGNORE INTO member_statuses (id, name) VALUES (?, ?)", MEMBER_STATUSES.items())
+
+
+def lookup_sql(table, name):
+    """SQL for the id of the name expression `name` in a lookup table (NULL if it has none)."""
+    return f"(SELECT id FROM {table} WHERE name = {name})"
+
+
+def name_sql(table, id):
+    """SQL for the name of the id expression `id` in a lookup table."""
+    return f"(SELECT name FROM {table} WHERE id = {id})"
+
+
+def code(conn, table, name):
+    """Id of name in a lookup table, added if it is new (inside a write transaction); None for None."""
+    if name is None:
+        return None
+    row = conn.execute(f"SELECT id FROM {table} WHERE name = ?", (name,)).fetchone()
+    if row:
+        return row[0]
+    return conn.execute(f"INSERT INTO {table} (name) VALUES (?)", (name,)).lastrowid
+
+
+def _quote(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+def encode_members(conn):
+    """Migration step: members.status becomes status_id, and status a virtual column over it.
+
+    A generated column cannot look the name up, so it spells out every
+    status known at this point - the fixed ones and any other name found in
+    the table.
+    """
+    conn.execute("""INSERT OR IGNORE INTO member_statuses (name)
+                    SELECT status FROM members WHERE status IS NOT NULL GROUP BY status ORDER BY MIN(id)""")
+    conn.execute("ALTER TABLE members ADD COLUMN status_id INTEGER")
+    conn.execute("UPDATE members SET status_id = s.id FROM member_statuses s WHERE s.name = members.status")
+    conn.execute("ALTER TABLE members DROP COLUMN status")
+    names = " ".join(f"WHEN {i} THEN {_quote(name)}"
+                     for i, name in conn.execute("SELECT id, name FROM member_statuses ORDER BY id"))
+    conn.execute(f"ALTER TABLE members ADD COLUMN status TEXT GENERATED ALWAYS AS (CASE status_id {names} END) VIRTUAL")
@@ -0,0 +1,100 @@
+"""Integer day numbers beside the ISO date columns.
+
+Dates are stored as ISO text (YYYY-MM-DD).  Those that loans and fines are
+computed from also have an integer twin holding the day number (days since
+1970-01-01):
+
+  issues    issue_date -> issue_day, return_date (due) -> return_day,
+            actual_return_date -> actual_return_day
+  members   start_date -> start_day, end_date -> end_day
+
+Triggers set the day numbers from the text whenever an insert or update
+leaves them out of step, so a writer may write just the dates; circulation
+writes both, which saves the triggers' second write.  Days overdue and fines
+are then integer subtraction instead of julianday() calls, and the index of
+open loans by due date carries return_day, so they are computed from the
+index without reading the loan rows.
+"""
+from datetime import date
+
+# Ordinal and julian day of day 0, 1970-01-01
+_EPOCH = date(1970, 1, 1).toordinal()
+_EPOCH_JULIAN = 2440587.5
+
+# table -> [(date column, day column)]
+COLUMNS = {
+    'issues': [('issue_date', 'issue_day'), ('return_date', 'return_day'),
+               ('actual_return_date', 'actual_return_day')],
+    'members': [('start_date', 'start_day'), ('end_date', 'end_day')],
+}
+
+INDEXES = [
+    # The open loans by due date (migration 1), now with the due day: Active
+    # Issues, Overdue and the nightly accrual sort and filter on return_date
+    "DROP INDEX IF EXISTS idx_issues_open_due",
+    """CREATE INDEX idx_issues_open_due
+       ON issues (return_date, product_id, member_id, issue_date, return_day)
+       WHERE actual_return_date IS NULL""",
+    # Memberships ending before a day
+    "CREATE INDEX IF NOT EXISTS idx_members_end_day ON members (end_day)",
+]
+
+
+def day_sql(expr):
+    """SQL for the day number of a date expression (NULL if it is not a date)."""
+    return f"CAST(julianday({expr}) - {_EPOCH_JULIAN} AS INTEGER)"
+
+
+def day_number(value):
+    """Day number of a YYYY-MM-DD string (anything after the date is ignored) or a date; None for None."""
+    if value is None:
+        return None
+    if not isinstance(value, date):
+        value = date.fromisoformat(str(value)[:10])
+    return value.toordinal() - _EPOCH
+
+
+def day_text(number):
+    """YYYY-MM-DD of a day number."""
+    return date.fromordinal(number + _EPOCH).isoformat()
+
+
+def _assign(columns, row=None):
+    prefix = f"{row}." if row else ""
+    return ", ".join(f"{day} = {day_sql(prefix + column)}" for column, day in columns)
+
+
+def _triggers(table):
+    columns = COLUMNS[table]
+    dates = ", ".join(column for column, _ in columns)
+    stale = " OR ".join(f"new.{day} IS NOT {day_sql('new.' + column)}" for column, day in columns)
+    return [f"""CREATE TRIGGER IF NOT EXISTS days_{table}_ai AFTER INSERT ON {table} WHEN {stale} BEGIN
+                    UPDATE {table} SET {_assign(columns, 'new')} WHERE id = new.id;
+                END""",
+            f"""CREATE TRIGGER IF NOT EXISTS days_{table}_au AFTER UPDATE OF {dates} ON {table} WHEN {stale} BEGIN
+                    UPDATE {table} SET {_assign(columns, 'new')} WHERE id = new.id;
+                END"""]
+
+
+def _fill(conn, table, columns):
+    existing = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+    for _, day in columns:
+        if day not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {day} INTEGER")
+    conn.execute(f"UPDATE {table} SET {_assign(columns)}")
+
+
+def create_columns(conn):
+    """Migration step: the day-number columns, filled from the dates, their triggers and indexes."""
+    for table, columns in COLUMNS.items():
+        _fill(conn, table, columns)
+        for stmt in _triggers(table):
+            conn.execute(stmt)
+    # Archive partitions have the columns of issues (archive.py copies them all)
+    for (table,) in conn.execute("SELECT table_name FROM loan_archives").fetchall():
+        _fill(conn, table, COLUMNS['issues'])
+    for stmt in INDEXES:
+        conn.execute(stmt)
+    # Without statistics the planner would pass over the rebuilt index
+    conn.execute("ANALYZE idx_issues_open_due")
+    conn.execute("ANALYZE idx_members_end_day")
@@ -0,0 +1,209 @@
+"""Shared SQLite data-access layer for the console and Streamlit apps.
+
+Connections come from a per-database pool instead of being opened and torn
+down for every statement.  Pooled connections stay open, so SQLite's page
+cache and the sqlite3 module's compiled-statement cache survive between calls.
+Every statement they run is timed and counted by instrument.py.
+"""
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import instrument
+
+# Database file; override with the LIBRARY_DB environment variable or set_db_path()
+DEFAULT_DB_PATH = 'library.db'
+
+# Idle connections kept per database file
+POOL_SIZE = 8
+
+# Compiled statements cached per connection (reused across calls)
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",       # readers never block the writer
+    "PRAGMA synchronous = NORMAL",     # safe with WAL, far fewer fsyncs
+    "PRAGMA cache_size = -20000",      # ~20 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",    # 256 MB memory-mapped reads
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",      # wait for locks instead of failing
+)
+
+# Write transactions that still find the database locked after busy_timeout
+# are retried this many times, backing off exponentially from BUSY_BACKOFF seconds
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.05
+
+_db_path = os.environ.get('LIBRARY_DB', DEFAULT_DB_PATH)
+_pools = {}
+_pools_lock = threading.Lock()
+_commits = 0
+
+
+def _committed():
+    global _commits
+    _commits += 1
+
+
+def commit_count():
+    """Transactions this process has committed through connection() / transaction()."""
+    return _commits
+
+
+def get_db_path():
+    return _db_path
+
+
+def set_db_path(path):
+    """Point get_connection() at another database file."""
+    global _db_path
+    _db_path = path
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back to its pool.
+
+    Its cursors are instrument.Cursor, so every statement is timed; the
+    shortcut execute methods go through cursor() for the same reason.
+    """
+    pool = None
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or (instrument.Cursor if instrument.ENABLED else sqlite3.Cursor))
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+
+class ConnectionPool:
+    """Thread-safe pool of open connections to one database file.
+
+    acquire() never blocks: when no idle connection is left a new one is
+    opened, and release() keeps at most `size` of them around.
+    """
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, factory=PooledConnection, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.pool = self
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        # Same semantics as closing a plain connection: uncommitted work is dropped
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = None
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            conn.pool = None
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.pool = None
+            conn.close()
+
+
+def get_pool(path=None):
+    key = os.path.abspath(path or _db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(key)
+        return pool
+
+
+def get_connection(path=None):
+    """Borrow a pooled connection; call close() on it to give it back."""
+    return get_pool(path).acquire()
+
+
+@contextmanager
+def connection(path=None):
+    """Borrow a connection, commit on success and roll back on error."""
+    conn = get_connection(path)
+    try:
+        yield conn
+        conn.commit()
+        _committed()
+    finally:
+        conn.close()
+
+
+class Conflict(Exception):
+    """A conditional write matched fewer rows than it validated; transaction() retries."""
+
+
+def _busy(e):
+    code = getattr(e, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return 'locked' in str(e) or 'busy' in str(e)
+
+
+def transaction(conn, fn, *args, **kwargs):
+    """Run fn(conn, *args, **kwargs) in a short IMMEDIATE transaction and commit.
+
+    The write lock is taken up front, so fn's reads and conditional writes
+    see no interleaved writer.  If the lock cannot be had (SQLITE_BUSY after
+    busy_timeout) or fn raises Conflict, the work is rolled back and run
+    again after a randomised exponential backoff; anything else rolls back
+    and propagates.  fn must therefore only touch the database.
+    """
+    for attempt in range(BUSY_RETRIES + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn, *args, **kwargs)
+                conn.commit()
+                _committed()
+                return result
+            except BaseException:
+                conn.rollback()
+                raise
+        except (sqlite3.OperationalError, Conflict) as e:
+            if attempt == BUSY_RETRIES or (isinstance(e, sqlite3.OperationalError) and not _busy(e)):
+                raise
+        time.sleep(BUSY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
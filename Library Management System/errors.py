@@ -0,0 +1,22 @@
+"""Errors raised by the core API and the service modules behind it.
+
+All of them are ValueErrors whose message can be shown to the user as is,
+so front ends can catch ValueError, or a subclass to react differently
+(e.g. offer "did you mean" for NotFound).
+"""
+
+
+class LibraryError(ValueError):
+    pass
+
+
+class NotFound(LibraryError):
+    """No member, item, loan or user with that key."""
+
+
+class InvalidInput(LibraryError):
+    """A missing, malformed or out-of-range argument."""
+
+
+class Unavailable(LibraryError):
+    """The record exists but is not in a state that allows the operation."""
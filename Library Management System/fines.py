@@ -0,0 +1,251 @@
+"""Fine ledger and overdue fine accrual.
+
+Every change to a member's fine balance is an entry in the append-only
+fine_ledger (accruals, fines billed at return, payments).  A trigger on the
+ledger moves members.pending_fine in the same statement, so pending_fine is
+a cached running balance that reads in O(1) and is never written with a
+read-modify-write.  reconcile() checks it against the ledger.
+
+Fines used to be computed only when an item came back.  The nightly job
+accrues them while the loan is still open: one set-based pass over the
+overdue open loans adds each loan's fine increase since the previous run to
+issues.fine_accrued, and each member's total to the ledger (one entry per
+member per run).  Returns then only bill what has not been accrued yet.
+
+A run is recorded per run date, so re-running a date does nothing, and a
+missed night is caught up by the next run (fines are recomputed from the
+due date, not added per night).  Rates and caps are the loan policy's
+(policy.py), compiled into the accrual statement.
+
+    python fines.py                     # accrue through today (run from cron)
+    python fines.py --date 2025-03-31
+    python fines.py --reconcile [--fix]
+"""
+import argparse
+import math
+import sys
+from datetime import datetime
+
+import policy
+from days import day_number
+from db import transaction
+from errors import InvalidInput, NotFound
+
+# Cached and ledger balances are sums of floats; differences below this are rounding
+EPSILON = 0.005
+
+LEDGER_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS fine_ledger
+       (id INTEGER PRIMARY KEY, member_id INTEGER NOT NULL, issue_id INTEGER, entry_date TEXT NOT NULL,
+        kind TEXT NOT NULL, amount REAL NOT NULL, created_at TEXT NOT NULL DEFAULT (datetime('now')))""",
+    "CREATE INDEX IF NOT EXISTS idx_fine_ledger_member ON fine_ledger (member_id)",
+    """CREATE TABLE IF NOT EXISTS accrual_runs
+       (run_date TEXT PRIMARY KEY, loans INTEGER NOT NULL, amount REAL NOT NULL, ran_at TEXT NOT NULL)""",
+]
+
+
+BALANCE_SCHEMA = [
+    # Opening entries, so every member's ledger adds up to the balance they already have
+    """INSERT INTO fine_ledger (member_id, entry_date, kind, amount)
+       SELECT id, date('now'), 'opening', balance FROM (
+           SELECT m.id, COALESCE(m.pending_fine, 0)
+                        - COALESCE((SELECT SUM(amount) FROM fine_ledger l WHERE l.member_id = m.id), 0) AS balance
+           FROM members m)
+       WHERE abs(balance) > 1e-9""",
+    # Covers the per-member sums of balance() and reconcile()
+    "DROP INDEX IF EXISTS idx_fine_ledger_member",
+    "CREATE INDEX IF NOT EXISTS idx_fine_ledger_balance ON fine_ledger (member_id, amount)",
+    """CREATE TRIGGER IF NOT EXISTS fine_ledger_ai AFTER INSERT ON fine_ledger BEGIN
+           UPDATE members SET pending_fine = COALESCE(pending_fine, 0) + new.amount WHERE id = new.member_id;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS fine_ledger_no_update BEFORE UPDATE ON fine_ledger BEGIN
+           SELECT RAISE(ABORT, 'fine_ledger is append-only; post a correcting entry instead');
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS fine_ledger_no_delete BEFORE DELETE ON fine_ledger BEGIN
+           SELECT RAISE(ABORT, 'fine_ledger is append-only; post a correcting entry instead');
+       END""",
+]
+
+
+def create_ledger(conn):
+    """Migration step: fine_ledger, accrual_runs and issues.fine_accrued."""
+    if 'fine_accrued' not in [r[1] for r in conn.execute("PRAGMA table_info(issues)")]:
+        conn.execute("ALTER TABLE issues ADD COLUMN fine_accrued REAL NOT NULL DEFAULT 0")
+    for stmt in LEDGER_SCHEMA:
+        conn.execute(stmt)
+
+
+def create_balances(conn):
+    """Migration step: opening entries and the balance/append-only triggers."""
+    for stmt in BALANCE_SCHEMA:
+        conn.execute(stmt)
+
+
+def _today():
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+# ────────────────────────────────────────────────
+# Balances (run inside the caller's transaction)
+# ────────────────────────────────────────────────
+def post(conn, member_id, amount, kind, issue_id=None, entry_date=None):
+    """Append a ledger entry; the member's balance moves with it."""
+    post_many(conn, [(member_id, issue_id, entry_date or _today(), kind, amount)])
+
+
+def post_many(conn, entries):
+    """Append (member_id, issue_id, entry_date, kind, amount) entries."""
+    conn.executemany("INSERT INTO fine_ledger (member_id, issue_id, entry_date, kind, amount) VALUES (?, ?, ?, ?, ?)",
+                     entries)
+
+
+def pay(conn, member_id, amount, entry_date=None):
+    """Record a payment and return the remaining balance.
+
+    The balance check and the debit are one statement, so two desks taking
+    money from the same member cannot both spend the same balance.  Raises
+    NotFound for an unknown member, InvalidInput if amount is not a positive
+    number or they owe less than it.
+    """
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        raise InvalidInput("Payment must be a number.") from None
+    if not (math.isfinite(amount) and amount > 0):
+        raise InvalidInput("Payment must be more than zero.")
+    c = conn.execute("""INSERT INTO fine_ledger (member_id, entry_date, kind, amount)
+                        SELECT id, ?, 'payment', -? FROM members
+                        WHERE id = ? AND COALESCE(pending_fine, 0) >= ? - ?""",
+                     (entry_date or _today(), amount, member_id, amount, EPSILON))
+    if c.rowcount == 0:
+        row = conn.execute("SELECT pending_fine FROM members WHERE id = ?", (member_id,)).fetchone()
+        if not row:
+            raise NotFound("Member not found.")
+        raise InvalidInput(f"Cannot pay more than pending (₹{row[0] or 0:.2f})")
+    return balance(conn, member_id)
+
+
+def balance(conn, member_id):
+    """Cached balance (members.pending_fine), or None for an unknown member."""
+    row = conn.execute("SELECT COALESCE(pending_fine, 0) FROM members WHERE id = ?", (member_id,)).fetchone()
+    return row[0] if row else None
+
+
+def reconcile(conn, fix=False):
+    """Compare every cached balance with its ledger total.
+
+    One streaming pass over members; each member's entries are summed from
+    the covering index.  Returns [(member_id, cached, ledger)] for members
+    that disagree; fix=True resets those cached balances to the ledger.
+    """
+    mismatches = []
+    for member_id, cached, total in conn.execute(
+            """SELECT m.id, COALESCE(m.pending_fine, 0),
+                      COALESCE((SELECT SUM(amount) FROM fine_ledger l WHERE l.member_id = m.id), 0)
+               FROM members m"""):
+        if abs(cached - total) > EPSILON:
+            mismatches.append((member_id, cached, total))
+    if fix and mismatches:
+        transaction(conn, lambda conn: conn.executemany(
+            """UPDATE members SET pending_fine =
+                   (SELECT COALESCE(SUM(amount), 0) FROM fine_ledger WHERE member_id = members.id)
+               WHERE id = ?""", [(m[0],) for m in mismatches]))
+    return mismatches
+
+
+# ────────────────────────────────────────────────
+# Nightly accrual
+# ────────────────────────────────────────────────
+# Fine so far of open loan i (title t, member m) on the day number :run_day
+_ACCRUED_SQL = policy.fine_sql(":run_day - i.return_day", "t.type_id", "t.category_id", "m.tier_id")
+
+
+def _accrue(conn, run_date):
+    # Loans of no member (legacy rows) have nobody to bill, and fine_ledger.member_id is NOT NULL
+    skipped = conn.execute("""SELECT COUNT(*) FROM issues
+                              WHERE actual_return_date IS NULL AND return_date < ? AND member_id IS NULL""",
+                           (run_date,)).fetchone()[0]
+    done = conn.execute("SELECT loans, amount FROM accrual_runs WHERE run_date = ?", (run_date,)).fetchone()
+    if done:
+        return done + (skipped,)
+    # Each loan's fine so far minus what earlier runs accrued.  Only the
+    # overdue part of the open-loans index is read; fines never go down,
+    # so an older run date after a newer one adds nothing.  The joins
+    # bring the policy's ids, and are left out when no rule names any.
+    conn.execute("DROP TABLE IF EXISTS temp.accrual_delta")
+    conn.execute(f"""CREATE TEMP TABLE accrual_delta AS
+                     SELECT id AS issue_id, member_id, amount FROM (
+                         SELECT i.id, i.member_id, {_ACCRUED_SQL} - i.fine_accrued AS amount
+                         FROM issues i
+                         LEFT JOIN titles t ON t.id = (SELECT title_id FROM copies WHERE id = i.product_id)
+                         LEFT JOIN members m ON m.id = i.member_id
+                         WHERE i.actual_return_date IS NULL AND i.return_date < :run AND i.member_id IS NOT NULL)
+                     WHERE amount > 0
+                     ORDER BY id""", {'run': run_date, 'run_day': day_number(run_date)})
+    # Sorted by issue id, so the loans are updated in table order
+    conn.execute("""UPDATE issues SET fine_accrued = fine_accrued + d.amount
+                    FROM accrual_delta d WHERE issues.id = d.issue_id""")
+    # The ledger trigger adds each entry to the member's balance
+    conn.execute("""INSERT INTO fine_ledger (member_id, entry_date, kind, amount)
+                    SELECT member_id, ?, 'accrual', SUM(amount) FROM accrual_delta GROUP BY member_id""",
+                 (run_date,))
+    loans, amount = conn.execute("SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM accrual_delta").fetchone()
+    conn.execute("INSERT INTO accrual_runs (run_date, loans, amount, ran_at) VALUES (?, ?, ?, datetime('now'))",
+                 (run_date, loans, amount))
+    conn.execute("DROP TABLE temp.accrual_delta")
+    return loans, amount, skipped
+
+
+def accrue(conn, run_date=None):
+    """Accrue fines on overdue open loans through run_date.
+
+    Returns (loans, amount, skipped) for the run, skipped being the overdue
+    loans left out because they have no member; a date that already ran
+    returns its recorded totals without changing anything.
+    """
+    return transaction(conn, _accrue, run_date or _today())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Accrue overdue fines on open loans, or check balances.")
+    parser.add_argument('--date', help="accrue through this date (YYYY-MM-DD, default today)")
+    parser.add_argument('--reconcile', action='store_true', help="check cached balances against the ledger")
+    parser.add_argument('--fix', action='store_true', help="with --reconcile, reset wrong balances to the ledger")
+    args = parser.parse_args(argv)
+
+    from db import get_connection
+    from api import parse_date
+    from library_management import bootstrap
+    if args.date:
+        try:
+            parse_date(args.date, "Run Date")
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+    bootstrap()
+    conn = get_connection()
+    if args.reconcile:
+        mismatches = reconcile(conn, args.fix)
+        conn.close()
+        for member_id, cached, total in mismatches[:20]:
+            print(f"  member {member_id}: balance ₹{cached:.2f}, ledger ₹{total:.2f}")
+        if len(mismatches) > 20:
+            print(f"  ... {len(mismatches) - 20} more")
+        if not mismatches:
+            print("All balances match the ledger.")
+        else:
+            print(f"{len(mismatches)} balance(s) {'reset to the ledger' if args.fix else 'differ from the ledger'}.")
+        return 1 if mismatches and not args.fix else 0
+    start = datetime.now()
+    loans, amount, skipped = accrue(conn, args.date)
+    conn.close()
+    print(f"{args.date or start.strftime('%Y-%m-%d')}: ₹{amount:.2f} accrued on {loans} overdue loan(s) "
+          f"in {(datetime.now() - start).total_seconds():.1f}s")
+    if skipped:
+        print(f"Skipped {skipped} overdue loan(s) with no member; they accrue nothing until one is recorded.",
+              file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
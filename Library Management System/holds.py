@@ -0,0 +1,260 @@
+"""Hold queue: members wait in line for a title, on the requests table.
+
+A request is one member waiting for one title (product_name).  Waiting
+requests form a FIFO queue per title, ordered by (requested_date, id) in a
+partial index that only covers unfulfilled requests, so the next member in
+line is one index seek and a queue position is one range count.
+
+When a copy comes back and someone is waiting, the return routes it in the
+same transaction: the copy is marked On Hold, and the request is fulfilled
+with the copy's product_id.  Only that member can then be issued the copy.
+Holds that are not collected within HOLD_DAYS are passed to the next member
+in line, or put back on the shelf, by expire().
+
+Wait estimates come from the title's copies and their open loans (due
+dates and loan lengths, else the loan policy's), never from the loan history.
+
+    python holds.py "Title"                  # waiting list with estimated dates
+    python holds.py --expire [--date D]      # release uncollected holds (run from cron)
+"""
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+import policy
+from codes import AVAILABLE, ON_HOLD
+from days import day_number, day_text
+from db import transaction
+from errors import InvalidInput, NotFound
+
+# Days a member has to collect a held copy
+HOLD_DAYS = 7
+
+
+def create_queue(conn):
+    """Migration step: requests.product_id and the queue indexes."""
+    if 'product_id' not in [r[1] for r in conn.execute("PRAGMA table_info(requests)")]:
+        conn.execute("ALTER TABLE requests ADD COLUMN product_id INTEGER")
+    # Next in line / queue position per title, waiting requests only
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_requests_queue
+                    ON requests (product_name, requested_date, id) WHERE fulfilled_date IS NULL""")
+    # held_for(): the hold on a copy
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_requests_held
+                    ON requests (product_id, fulfilled_date) WHERE product_id IS NOT NULL""")
+
+
+def _today():
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+# ────────────────────────────────────────────────
+# Routing (run inside the caller's transaction)
+# ────────────────────────────────────────────────
+def next_in_line(conn, title):
+    """(request_id, member_id) of the first member waiting for title, or None."""
+    return conn.execute("""SELECT id, member_id FROM requests
+                           WHERE product_name = ? AND fulfilled_date IS NULL
+                           ORDER BY requested_date, id LIMIT 1""", (title,)).fetchone()
+
+
+def route(conn, copies, hold_date):
+    """Hold each returned copy for the next member waiting for its title.
+
+    copies is [(product_id, title)]; returns {product_id: member_id} for the
+    copies now On Hold.  The rest are left for the caller to shelve.
+    """
+    held = {}
+    for pid, title in copies:
+        waiting = next_in_line(conn, title)
+        if waiting:
+            conn.execute("UPDATE requests SET fulfilled_date = ?, product_id = ? WHERE id = ?",
+                         (hold_date, pid, waiting[0]))
+            conn.execute(f"UPDATE copies SET status_id = {ON_HOLD} WHERE id = ?", (pid,))
+            held[pid] = waiting[1]
+    return held
+
+
+def held_for(conn, product_id):
+    """Member the copy was last held for (meaningful while it is On Hold)."""
+    row = conn.execute("""SELECT member_id FROM requests WHERE product_id = ?
+                          ORDER BY fulfilled_date DESC, id DESC LIMIT 1""", (product_id,)).fetchone()
+    return row[0] if row else None
+
+
+def collected(conn, member_id, issued, issue_date):
+    """Close the member's waiting requests for titles they have just been issued.
+
+    issued is [(product_id, title)].
+    """
+    conn.executemany("""UPDATE requests SET fulfilled_date = ?, product_id = ?
+                        WHERE member_id = ? AND product_name = ? AND fulfilled_date IS NULL""",
+                     [(issue_date, pid, member_id, title) for pid, title in issued])
+
+
+def _fill(conn, title, hold_date):
+    # Copies on the shelf while members wait (e.g. newly added copies)
+    shelved = conn.execute(f"""SELECT id, name FROM products
+                               WHERE name = ? AND status_id = {AVAILABLE}""", (title,)).fetchall()
+    return route(conn, shelved, hold_date)
+
+
+# ────────────────────────────────────────────────
+# Queue operations (each commits its own transaction)
+# ────────────────────────────────────────────────
+def _place(conn, member_id, title, request_date):
+    if not conn.execute("SELECT 1 FROM members WHERE id = ?", (member_id,)).fetchone():
+        raise NotFound(f"Member ID {member_id} not found.")
+    if not conn.execute("SELECT 1 FROM products WHERE name = ?", (title,)).fetchone():
+        raise NotFound(f"No item titled '{title}'.")
+    if conn.execute("SELECT 1 FROM requests WHERE member_id = ? AND product_name = ? AND fulfilled_date IS NULL",
+                    (member_id, title)).fetchone():
+        raise InvalidInput(f"Member {member_id} is already waiting for '{title}'.")
+    c = conn.execute("INSERT INTO requests (member_id, product_name, requested_date) VALUES (?, ?, ?)",
+                     (member_id, title, request_date))
+    request_id = c.lastrowid
+    _fill(conn, title, request_date)
+    held = conn.execute("""SELECT p.serial_no FROM requests r JOIN products p ON p.id = r.product_id
+                           WHERE r.id = ?""", (request_id,)).fetchone()
+    if held:
+        return request_id, 0, held[0]
+    return request_id, position(conn, request_id), None
+
+
+def place(conn, member_id, title, request_date=None):
+    """Put member_id in the queue for title.
+
+    Returns (request_id, position, serial): a copy on the shelf is held at
+    once (serial of the held copy, position 0); otherwise position is the
+    number of members ahead plus one.  Raises NotFound for an unknown
+    member or title, InvalidInput if the member is already waiting for it.
+    """
+    return transaction(conn, _place, member_id, title, request_date or _today())
+
+
+def cancel(conn, request_id):
+    """Withdraw a waiting request; returns False if it was not waiting."""
+    def work(conn):
+        return conn.execute("DELETE FROM requests WHERE id = ? AND fulfilled_date IS NULL",
+                            (request_id,)).rowcount > 0
+    return transaction(conn, work)
+
+
+def _expire(conn, today, days):
+    cutoff = (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=days)).strftime("%Y-%m-%d")
+    stale = []
+    for pid, title in conn.execute(f"SELECT id, name FROM products WHERE status_id = {ON_HOLD}").fetchall():
+        since = conn.execute("""SELECT fulfilled_date FROM requests WHERE product_id = ?
+                                ORDER BY fulfilled_date DESC, id DESC LIMIT 1""", (pid,)).fetchone()
+        if not since or since[0] < cutoff:
+            stale.append((pid, title))
+    held = route(conn, stale, today)
+    conn.executemany(f"UPDATE copies SET status_id = {AVAILABLE} WHERE id = ?",
+                     [(pid,) for pid, _ in stale if pid not in held])
+    return len(stale), len(held)
+
+
+def expire(conn, today=None, days=HOLD_DAYS):
+    """Release holds older than `days`; returns (released, passed on to the next member)."""
+    return transaction(conn, _expire, today or _today(), days)
+
+
+# ────────────────────────────────────────────────
+# Queue positions and wait estimates (reads)
+# ────────────────────────────────────────────────
+def position(conn, request_id):
+    """1-based place in its title's queue, or None if the request is not waiting."""
+    row = conn.execute("SELECT product_name, requested_date FROM requests WHERE id = ? AND fulfilled_date IS NULL",
+                       (request_id,)).fetchone()
+    if not row:
+        return None
+    ahead = conn.execute("""SELECT COUNT(*) FROM requests
+                            WHERE product_name = ? AND fulfilled_date IS NULL AND (requested_date, id) < (?, ?)""",
+                         (row[0], row[1], request_id)).fetchone()[0]
+    return ahead + 1
+
+
+def _free_dates(conn, title, today):
+    # Day each circulating copy is expected back on the shelf, from its open
+    # loan's due day; held copies are about to go out for a full loan
+    rows = conn.execute("""SELECT p.status_id, i.issue_day, i.return_day, p.type, p.category
+                           FROM products p
+                           LEFT JOIN issues i ON i.product_id = p.id AND i.actual_return_date IS NULL
+                           WHERE p.name = ?""", (title,)).fetchall()
+    lengths = [due - issued for _, issued, due, _, _ in rows if issued is not None and due is not None]
+    if lengths:
+        loan_days = round(sum(lengths) / len(lengths))
+    elif rows:
+        loan_days = policy.lookup(rows[0][3], rows[0][4], policy.DEFAULT_TIER).loan_days
+    else:
+        loan_days = policy.DEFAULTS['loan_days']
+    start = day_number(today)
+    days = []
+    for status, _, due, _, _ in rows:
+        if due is not None:
+            days.append(max(start, due))
+        elif status == AVAILABLE:
+            days.append(start)
+        elif status == ON_HOLD:
+            days.append(start + loan_days)
+    return sorted(days), loan_days
+
+
+def _eta(days, loan_days, position):
+    if not days:
+        return None
+    # Copies go round in due-date order, one loan per member ahead
+    rounds, slot = divmod(position - 1, len(days))
+    return day_text(days[slot] + rounds * loan_days)
+
+
+def estimate(conn, title, position, today=None):
+    """Estimated date (YYYY-MM-DD) a copy reaches queue position, or None if no copy circulates."""
+    return _eta(*_free_dates(conn, title, today or _today()), position)
+
+
+def queue(conn, title, today=None):
+    """Waiting list for title: [(request_id, member_id, member name, requested_date, position, estimate)]."""
+    dates, loan_days = _free_dates(conn, title, today or _today())
+    rows = conn.execute("""SELECT r.id, r.member_id, m.first_name || ' ' || m.last_name, r.requested_date
+                           FROM requests r LEFT JOIN members m ON m.id = r.member_id
+                           WHERE r.product_name = ? AND r.fulfilled_date IS NULL
+                           ORDER BY r.requested_date, r.id""", (title,)).fetchall()
+    return [row + (n, _eta(dates, loan_days, n)) for n, row in enumerate(rows, 1)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show a title's hold queue, or release uncollected holds.")
+    parser.add_argument('title', nargs='?')
+    parser.add_argument('--expire', action='store_true', help=f"release holds older than {HOLD_DAYS} days")
+    parser.add_argument('--date', help="today's date for --expire (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+    if not args.title and not args.expire:
+        parser.error("give a title or --expire")
+
+    from db import get_connection
+    from api import parse_date
+    from library_management import bootstrap
+    if args.date:
+        try:
+            parse_date(args.date, "Date")
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+    bootstrap()
+    conn = get_connection()
+    try:
+        if args.expire:
+            released, passed = expire(conn, args.date)
+            print(f"{released} uncollected hold(s) released, {passed} passed to the next member in line.")
+        else:
+            waiting = queue(conn, args.title)
+            for request_id, member_id, name, requested, pos, eta in waiting:
+                print(f"  {pos:>3}. member {member_id} ({name}), since {requested}, expected {eta or 'unknown'}")
+            print(f"{len(waiting)} member(s) waiting for '{args.title}'.")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+"""Streaming bulk import of catalog items, members and renewals from CSV or JSONL.
+
+Rows are validated with the same rules as the entry forms (validate_date,
+category_map), inserted in large batches - one transaction each - and
+invalid rows are reported without stopping the import.  Progress is
+checkpointed in the same transaction as each batch, so an interrupted import
+resumes after the last committed batch when the same file is imported again.
+
+    python importer.py products holdings.csv
+    python importer.py members members.jsonl --errors rejected.csv
+    python importer.py renewals renewals.csv
+
+A renewals file extends existing memberships (memberships.renew_many(), one
+set-based update per batch): each row's member is Active again until its
+end_date, or for its membership from the later of their end date and today.
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import math
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from db import get_connection, transaction
+from catalog import allocate_serials, format_serial, insert_copies, serial_prefix
+from codes import ACTIVE, code
+from api import DEFAULT_TIER, TIERS, category_map, membership_days, parse_date, product_types, renew_many
+
+BATCH_SIZE = 5000
+
+# Lookups of existing serials are chunked to stay under SQLite's variable limit
+LOOKUP_CHUNK = 500
+
+COLUMNS = {
+    'products': "type, name, author, category, cost, procurement_date, [qty], [serial_no]",
+    'members': "first_name, last_name, contact_name, contact_address, aadhar_no, start_date, "
+               "membership (6 months / 1 year / 2 years) or end_date, [tier]",
+    'renewals': "member_id, membership (6 months / 1 year / 2 years) or end_date",
+}
+
+# What the summary says was done with the records of a kind
+VERBS = {'renewals': 'applied'}
+
+
+class ImportReport:
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows = 0            # rows read from the file in this run
+        self.skipped = 0         # rows already imported by an earlier run
+        self.inserted = 0        # records written (a product row may add several copies)
+        self.errors = []         # (row number, message)
+        self.elapsed = 0.0
+        self.already_done = False
+
+    @property
+    def rate(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        if self.already_done:
+            return "This file was already imported completely (use restart to import it again)."
+        text = (f"{self.inserted} {self.kind} record(s) {VERBS.get(self.kind, 'inserted')} from {self.rows} row(s), "
+                f"{len(self.errors)} rejected, {self.elapsed:.1f}s ({self.rate:,.0f} rows/s)")
+        if self.skipped:
+            text += f"; resumed after {self.skipped} row(s) done earlier"
+        return text
+
+
+# ────────────────────────────────────────────────
+# Reading and validation
+# ────────────────────────────────────────────────
+def read_records(stream, fmt):
+    """Yield (row number, dict) from a text stream, one record at a time.
+
+    Rows are numbered from 1: data rows after the CSV header, lines in JSONL.
+    """
+    if fmt == 'csv':
+        for n, rec in enumerate(csv.DictReader(stream), 1):
+            yield n, rec
+    else:
+        for n, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                rec = None
+            yield n, rec if isinstance(rec, dict) else {'__invalid__': line.strip()}
+
+
+def _text(rec, field):
+    value = rec.get(field)
+    return str(value).strip() if value is not None else ''
+
+
+def _product(rec):
+    ptype = _text(rec, 'type').capitalize()
+    if ptype not in ('Book', 'Movie'):
+        raise ValueError("type must be Book or Movie")
+    name, author = _text(rec, 'name'), _text(rec, 'author')
+    if not name or not author:
+        raise ValueError("name and author are required")
+    cat = _text(rec, 'category')
+    if cat not in category_map:
+        raise ValueError(f"invalid category '{cat}' (use {', '.join(category_map)})")
+    try:
+        cost = float(_text(rec, 'cost') or 0)
+        qty = int(_text(rec, 'qty') or 1)
+    except ValueError:
+        raise ValueError("invalid cost or qty") from None
+    if qty < 1:
+        raise ValueError("qty must be at least 1")
+    # As api.add_item(); float() also reads 'nan' and 'inf'
+    if not math.isfinite(cost) or cost < 0:
+        raise ValueError("cost must be a number, not negative")
+    proc_date = _text(rec, 'procurement_date')
+    parse_date(proc_date, "Procurement Date")
+    serial = _text(rec, 'serial_no') or None
+    if serial and qty != 1:
+        raise ValueError("a row with a serial_no must have qty 1")
+    return (ptype, name, author, cat, cost, proc_date), qty, serial
+
+
+def _member(rec):
+    fields = [_text(rec, f) for f in ('first_name', 'last_name', 'contact_name', 'contact_address', 'aadhar_no')]
+    if not all(fields):
+        raise ValueError("first_name, last_name, contact_name, contact_address and aadhar_no are required")
+    start = _text(rec, 'start_date')
+    start_dt = parse_date(start, "Start Date")
+    end = _text(rec, 'end_date')
+    if end:
+        if parse_date(end, "End Date") <= start_dt:
+            raise ValueError("end_date must be after start_date")
+    else:
+        days = membership_days.get(_text(rec, 'membership'))
+        if not days:
+            raise ValueError(f"membership must be one of {', '.join(membership_days)} (or give end_date)")
+        end = (start_dt + timedelta(days=days)).strftime("%Y-%m-%d")
+    tier = _text(rec, 'tier') or DEFAULT_TIER
+    if tier not in TIERS:
+        raise ValueError(f"tier must be one of {', '.join(TIERS)}")
+    return tuple(fields) + (start, end, tier)
+
+
+def _renewal(rec):
+    try:
+        member_id = int(_text(rec, 'member_id'))
+    except ValueError:
+        raise ValueError("member_id must be a number") from None
+    end = _text(rec, 'end_date')
+    if end:
+        parse_date(end, "End Date")
+        return member_id, None, end
+    days = membership_days.get(_text(rec, 'membership'))
+    if not days:
+        raise ValueError(f"membership must be one of {', '.join(membership_days)} (or give end_date)")
+    return member_id, days, None
+
+
+# ────────────────────────────────────────────────
+# Batch writers (called inside the batch transaction)
+# ────────────────────────────────────────────────
+def _existing_serials(conn, serials):
+    found = set()
+    serials = list(serials)
+    for i in range(0, len(serials), LOOKUP_CHUNK):
+        chunk = serials[i:i + LOOKUP_CHUNK]
+        found.update(r[0] for r in conn.execute(
+            f"SELECT serial_no FROM copies WHERE serial_no IN ({','.join('?' * len(chunk))})", chunk))
+    return found
+
+
+def _prefix(values):
+    """The serial counter api.add_item() would number this item from."""
+    ptype, _, _, category = values[:4]
+    return serial_prefix(category_map[category], product_types[ptype])
+
+
+def _write_products(conn, batch, report):
+    taken = _existing_serials(conn, {serial for _, (_, _, serial) in batch if serial})
+    rows, pending, given = [], {}, {}
+    for n, (values, qty, serial) in batch:
+        if serial:
+            if serial in taken:
+                report.errors.append((n, f"serial_no {serial} already exists"))
+                continue
+            taken.add(serial)
+            rows.append(values + (serial,))
+            prefix = _prefix(values)
+            number = serial[len(prefix):]
+            if serial.startswith(prefix) and number.isdigit():
+                given[prefix] = max(given.get(prefix, 0), int(number))
+        else:
+            pending.setdefault(_prefix(values), []).append((values, qty))
+    # Keep the counters ahead of any serials in their scheme given in the file (a counter
+    # that does not exist yet starts after the serials already in copies)
+    insert_copies(conn, rows)
+    conn.executemany("UPDATE serial_counters SET last_value = MAX(last_value, ?) WHERE prefix = ?",
+                     [(number, prefix) for prefix, number in given.items()])
+    written, rows = len(rows), []
+    # One counter update per prefix reserves serials for the whole batch
+    for prefix, items in pending.items():
+        next_no = allocate_serials(conn, sum(qty for _, qty in items), prefix)
+        for values, qty in items:
+            for _ in range(qty):
+                rows.append(values + (format_serial(prefix, next_no),))
+                next_no += 1
+    insert_copies(conn, rows)
+    return written + len(rows)
+
+
+def _write_members(conn, batch, report):
+    tiers = {tier: code(conn, 'member_tiers', tier) for tier in {values[-1] for _, values in batch}}
+    conn.executemany(f"""INSERT INTO members (first_name, last_name, contact_name, contact_address, aadhar_no,
+                                              start_date, end_date, status_id, tier_id)
+                         VALUES (?,?,?,?,?,?,?,{ACTIVE},?)""",
+                     [values[:-1] + (tiers[values[-1]],) for _, values in batch])
+    return len(batch)
+
+
+def _write_renewals(conn, batch, report):
+    renewed, unknown = renew_many(conn, [values for _, values in batch], datetime.now().strftime("%Y-%m-%d"))
+    unknown = set(unknown)
+    report.errors.extend((n, f"member {values[0]} not found") for n, values in batch if values[0] in unknown)
+    return renewed
+
+
+KINDS = {
+    'products': (_product, _write_products),
+    'members': (_member, _write_members),
+    'renewals': (_renewal, _write_renewals),
+}
+
+
+# ────────────────────────────────────────────────
+# Import driver
+# ────────────────────────────────────────────────
+def _checkpoint(conn, source):
+    row = conn.execute("SELECT rows_done, finished FROM import_checkpoints WHERE source = ?", (source,)).fetchone()
+    return row or (0, 0)
+
+
+def _save_checkpoint(conn, source, kind, rows_done, inserted, finished=0):
+    conn.execute("""INSERT INTO import_checkpoints (source, kind, rows_done, inserted, finished, updated_at)
+                    VALUES (?, ?, ?, ?, ?, datetime('now'))
+                    ON CONFLICT(source) DO UPDATE SET rows_done = excluded.rows_done,
+                        inserted = import_checkpoints.inserted + excluded.inserted,
+                        finished = excluded.finished, updated_at = excluded.updated_at""",
+                 (source, kind, rows_done, inserted, finished))
+
+
+def import_records(conn, records, kind, source, batch_size=BATCH_SIZE, restart=False, on_batch=None):
+    """Import (row number, dict) records; returns an ImportReport.
+
+    `source` identifies the input for resuming.  on_batch(report) is called
+    after every committed batch.
+    """
+    parse, write = KINDS[kind]
+    report = ImportReport(kind)
+    done, finished = (0, 0) if restart else _checkpoint(conn, source)
+    if finished:
+        report.already_done = True
+        return report
+    if restart:
+        transaction(conn, lambda conn: conn.execute("DELETE FROM import_checkpoints WHERE source = ?", (source,)))
+
+    start = time.perf_counter()
+    batch, last_row = [], done
+
+    def write_batch(conn, rejected):
+        # A retried batch reports its rejected rows again, so drop the first attempt's
+        del report.errors[rejected:]
+        inserted = write(conn, batch, report) if batch else 0
+        _save_checkpoint(conn, source, kind, last_row, inserted)
+        return inserted
+
+    def flush():
+        inserted = transaction(conn, write_batch, len(report.errors))
+        report.inserted += inserted
+        report.elapsed = time.perf_counter() - start
+        if on_batch:
+            on_batch(report)
+
+    for n, rec in records:
+        if n <= done:
+            report.skipped += 1
+            continue
+        report.rows += 1
+        last_row = n
+        try:
+            if '__invalid__' in rec:
+                raise ValueError("not a JSON object")
+            batch.append((n, parse(rec)))
+        except ValueError as e:
+            report.errors.append((n, str(e)))
+        if report.rows % batch_size == 0:
+            flush()
+            batch = []
+    flush()
+    transaction(conn, _save_checkpoint, source, kind, last_row, 0, finished=1)
+    report.errors.sort()
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def source_key(binary_stream, name):
+    """Identify an input by content, so a renamed copy still resumes."""
+    digest = hashlib.sha1()
+    for chunk in iter(lambda: binary_stream.read(1 << 20), b''):
+        digest.update(chunk)
+    binary_stream.seek(0)
+    return f"{os.path.basename(name)}:{digest.hexdigest()}"
+
+
+def detect_format(name):
+    return 'jsonl' if name.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def import_stream(binary_stream, name, kind, conn=None, **options):
+    """Import an open binary file (or upload) named `name`."""
+    source = source_key(binary_stream, name)
+    text = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    own = conn is None
+    conn = conn or get_connection()
+    try:
+        return import_records(conn, read_records(text, detect_format(name)), kind, source, **options)
+    finally:
+        text.detach()
+        if own:
+            conn.close()
+
+
+def write_errors(report, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        w.writerow(['row', 'error'])
+        w.writerows(report.errors)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import catalog items, members or renewals from CSV/JSONL.")
+    parser.add_argument('kind', choices=sorted(KINDS))
+    parser.add_argument('file')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint and import from row 1")
+    parser.add_argument('--errors', help="write rejected rows to this CSV file")
+    args = parser.parse_args(argv)
+
+    from library_management import create_db
+    create_db()
+
+    def progress(report):
+        print(f"  {report.rows + report.skipped} rows, {report.inserted} inserted, "
+              f"{len(report.errors)} rejected, {report.rate:,.0f} rows/s", flush=True)
+
+    with open(args.file, 'rb') as f:
+        report = import_stream(f, args.file, args.kind, batch_size=args.batch_size,
+                               restart=args.restart, on_batch=progress)
+    print(report.summary())
+    if report.errors:
+        if args.errors:
+            write_errors(report, args.errors)
+            print(f"Rejected rows written to {args.errors}")
+        else:
+            for n, msg in report.errors[:20]:
+                print(f"  row {n}: {msg}", file=sys.stderr)
+            if len(report.errors) > 20:
+                print(f"  ... {len(report.errors) - 20} more (use --errors FILE)", file=sys.stderr)
+    return 1 if report.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""Per-statement instrumentation for every pooled connection.
+
+Pooled connections (db.py) create their cursors from Cursor below, so every
+statement the apps run - the console, Streamlit (including pandas
+read_sql_query), the importer and the HTTP server - is timed from execute()
+until its rows are consumed or the cursor goes away.  Counters are kept
+per statement text (whitespace collapsed, "IN (?, ?, ...)" lists folded):
+calls, total and max time, rows returned or changed, and slow executions.
+
+A statement slower than SLOW_MS is logged at WARNING with its EXPLAIN QUERY
+PLAN and kept in a short in-memory slow log.  Counters live in the process;
+read them with snapshot() / slow_queries(), as Prometheus text with
+prometheus(), on the web app's Diagnostics page, at the HTTP server's
+/metrics/sql, or in a Prometheus textfile written every METRICS_INTERVAL
+seconds and at exit when LIBRARY_METRICS_FILE is set:
+
+    LIBRARY_METRICS_FILE=/var/lib/node_exporter/library.prom python library_management.py
+
+LIBRARY_SLOW_MS overrides the threshold; LIBRARY_INSTRUMENT=0 turns the
+instrumentation off.
+"""
+import atexit
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger("instrument")
+
+ENABLED = os.environ.get('LIBRARY_INSTRUMENT', '1') != '0'
+
+# Statements slower than this (milliseconds) are logged with their query plan
+SLOW_MS = float(os.environ.get('LIBRARY_SLOW_MS', 100))
+
+# Slow executions kept for slow_queries()
+SLOW_LOG_SIZE = 100
+
+# Distinct statements counted; any beyond are counted under OTHER
+MAX_STATEMENTS = 1000
+OTHER = "(other)"
+
+# Seconds between writes of LIBRARY_METRICS_FILE
+METRICS_INTERVAL = 60
+
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+# Each thread counts into its own dict (statement -> [calls, seconds, max
+# seconds, rows, slow]), so recording takes no lock; readers merge them.
+# Counts of finished threads are folded into _retired.
+_threads = []                    # [(thread, stats)]
+_retired = {}
+_local = threading.local()
+_slow = deque(maxlen=SLOW_LOG_SIZE)
+_keys = {}
+_lock = threading.Lock()
+
+
+def _key(sql):
+    key = _keys.get(sql)
+    if key is None:
+        key = _IN_LIST.sub("(?, ...)", " ".join(sql.split()))
+        if len(_keys) >= MAX_STATEMENTS * 4:
+            _keys.clear()
+        _keys[sql] = key
+    return key
+
+
+def _plan(conn, sql, params):
+    try:
+        cur = sqlite3.Cursor(conn)
+        return "\n".join(row[3] for row in cur.execute("EXPLAIN QUERY PLAN " + sql, params))
+    except (sqlite3.Error, ValueError, TypeError):
+        return None
+
+
+def _add(totals, key, entry):
+    total = totals.setdefault(key, [0, 0.0, 0.0, 0, 0])
+    total[0] += entry[0]
+    total[1] += entry[1]
+    total[2] = max(total[2], entry[2])
+    total[3] += entry[3]
+    total[4] += entry[4]
+
+
+def _thread_stats():
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        stats = _local.stats = {}
+        with _lock:
+            for thread, finished in [t for t in _threads if not t[0].is_alive()]:
+                for key, entry in finished.items():
+                    _add(_retired, key, entry)
+            _threads[:] = [t for t in _threads if t[0].is_alive()]
+            _threads.append((threading.current_thread(), stats))
+    return stats
+
+
+def record(sql, seconds, rows, conn=None, params=None):
+    """Count one execution; if it was slow, log it with its plan (when conn is given)."""
+    key = _key(sql)
+    slow = seconds * 1000 >= SLOW_MS
+    stats = _thread_stats()
+    entry = stats.get(key)
+    if entry is None:
+        if len(stats) >= MAX_STATEMENTS:
+            key = OTHER
+        entry = stats.setdefault(key, [0, 0.0, 0.0, 0, 0])
+    entry[0] += 1
+    entry[1] += seconds
+    if seconds > entry[2]:
+        entry[2] = seconds
+    entry[3] += rows
+    entry[4] += slow
+    if slow:
+        plan = _plan(conn, sql, params) if conn is not None and params is not None else None
+        _slow.append({'at': time.strftime("%Y-%m-%d %H:%M:%S"), 'ms': round(seconds * 1000, 1), 'rows': rows,
+                      'statement': key, 'plan': plan})
+        log.warning("Slow query (%.1f ms, %d rows): %s%s", seconds * 1000, rows, key,
+                    f"\n{plan}" if plan else "")
+
+
+_perf = time.perf_counter
+_base = sqlite3.Cursor
+
+
+class Cursor(sqlite3.Cursor):
+    """sqlite3 cursor that records each statement it runs."""
+    _sql = None
+
+    def _finish(self):
+        if self._sql is not None:
+            sql, self._sql = self._sql, None
+            rows = self._rows if self.description is not None else max(self.rowcount, 0)
+            record(sql, self._elapsed, rows, self.connection, self._params)
+
+    # The timing wrappers below are inlined: they run for every statement and row batch
+    def execute(self, sql, params=()):
+        if self._sql is not None:
+            self._finish()
+        self._sql, self._params, self._rows = sql, params, 0
+        t0 = _perf()
+        try:
+            return _base.execute(self, sql, params)
+        finally:
+            self._elapsed = _perf() - t0
+
+    def executemany(self, sql, seq_of_params):
+        if self._sql is not None:
+            self._finish()
+        self._sql, self._params, self._rows = sql, None, 0
+        t0 = _perf()
+        try:
+            return _base.executemany(self, sql, seq_of_params)
+        finally:
+            self._elapsed = _perf() - t0
+
+    def executescript(self, script):
+        if self._sql is not None:
+            self._finish()
+        self._sql, self._params, self._rows = script, None, 0
+        t0 = _perf()
+        try:
+            return _base.executescript(self, script)
+        finally:
+            self._elapsed = _perf() - t0
+
+    def fetchone(self):
+        t0 = _perf()
+        row = _base.fetchone(self)
+        if self._sql is not None:
+            self._elapsed += _perf() - t0
+            if row is None:
+                self._finish()
+            else:
+                self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        t0 = _perf()
+        rows = _base.fetchmany(self, self.arraysize if size is None else size)
+        if self._sql is not None:
+            self._elapsed += _perf() - t0
+            if rows:
+                self._rows += len(rows)
+            else:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        t0 = _perf()
+        rows = _base.fetchall(self)
+        if self._sql is not None:
+            self._elapsed += _perf() - t0
+            self._rows += len(rows)
+            self._finish()
+        return rows
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+# ────────────────────────────────────────────────
+# Reading the counters
+# ────────────────────────────────────────────────
+def _merged():
+    with _lock:
+        totals = {key: list(entry) for key, entry in _retired.items()}
+        threads = [stats for _, stats in _threads]
+    for stats in threads:
+        for key, entry in list(stats.items()):
+            _add(totals, key, list(entry))
+    return totals
+
+
+def snapshot():
+    """Per-statement counters, most total time first."""
+    items = _merged().items()
+    return sorted(({'statement': key, 'calls': calls, 'total_ms': round(seconds * 1000, 3),
+                    'mean_ms': round(seconds * 1000 / calls, 3), 'max_ms': round(peak * 1000, 3),
+                    'rows': rows, 'slow': slow}
+                   for key, (calls, seconds, peak, rows, slow) in items),
+                  key=lambda s: -s['total_ms'])
+
+
+def slow_queries():
+    """Recent slow executions, newest first."""
+    return list(reversed(_slow))
+
+
+def reset():
+    with _lock:
+        for _, stats in _threads:
+            stats.clear()
+        _retired.clear()
+        _slow.clear()
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def prometheus():
+    """Counters in the Prometheus text exposition format."""
+    items = sorted(_merged().items())
+    lines = []
+    for i, (name, kind, help_text) in enumerate((
+            ('library_sql_calls_total', 'counter', "Statements executed."),
+            ('library_sql_seconds_total', 'counter', "Time spent executing and fetching, in seconds."),
+            ('library_sql_max_seconds', 'gauge', "Slowest execution, in seconds."),
+            ('library_sql_rows_total', 'counter', "Rows returned or changed."),
+            ('library_sql_slow_total', 'counter', f"Executions slower than {SLOW_MS:g} ms."))):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        lines += [f'{name}{{statement="{_label(key)}"}} {entry[i]:g}' for key, entry in items]
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path):
+    """Write prometheus() to path atomically (for node_exporter's textfile collector)."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(prometheus())
+    os.replace(tmp, path)
+
+
+def _export_loop(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_textfile(path)
+        except OSError as e:
+            log.warning("Could not write %s: %s", path, e)
+
+
+def export_to(path, interval=METRICS_INTERVAL):
+    """Write the counters to path every interval seconds and at exit."""
+    threading.Thread(target=_export_loop, args=(path, interval), daemon=True, name="metrics-export").start()
+    atexit.register(write_textfile, path)
+
+
+if ENABLED and os.environ.get('LIBRARY_METRICS_FILE'):
+    export_to(os.environ['LIBRARY_METRICS_FILE'])
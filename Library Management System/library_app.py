@@ -1,60 +1,45 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
 from datetime import datetime
-import hashlib
-from library_management import create_db, category_map
-print("=== DEBUG: Starting library_app.py version 2025-02-18 fixed login ===")
-print("Current working directory:", __import__('os').getcwd())
+import logging
+import os
+import tempfile
+from library_management import bootstrap
+import api
+from api import DEFAULT_TIER, TIERS, category_map, membership_days
+from db import get_connection
+from errors import NotFound
+from search import search_products, suggest, suggest_serials
+import importer
+import reports
+import stats
+import readcache
+import instrument
+import availability
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger("library_app")
 # ────────────────────────────────────────────────
-#  Database & Helpers (copied from console version)
+#  Database & Helpers (logic lives in api.py)
 # ────────────────────────────────────────────────
 
-def hash_password(pw):
-    return hashlib.sha256(pw.encode()).hexdigest()
-
-def get_connection():
-    return sqlite3.connect('library.db', check_same_thread=False)
-
-# Ensure DB and tables exist before any DB queries
-create_db()
-
-# ────────────────────────────────────────────────
-# Initialize default users (without destroying existing data)
-# ────────────────────────────────────────────────
-def reset_default_users():
-    conn = get_connection()
-    c = conn.cursor()
-    
-    # Create table if not exists (preserve existing data)
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT, is_admin INTEGER, is_active INTEGER)''')
-    
-    # Insert default credentials ONLY if they don't exist
-    c.execute("INSERT OR IGNORE INTO users (username, password, is_admin, is_active) VALUES (?, ?, 1, 1)",
-              ('adm', hash_password('adm')))
-    c.execute("INSERT OR IGNORE INTO users (username, password, is_admin, is_active) VALUES (?, ?, 0, 1)",
-              ('user', hash_password('user')))
-    
-    conn.commit()
-    conn.close()
-    print("DEBUG: Default users initialized (adm/adm & user/user if not already present)")
-
-# Call it once at startup
-reset_default_users()
-
-# Then the rest of your if __name__ == "__main__": block remains empty or just pass
-
-def check_login(username, password):
-    """Check if user exists and password is correct (case-insensitive username)."""
-    hashed = hash_password(password)
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT is_admin FROM users WHERE LOWER(username) = LOWER(?) AND password = ? AND is_active = 1",
-              (username, hashed))
-    row = c.fetchone()
-    conn.close()
-    return row[0] if row else None
+# Ensure DB, tables and default users (adm/adm & user/user) exist before any
+# DB queries.  Streamlit re-runs this script on every interaction; bootstrap()
+# only does work the first time per process and database file.
+if bootstrap():
+    log.info("Starting library_app.py (working directory %s)", os.getcwd())
+    _conn = get_connection()
+    try:
+        log.info("Availability index: %d copies", availability.warm(_conn))
+    finally:
+        _conn.close()
+
+def show_batch_result(result):
+    """Per-item outcomes of a batch issue/return."""
+    (st.success if not result.failed else st.warning)(result.summary())
+    st.dataframe(pd.DataFrame([("✅" if ok else "❌", serial, message) for serial, ok, message in result.outcomes],
+                              columns=["", "serial_no", "outcome"]),
+                 hide_index=True, use_container_width=True)
 
 # ────────────────────────────────────────────────
 #  Streamlit App
@@ -76,10 +61,12 @@ if not st.session_state.logged_in:
         password = st.text_input("Password", type="password")
 
         if st.button("Login"):
-            role = check_login(username.strip(), password.strip())
-            if role is not None:
+            conn = get_connection()
+            user = api.login(conn, username, password)
+            conn.close()
+            if user:
                 st.session_state.logged_in = True
-                st.session_state.is_admin = bool(role)
+                st.session_state.is_admin = bool(user.is_admin)
                 st.success("Login successful!")
                 st.rerun()
             else:
@@ -90,7 +77,7 @@ else:
     with st.sidebar:
         st.title("Library System")
         if st.session_state.is_admin:
-            pages = ["Home", "Maintenance", "Transactions", "Reports"]
+            pages = ["Home", "Maintenance", "Transactions", "Reports", "Diagnostics"]
         else:
             pages = ["Home", "Transactions", "Reports"]
         
@@ -112,15 +99,34 @@ else:
         - View reports
         """ + ("- Manage members & items (admin only)" if st.session_state.is_admin else ""))
 
+        # Dashboard reads only the trigger-maintained summary tables
+        summary = readcache.cached(("products", "issues", "members"), stats.dashboard)
+        st.subheader("Circulation at a glance")
+        c1, c2, c3, c4, c5 = st.columns(5)
+        c1.metric("Copies", f"{summary['copies']:,}")
+        c2.metric("Available", f"{summary['available']:,}")
+        c3.metric("On loan", f"{summary['open_loans']:,}")
+        c4.metric("Overdue", f"{summary['overdue']:,}")
+        c5.metric("Fines due", f"₹{summary['outstanding_fines']:,.2f}", f"{summary['members_owing']} member(s)",
+                  delta_color="off")
+        if summary['categories']:
+            df = pd.DataFrame.from_dict(summary['categories'], orient='index')
+            df.index.name = 'category'
+            st.dataframe(df.sort_index(), use_container_width=True)
+        if summary['busiest_members']:
+            st.caption("Members with the most items on loan")
+            st.dataframe(pd.DataFrame(summary['busiest_members'], columns=['member_id', 'name', 'on_loan']),
+                         hide_index=True, use_container_width=True)
+
     # ─── Maintenance (Admin only) ───────────────────
     elif page == "Maintenance" and st.session_state.is_admin:
         st.title("Maintenance")
-        tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["Add Item", "Add Member", "Update Member", "Update Status", "Add User", "Update User"])
+        tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["Add Item", "Add Member", "Update Member", "Update Status", "Add User", "Update User", "Bulk Import"])
 
         with tab1:
             st.subheader("Add Book / Movie")
             with st.form("add_item_form"):
-                ptype = st.selectbox("Type", ["Book", "Movie"])
+                ptype = st.selectbox("Type", list(api.product_types))
                 name = st.text_input("Title")
                 author = st.text_input("Author / Director")
                 category = st.selectbox("Category", list(category_map.keys()))
@@ -130,25 +136,15 @@ else:
 
                 submitted = st.form_submit_button("Add Item(s)")
                 if submitted:
-                    if name and author and proc_date:
-                        conn = get_connection()
-                        c = conn.cursor()
-                        
-                        # Get the highest serial number from ALL products
-                        c.execute("SELECT MAX(CAST(serial_no AS INTEGER)) FROM products")
-                        max_serial = c.fetchone()[0] or 0
-                        
-                        for i in range(qty):
-                            # Generate simple unique serial numbers: 01, 02, 03, etc.
-                            serial = f"{max_serial + i + 1:02d}"
-                            c.execute("""INSERT INTO products (type, name, author, category, cost, procurement_date, serial_no)
-                                         VALUES (?,?,?,?,?,?,?)""",
-                                      (ptype, name, author, category, cost, str(proc_date), serial))
-                        conn.commit()
+                    conn = get_connection()
+                    try:
+                        first, last = api.add_item(conn, ptype, name, author, category, cost, str(proc_date), int(qty))
+                        readcache.invalidate("products")
+                        st.success(f"✅ {qty} item(s) added successfully. (Serial: {first} to {last})")
+                    except ValueError as e:
+                        st.error(str(e))
+                    finally:
                         conn.close()
-                        st.success(f"✅ {qty} item(s) added successfully. (Serial: {max_serial + 1:02d} to {max_serial + qty:02d})")
-                    else:
-                        st.error("Please fill required fields.")
 
         with tab2:
             st.subheader("Add Member")
@@ -159,84 +155,114 @@ else:
                 address = st.text_area("Address")
                 aadhar = st.text_input("Aadhar No")
                 start_date = st.date_input("Membership Start")
-                mtype = st.selectbox("Duration", ["6 months", "1 year", "2 years"])
+                mtype = st.selectbox("Duration", list(membership_days))
+                # Tiers come from the loan policy; with one there is nothing to choose
+                tier = st.selectbox("Tier", TIERS) if len(TIERS) > 1 else DEFAULT_TIER
 
                 submitted = st.form_submit_button("Add Member")
                 if submitted:
-                    if first and last and contact and address and aadhar and start_date:
-                        days = {"6 months":180, "1 year":365, "2 years":730}[mtype]
-                        end_date = start_date + pd.Timedelta(days=days)
-                        conn = get_connection()
-                        c = conn.cursor()
-                        c.execute("""INSERT INTO members (first_name, last_name, contact_name, contact_address, aadhar_no, start_date, end_date, status)
-                                     VALUES (?,?,?,?,?,?,?,'Active')""",
-                                  (first, last, contact, address, aadhar, str(start_date), str(end_date)))
-                        conn.commit()
+                    conn = get_connection()
+                    try:
+                        member = api.add_member(conn, first, last, contact, address, aadhar, str(start_date), mtype,
+                                                tier)
+                        readcache.invalidate("members")
+                        st.success(f"Member added (ID {member.id}, until {member.end_date}).")
+                    except ValueError as e:
+                        st.error(str(e))
+                    finally:
                         conn.close()
-                        st.success("Member added.")
-                    else:
-                        st.error("Fill all required fields.")
 
         with tab3:
             st.subheader("Update Member Membership")
             member_id = st.text_input("Member ID", key="update_member_id")
             if st.button("Load Member", key="load_member_btn"):
                 conn = get_connection()
-                c = conn.cursor()
-                c.execute("SELECT end_date, status FROM members WHERE id = ?", (member_id,))
-                member = c.fetchone()
-                conn.close()
-                if member:
-                    st.session_state.member_data = {"end_date": member[0], "status": member[1]}
-                else:
-                    st.error("Member not found.")
+                try:
+                    member = api.get_member(conn, member_id)
+                    st.session_state.member_data = {"end_date": member.end_date, "status": member.status,
+                                                    "tier": member.tier}
+                except ValueError as e:
+                    st.error(str(e))
                     st.session_state.member_data = None
+                finally:
+                    conn.close()
             
             if hasattr(st.session_state, 'member_data') and st.session_state.member_data:
                 data = st.session_state.member_data
-                st.info(f"Current end date: {data['end_date']} | Status: {data['status']}")
-                action = st.selectbox("Action", ["Extend Membership", "Cancel Membership"])
+                st.info(f"Current end date: {data['end_date']} | Status: {data['status']}"
+                        f" | Tier: {data['tier'] or '-'}")
+                actions = ["Extend Membership", "Cancel Membership"] + (["Change Tier"] if len(TIERS) > 1 else [])
+                action = st.selectbox("Action", actions)
                 
                 if action == "Extend Membership":
-                    ext_type = st.selectbox("Extend by", ["6 months", "1 year", "2 years"])
+                    ext_type = st.selectbox("Extend by", list(membership_days))
                     if st.button("Extend"):
-                        days = {"6 months":180, "1 year":365, "2 years":730}[ext_type]
-                        from datetime import datetime
-                        old_date = datetime.strptime(data['end_date'], "%Y-%m-%d")
-                        new_end = (old_date + pd.Timedelta(days=days)).strftime("%Y-%m-%d")
                         conn = get_connection()
-                        c = conn.cursor()
-                        c.execute("UPDATE members SET end_date = ? WHERE id = ?", (new_end, member_id))
-                        conn.commit()
-                        conn.close()
-                        st.success(f"Membership extended to {new_end}.")
-                        st.session_state.member_data = None
+                        try:
+                            new_end = api.extend_membership(conn, member_id, ext_type)
+                            readcache.invalidate("members")
+                            st.success(f"Membership extended to {new_end}.")
+                            st.session_state.member_data = None
+                        except ValueError as e:
+                            st.error(str(e))
+                        finally:
+                            conn.close()
                 
                 elif action == "Cancel Membership":
                     if st.button("Confirm Cancel"):
                         conn = get_connection()
-                        c = conn.cursor()
-                        c.execute("UPDATE members SET status = 'Inactive' WHERE id = ?", (member_id,))
-                        conn.commit()
-                        conn.close()
-                        st.success("Membership cancelled.")
-                        st.session_state.member_data = None
+                        try:
+                            api.cancel_membership(conn, member_id)
+                            readcache.invalidate("members")
+                            st.success("Membership cancelled.")
+                            st.session_state.member_data = None
+                        except ValueError as e:
+                            st.error(str(e))
+                        finally:
+                            conn.close()
+                
+                elif action == "Change Tier":
+                    new_tier = st.selectbox("New Tier", TIERS)
+                    if st.button("Change Tier", key="change_tier_btn"):
+                        conn = get_connection()
+                        try:
+                            api.set_member_tier(conn, member_id, new_tier)
+                            readcache.invalidate("members")
+                            st.success(f"Member moved to the {new_tier} tier.")
+                            st.session_state.member_data = None
+                        except ValueError as e:
+                            st.error(str(e))
+                        finally:
+                            conn.close()
+
+            st.divider()
+            st.caption("Members whose membership has ended are marked Inactive by the nightly "
+                       "`python memberships.py --expire`; this runs it now.")
+            if st.button("Expire Lapsed Memberships", key="expire_members_btn"):
+                conn = get_connection()
+                try:
+                    expired = api.expire_memberships(conn)
+                    readcache.invalidate("members")
+                    st.success(f"{expired} membership(s) lapsed and marked Inactive.")
+                    st.session_state.member_data = None
+                finally:
+                    conn.close()
 
         with tab4:
             st.subheader("Update Item Status")
             serial = st.text_input("Serial Number")
-            new_status = st.selectbox("New Status", ["Available", "Issued"])
+            new_status = st.selectbox("New Status", list(api.ITEM_STATUSES))
             if st.button("Update Status"):
                 if serial:
                     conn = get_connection()
-                    c = conn.cursor()
-                    c.execute("UPDATE products SET status = ? WHERE serial_no = ?", (new_status, serial))
-                    if c.rowcount > 0:
-                        conn.commit()
+                    try:
+                        api.set_item_status(conn, serial, new_status)
+                        readcache.invalidate("products")
                         st.success("Status updated.")
-                    else:
-                        st.error("Serial not found.")
-                    conn.close()
+                    except ValueError as e:
+                        st.error(str(e))
+                    finally:
+                        conn.close()
                 else:
                     st.warning("Enter serial number.")
 
@@ -245,10 +271,8 @@ else:
             
             # Show all existing users
             if st.checkbox("Show existing users", key="show_users_add"):
-                conn = get_connection()
-                all_users = pd.read_sql_query("SELECT id, username, is_admin, is_active FROM users ORDER BY username", conn)
-                conn.close()
-                st.dataframe(all_users, use_container_width=True)
+                st.dataframe(pd.DataFrame(readcache.cached(("users",), api.list_users), columns=api.User._fields),
+                             use_container_width=True)
             
             with st.form("add_user_form"):
                 username = st.text_input("Username", key="new_username")
@@ -258,28 +282,16 @@ else:
                 
                 submitted = st.form_submit_button("Create User")
                 if submitted:
-                    if not all([username, password, confirm_pwd]):
-                        st.error("All fields required.")
-                    elif password != confirm_pwd:
+                    if password != confirm_pwd:
                         st.error("Passwords do not match.")
-                    elif len(password) < 4:
-                        st.error("Password must be at least 4 characters.")
                     else:
                         conn = get_connection()
-                        c = conn.cursor()
                         try:
-                            # Check if username already exists (case-insensitive)
-                            c.execute("SELECT id FROM users WHERE LOWER(username) = LOWER(?)", (username,))
-                            if c.fetchone():
-                                st.error(f"Username '{username}' already exists!")
-                            else:
-                                hashed = hash_password(password)
-                                c.execute("INSERT INTO users (username, password, is_admin, is_active) VALUES (?, ?, ?, 1)",
-                                          (username, hashed, 1 if is_admin else 0))
-                                conn.commit()
-                                st.success(f"✅ User '{username}' created successfully!")
-                        except sqlite3.IntegrityError:
-                            st.error("Username already exists (case-insensitive check failed).")
+                            api.create_user(conn, username, password, is_admin)
+                            readcache.invalidate("users")
+                            st.success(f"✅ User '{username}' created successfully!")
+                        except ValueError as e:
+                            st.error(str(e))
                         finally:
                             conn.close()
 
@@ -290,24 +302,20 @@ else:
                 username = st.text_input("Username to update", key="update_username")
             with col2:
                 if st.button("Show All Users"):
-                    conn = get_connection()
-                    all_users = pd.read_sql_query("SELECT id, username, is_admin, is_active FROM users ORDER BY username", conn)
-                    conn.close()
-                    st.dataframe(all_users, use_container_width=True)
+                    st.dataframe(pd.DataFrame(readcache.cached(("users",), api.list_users), columns=api.User._fields),
+                                 use_container_width=True)
             
             if st.button("Load User", key="load_user_btn"):
                 conn = get_connection()
-                c = conn.cursor()
-                # Case-insensitive search
-                c.execute("SELECT id, is_admin, is_active FROM users WHERE LOWER(username) = LOWER(?)", (username,))
-                user = c.fetchone()
-                conn.close()
-                if user:
-                    st.session_state.user_data = {"id": user[0], "is_admin": user[1], "is_active": user[2]}
+                try:
+                    user = api.get_user(conn, username)
+                    st.session_state.user_data = {"id": user.id, "is_admin": user.is_admin, "is_active": user.is_active}
                     st.success(f"User '{username}' loaded successfully!")
-                else:
-                    st.error(f"User '{username}' not found. Click 'Show All Users' to see available usernames.")
+                except ValueError as e:
+                    st.error(f"{e} Click 'Show All Users' to see available usernames.")
                     st.session_state.user_data = None
+                finally:
+                    conn.close()
             
             if hasattr(st.session_state, 'user_data') and st.session_state.user_data:
                 data = st.session_state.user_data
@@ -319,30 +327,27 @@ else:
                     new_pwd = st.text_input("New Password", type="password", key="update_password")
                     confirm_new = st.text_input("Confirm New Password", type="password", key="confirm_update_password")
                     if st.button("Update Password"):
-                        if not all([new_pwd, confirm_new]):
-                            st.error("Both fields required.")
-                        elif new_pwd != confirm_new:
+                        if new_pwd != confirm_new:
                             st.error("Passwords do not match.")
-                        elif len(new_pwd) < 4:
-                            st.error("Password must be at least 4 characters.")
                         else:
                             conn = get_connection()
-                            c = conn.cursor()
-                            hashed = hash_password(new_pwd)
-                            c.execute("UPDATE users SET password = ? WHERE id = ?", (hashed, data['id']))
-                            conn.commit()
-                            conn.close()
-                            st.success(f"Password updated for '{username}'.")
-                            st.session_state.user_data = None
+                            try:
+                                api.set_password(conn, data['id'], new_pwd)
+                                readcache.invalidate("users")
+                                st.success(f"Password updated for '{username}'.")
+                                st.session_state.user_data = None
+                            except ValueError as e:
+                                st.error(str(e))
+                            finally:
+                                conn.close()
                 
                 elif action == "Toggle Admin":
                     new_admin = not bool(data['is_admin'])
                     if st.button(f"Make {'Admin' if new_admin else 'Regular User'}"):
                         conn = get_connection()
-                        c = conn.cursor()
-                        c.execute("UPDATE users SET is_admin = ? WHERE id = ?", (1 if new_admin else 0, data['id']))
-                        conn.commit()
+                        api.set_admin(conn, data['id'], new_admin)
                         conn.close()
+                        readcache.invalidate("users")
                         st.success(f"User '{username}' is now {'admin' if new_admin else 'regular user'}.")
                         st.session_state.user_data = None
                 
@@ -350,29 +355,80 @@ else:
                     new_active = not bool(data['is_active'])
                     if st.button(f"{'Activate' if new_active else 'Deactivate'}"):
                         conn = get_connection()
-                        c = conn.cursor()
-                        c.execute("UPDATE users SET is_active = ? WHERE id = ?", (1 if new_active else 0, data['id']))
-                        conn.commit()
+                        api.set_active(conn, data['id'], new_active)
                         conn.close()
+                        readcache.invalidate("users")
                         st.success(f"User '{username}' is now {'active' if new_active else 'inactive'}.")
                         st.session_state.user_data = None
 
+        with tab7:
+            st.subheader("Bulk Import (CSV / JSONL)")
+            kinds = {"products": "Books / Movies", "members": "Members", "renewals": "Membership Renewals"}
+            kind = st.selectbox("Import", list(kinds), format_func=kinds.get)
+            st.caption("Columns: " + importer.COLUMNS[kind])
+            upload = st.file_uploader("File", type=["csv", "jsonl", "ndjson", "json"])
+            restart = st.checkbox("Start from the first row (ignore an earlier partial import)")
+            
+            if st.button("Import", key="bulk_import_btn"):
+                if not upload:
+                    st.warning("Choose a file first.")
+                else:
+                    bar = st.progress(0.0)
+                    status = st.empty()
+                    total = max(upload.getvalue().count(b"\n"), 1)
+                    
+                    def show_progress(report):
+                        bar.progress(min((report.rows + report.skipped) / total, 1.0))
+                        status.text(f"{report.rows + report.skipped} rows read, {report.inserted} inserted, "
+                                    f"{len(report.errors)} rejected - {report.rate:,.0f} rows/s")
+                    
+                    try:
+                        report = importer.import_stream(upload, upload.name, kind, restart=restart, on_batch=show_progress)
+                    finally:
+                        # Batches already committed stay in the database even if a later one fails
+                        readcache.invalidate("members" if kind == "renewals" else kind)
+                    bar.progress(1.0)
+                    if report.already_done:
+                        st.info(report.summary())
+                    else:
+                        st.success(f"✅ {report.summary()}")
+                    if report.errors:
+                        errors = pd.DataFrame(report.errors, columns=["row", "error"])
+                        st.dataframe(errors.head(1000), use_container_width=True)
+                        st.download_button("Download rejected rows", errors.to_csv(index=False), "rejected_rows.csv", "text/csv")
+
     # ─── Transactions ───────────────────────────────
     elif page == "Transactions":
         st.title("Transactions")
-        action = st.selectbox("Action", ["Check Availability", "Issue Item", "Return Item", "Pay Fine"])
+        action = st.selectbox("Action", ["Check Availability", "Issue Item", "Return Item", "Pay Fine",
+                                         "Batch Issue", "Batch Return", "Holds"])
 
         if action == "Check Availability":
-            name = st.text_input("Title (partial search)")
+            name = st.text_input("Title, author or category (partial search)")
             if st.button("Search"):
-                conn = get_connection()
-                df = pd.read_sql_query("SELECT serial_no, name, author, status FROM products WHERE name LIKE ?",
-                                       conn, params=(f"%{name}%",))
-                conn.close()
-                if df.empty:
-                    st.info("No items found.")
+                st.session_state.search_term = name
+                st.session_state.search_page = 1
+            
+            if st.session_state.get('search_term') is not None:
+                term = st.session_state.search_term
+                rows, has_more = readcache.cached(("products",), search_products, term, st.session_state.search_page)
+                hint = None if rows else readcache.cached(("products",), suggest, term)
+                if not rows:
+                    st.info("No items found." + (f" 💡 Did you mean: **{hint}**?" if hint else ""))
                 else:
-                    st.dataframe(df)
+                    st.dataframe(pd.DataFrame(rows, columns=["name", "author", "category", "type", "copies",
+                                                             "available", "issued", "on the shelf"]))
+                    col1, col2, col3 = st.columns([1, 1, 4])
+                    with col1:
+                        if st.session_state.search_page > 1 and st.button("◀ Previous"):
+                            st.session_state.search_page -= 1
+                            st.rerun()
+                    with col2:
+                        if has_more and st.button("Next ▶"):
+                            st.session_state.search_page += 1
+                            st.rerun()
+                    with col3:
+                        st.caption(f"Page {st.session_state.search_page}")
 
         elif action == "Issue Item":
             st.subheader("Issue Item to Member")
@@ -380,14 +436,18 @@ else:
             # Show available items
             with st.expander("📚 Click to see available items", expanded=False):
                 conn = get_connection()
-                available = pd.read_sql_query(
-                    "SELECT serial_no, name, author, type, COALESCE(status, 'Available') AS status FROM products WHERE COALESCE(status, 'Available') = 'Available' ORDER BY serial_no",
-                    conn)
-                conn.close()
-                if available.empty:
+                try:
+                    total, rows = api.available_items(conn)
+                finally:
+                    conn.close()
+                if not rows:
                     st.warning("❌ No items available.")
                 else:
-                    st.dataframe(available, use_container_width=True)
+                    if total > len(rows):
+                        st.caption(f"First {len(rows):,} of {total:,} available copies; "
+                                   f"use Check Availability to find a title.")
+                    st.dataframe(pd.DataFrame(rows, columns=["serial_no", "name", "author", "type"]),
+                                 use_container_width=True)
             
             col1, col2 = st.columns(2)
             with col1:
@@ -396,7 +456,8 @@ else:
                 member_id = st.text_input("Member ID", placeholder="e.g., 1, 2, 3...")
             
             issue_date = st.date_input("Issue Date", value=datetime.today(), key="issue_date_picker")
-            return_date = st.date_input("Expected Return Date", key="return_date_picker")
+            return_date = st.date_input("Expected Return Date", value=None, key="return_date_picker",
+                                        help="Leave empty for the loan policy's due date")
             remarks = st.text_area("Remarks (optional)", height=60, key="issue_remarks")
             
             if st.button("Issue Item", key="issue_btn"):
@@ -404,43 +465,31 @@ else:
                     st.error("❌ Enter serial number.")
                 elif not member_id:
                     st.error("❌ Enter member ID.")
-                elif return_date <= issue_date:
+                elif return_date is not None and return_date <= issue_date:
                     st.error("❌ Return date must be after issue date.")
                 else:
                     conn = get_connection()
-                    c = conn.cursor()
-                    
-                    # Check if member exists
-                    c.execute("SELECT id, first_name, last_name FROM members WHERE id = ?", (member_id,))
-                    member = c.fetchone()
-                    if not member:
-                        st.error(f"❌ Member ID {member_id} not found.")
-                        conn.close()
-                    else:
-                        # Check if product exists and is available
-                        c.execute("SELECT id, COALESCE(status, 'Available') as status, name FROM products WHERE serial_no = ?", (serial,))
-                        prod = c.fetchone()
-                        if not prod:
-                            st.error(f"❌ Serial '{serial}' not found. See available items above.")
-                            # Show similar serials for help
-                            c.execute("SELECT serial_no FROM products WHERE serial_no LIKE ? LIMIT 5", (f"%{serial}%",))
-                            similar = c.fetchall()
+                    try:
+                        item_name, member_name, due = api.issue_item(conn, serial, member_id, str(issue_date),
+                                                                     return_date and str(return_date), remarks)
+                    except ValueError as e:
+                        st.error(f"❌ {e}")
+                        # Show similar serials for help
+                        try:
+                            api.get_item(conn, serial)
+                        except NotFound:
+                            similar = suggest_serials(conn, serial)
                             if similar:
-                                st.info("💡 Did you mean: " + ", ".join([s[0] for s in similar]))
-                        elif prod[1] != 'Available':
-                            st.error(f"❌ Serial {serial} ({prod[2]}) is {prod[1]}. Cannot issue.")
-                        else:
-                            c.execute("INSERT INTO issues (product_id, member_id, issue_date, return_date, remarks) VALUES (?,?,?,?,?)",
-                                      (prod[0], member_id, str(issue_date), str(return_date), remarks))
-                            c.execute("UPDATE products SET status = 'Issued' WHERE id = ?", (prod[0],))
-                            conn.commit()
-                            member_name = f"{member[1]} {member[2]}"
-                            st.success(f"""
-                            ✅ **Item issued successfully!**
-                            - Serial: {serial} ({prod[2]})
-                            - Member: {member_name}
-                            - Due: {return_date}
-                            """)
+                                st.info("💡 Did you mean: " + ", ".join(similar))
+                    else:
+                        readcache.invalidate("issues", "products", "requests")
+                        st.success(f"""
+                        ✅ **Item issued successfully!**
+                        - Serial: {serial} ({item_name})
+                        - Member: {member_name}
+                        - Due: {due}
+                        """)
+                    finally:
                         conn.close()
 
         elif action == "Return Item":
@@ -448,21 +497,15 @@ else:
             
             # Show active issues
             with st.expander("📋 Click to see active issues (items to return)", expanded=False):
-                conn = get_connection()
-                active = pd.read_sql_query("""
-                    SELECT p.serial_no, p.name, m.first_name || ' ' || m.last_name AS member_name, 
-                           i.issue_date, i.return_date
-                    FROM issues i
-                    JOIN products p ON i.product_id = p.id
-                    LEFT JOIN members m ON i.member_id = m.id
-                    WHERE i.actual_return_date IS NULL
-                    ORDER BY i.return_date
-                """, conn)
-                conn.close()
-                if active.empty:
+                active = reports.REPORTS['active']
+                rows, more = readcache.cached(readcache.tables_in("FROM " + active.source), reports.fetch_page,
+                                              active, 'return_date')
+                if not rows:
                     st.info("No active issues.")
                 else:
-                    st.dataframe(active, use_container_width=True)
+                    st.dataframe(pd.DataFrame(rows, columns=active.labels), use_container_width=True)
+                    if more is not None:
+                        st.caption("Soonest due first; Reports → Active Issues lists them all.")
             
             col1, col2 = st.columns(2)
             with col1:
@@ -475,36 +518,29 @@ else:
             
             if st.button("Calculate Fine", key="calc_fine_btn"):
                 conn = get_connection()
-                c = conn.cursor()
-                c.execute("""SELECT i.id, i.return_date, i.member_id, p.id, m.pending_fine, p.name, m.first_name, m.last_name
-                             FROM issues i 
-                             JOIN products p ON i.product_id = p.id 
-                             LEFT JOIN members m ON i.member_id = m.id
-                             WHERE p.serial_no = ? AND i.actual_return_date IS NULL""", (serial,))
-                issue = c.fetchone()
-                conn.close()
-                
-                if issue:
-                    issue_id, expected_str, member_id, prod_id, existing_fine, item_name, fname, lname = issue
-                    # Use date-only arithmetic to avoid time-related issues
-                    expected_date = datetime.strptime(expected_str, "%Y-%m-%d").date()
-                    actual_date = return_date
-                    new_fine = max(0, (actual_date - expected_date).days) * 1.0
-                    existing_fine = existing_fine if existing_fine is not None else 0.0
+                try:
+                    item_name, member_id, loan_fine, accrued, existing_fine = api.preview_return(conn, serial,
+                                                                                                 str(return_date))
+                except ValueError:
+                    st.error(f"❌ No active issue found for serial {serial}")
+                else:
+                    # The nightly accrual has already added part of it to the pending fine
+                    new_fine = loan_fine - accrued
                     total_fine = existing_fine + new_fine
                     
                     st.session_state.return_data = {
-                        "issue_id": issue_id,
-                        "prod_id": prod_id,
+                        "serial": serial,
                         "member_id": member_id,
+                        "loan_fine": loan_fine,
+                        "accrued": accrued,
                         "new_fine": new_fine,
                         "existing_fine": existing_fine,
                         "total_fine": total_fine,
                         "return_date": str(return_date),
                         "remarks": remarks
                     }
-                else:
-                    st.error(f"❌ No active issue found for serial {serial}")
+                finally:
+                    conn.close()
             
             if hasattr(st.session_state, 'return_data') and st.session_state.return_data:
                 data = st.session_state.return_data
@@ -512,6 +548,7 @@ else:
                 st.divider()
                 st.info(f"""
                 **Fine Breakdown:**
+                - Late fine for this item: ₹{data['loan_fine']:.2f} (₹{data['accrued']:.2f} already accrued)
                 - New fine (from this return): ₹{data['new_fine']:.2f}
                 - Existing pending fine: ₹{data['existing_fine']:.2f}
                 - **Total fine due: ₹{data['total_fine']:.2f}**
@@ -523,50 +560,51 @@ else:
                     st.subheader("Return without payment")
                     if st.button("Return Item Only", key="return_only_btn"):
                         conn = get_connection()
-                        c = conn.cursor()
-                        c.execute("UPDATE issues SET actual_return_date = ?, fine_amount = ?, remarks = ? WHERE id = ?",
-                                  (data['return_date'], data['new_fine'], remarks, data['issue_id']))
-                        c.execute("UPDATE products SET status = 'Available' WHERE id = ?", (data['prod_id'],))
-                        if data['new_fine'] > 0:
-                            c.execute("UPDATE members SET pending_fine = COALESCE(pending_fine, 0) + ? WHERE id = ?",
-                                      (data['new_fine'], data['member_id']))
-                        conn.commit()
-                        conn.close()
-                        st.success(f"✅ Item returned. Fine: ₹{data['new_fine']:.2f}")
-                        st.session_state.return_data = None
-                        st.rerun()
+                        try:
+                            # Re-checked and billed in the service's transaction; another desk may have got there first
+                            _, loan_fine, _, _, held_for = api.return_item(conn, data['serial'], data['return_date'], remarks)
+                        except ValueError as e:
+                            st.error(f"❌ {e}")
+                        else:
+                            readcache.invalidate("issues", "products", "members", "requests")
+                            st.success(f"✅ Item returned. Fine: ₹{loan_fine:.2f}"
+                                       + (f" — held for member {held_for}" if held_for is not None else ""))
+                            st.session_state.return_data = None
+                            st.rerun()
+                        finally:
+                            conn.close()
                 
                 with col2:
                     st.subheader("Return & Pay Fine")
-                    pay_amount = st.number_input("Amount to pay now", min_value=0.0, max_value=data['total_fine'], 
-                                                 step=1.0, value=data['total_fine'], key="pay_on_return")
+                    if data['total_fine'] <= 0:
+                        st.caption("Nothing is owed; use Return Item Only.")
+                    else:
+                        pay_amount = st.number_input("Amount to pay now", min_value=0.0, max_value=max(0.0, data['total_fine']),
+                                                     step=1.0, value=max(0.0, data['total_fine']), key="pay_on_return")
                     
-                    if st.button("Return & Pay Fine", key="return_pay_btn"):
-                        if pay_amount > 0:
-                            conn = get_connection()
-                            c = conn.cursor()
-                            # Update issue return
-                            c.execute("UPDATE issues SET actual_return_date = ?, fine_amount = ?, remarks = ? WHERE id = ?",
-                                      (data['return_date'], data['new_fine'], remarks, data['issue_id']))
-                            c.execute("UPDATE products SET status = 'Available' WHERE id = ?", (data['prod_id'],))
-                            
-                            # Update member fine
-                            new_pending = data['total_fine'] - pay_amount
-                            c.execute("UPDATE members SET pending_fine = ? WHERE id = ?", (new_pending, data['member_id']))
-                            
-                            conn.commit()
-                            conn.close()
-                            
-                            st.success(f"""
-                            ✅ **Item returned successfully!**
-                            - New fine from return: ₹{data['new_fine']:.2f}
-                            - Payment received: ₹{pay_amount:.2f}
-                            - Remaining balance: ₹{new_pending:.2f}
-                            """)
-                            st.session_state.return_data = None
-                            st.rerun()
-                        else:
-                            st.warning("Enter amount to pay.")
+                        if st.button("Return & Pay Fine", key="return_pay_btn"):
+                            if pay_amount > 0:
+                                conn = get_connection()
+                                try:
+                                    # Return, fine and payment commit together, or not at all
+                                    _, _, new_fine, new_pending, held_for = api.return_item(
+                                        conn, data['serial'], data['return_date'], remarks, payment=pay_amount)
+                                except ValueError as e:
+                                    st.error(f"❌ {e}")
+                                else:
+                                    readcache.invalidate("issues", "products", "members", "requests")
+                                    st.success(f"""
+                                    ✅ **Item returned successfully!**
+                                    - New fine from return: ₹{new_fine:.2f}
+                                    - Payment received: ₹{pay_amount:.2f}
+                                    - Remaining balance: ₹{new_pending:.2f}
+                                    """ + (f"- Held for member {held_for}" if held_for is not None else ""))
+                                    st.session_state.return_data = None
+                                    st.rerun()
+                                finally:
+                                    conn.close()
+                            else:
+                                st.warning("Enter amount to pay.")
 
         elif action == "Pay Fine":
             with st.form("pay_fine_form"):
@@ -576,70 +614,163 @@ else:
                 submitted = st.form_submit_button("Pay Fine")
                 if submitted and amount > 0:
                     conn = get_connection()
-                    c = conn.cursor()
-                    c.execute("SELECT pending_fine FROM members WHERE id = ?", (member_id,))
-                    row = c.fetchone()
-                    if row:
-                        current = row[0] if row[0] is not None else 0.0
-                        if amount <= current:
-                            new_fine = current - amount
-                            c.execute("UPDATE members SET pending_fine = ? WHERE id = ?", (new_fine, member_id))
-                            conn.commit()
-                            st.success(f"✅ Payment accepted. Remaining: ₹{new_fine:.2f}")
-                        else:
-                            st.error(f"❌ Cannot pay more than pending (₹{current:.2f}). Amount to pay: ₹{amount:.2f}")
+                    try:
+                        new_fine = api.pay_fine(conn, member_id, amount)
+                    except ValueError as e:
+                        st.error(f"❌ {e}")
+                    else:
+                        readcache.invalidate("members")
+                        st.success(f"✅ Payment accepted. Remaining: ₹{new_fine:.2f}")
+                    finally:
+                        conn.close()
+
+        elif action == "Batch Issue":
+            st.subheader("Batch Issue (scanner)")
+            member_id = st.text_input("Member ID", key="batch_member_id")
+            scans = st.text_area("Scan serials (one per line)", height=200, key="batch_issue_scans")
+            serials = api.parse_serials(scans)
+            st.caption(f"{len(serials)} item(s) scanned")
+            col1, col2 = st.columns(2)
+            with col1:
+                issue_date = st.date_input("Issue Date", value=datetime.today(), key="batch_issue_date")
+            with col2:
+                return_date = st.date_input("Expected Return Date", value=None, key="batch_return_due",
+                                            help="Leave empty for each item's loan policy")
+            remarks = st.text_input("Remarks (optional)", key="batch_issue_remarks")
+            
+            if st.button("Issue All", key="batch_issue_btn"):
+                if not member_id:
+                    st.error("❌ Enter member ID.")
+                elif not serials:
+                    st.error("❌ Scan at least one serial.")
+                elif return_date is not None and return_date <= issue_date:
+                    st.error("❌ Return date must be after issue date.")
+                else:
+                    conn = get_connection()
+                    try:
+                        result = api.issue_batch(conn, member_id, serials, str(issue_date),
+                                                 return_date and str(return_date), remarks)
+                    except ValueError as e:
+                        st.error(f"❌ {e}")
                     else:
-                        st.error("Member not found.")
+                        readcache.invalidate("issues", "products", "requests")
+                        show_batch_result(result)
+                    finally:
+                        conn.close()
+
+        elif action == "Batch Return":
+            st.subheader("Batch Return (scanner)")
+            scans = st.text_area("Scan serials (one per line)", height=200, key="batch_return_scans")
+            serials = api.parse_serials(scans)
+            st.caption(f"{len(serials)} item(s) scanned")
+            return_date = st.date_input("Actual Return Date", value=datetime.today(), key="batch_return_date")
+            remarks = st.text_input("Remarks (optional)", key="batch_return_remarks")
+            
+            if st.button("Return All", key="batch_return_btn"):
+                if not serials:
+                    st.error("❌ Scan at least one serial.")
+                else:
+                    conn = get_connection()
+                    result = api.return_batch(conn, serials, str(return_date), remarks)
                     conn.close()
+                    readcache.invalidate("issues", "products", "members", "requests")
+                    show_batch_result(result)
+
+        elif action == "Holds":
+            st.subheader("Hold Queue")
+            title = st.text_input("Title (exact)", key="hold_title")
+            
+            with st.form("place_hold_form"):
+                member_id = st.text_input("Member ID", key="hold_member_id")
+                if st.form_submit_button("Place Hold"):
+                    if not title or not member_id:
+                        st.error("❌ Enter title and member ID.")
+                    else:
+                        conn = get_connection()
+                        try:
+                            request_id, position, held_serial = api.place_hold(conn, member_id, title)
+                            eta = api.hold_estimate(conn, title, position) if position else None
+                        except ValueError as e:
+                            st.error(f"❌ {e}")
+                        else:
+                            readcache.invalidate("requests", "products")
+                            if held_serial:
+                                st.success(f"✅ A copy is on the shelf: serial {held_serial} is held for member {member_id}.")
+                            else:
+                                st.success(f"✅ Hold #{request_id} placed: position {position}, "
+                                           f"expected around {eta or 'unknown'}.")
+                        finally:
+                            conn.close()
+            
+            if title:
+                waiting = readcache.cached(("requests", "members", "products", "issues"), api.hold_queue, title)
+                if not waiting:
+                    st.info("Nobody is waiting for this title.")
+                else:
+                    st.dataframe(pd.DataFrame(waiting, columns=["request_id", "member_id", "member_name", "requested_date",
+                                                                "position", "expected"]),
+                                 hide_index=True, use_container_width=True)
+                    cancel_id = st.selectbox("Cancel hold", [w[0] for w in waiting], key="hold_cancel_id",
+                                             format_func=lambda r: f"#{r}")
+                    if st.button("Cancel Hold", key="hold_cancel_btn"):
+                        conn = get_connection()
+                        cancelled = api.cancel_hold(conn, cancel_id)
+                        conn.close()
+                        readcache.invalidate("requests")
+                        if cancelled:
+                            st.success(f"✅ Hold #{cancel_id} cancelled.")
+                            st.rerun()
+                        else:
+                            st.error(f"❌ Hold #{cancel_id} is no longer waiting.")
 
     # ─── Reports ────────────────────────────────────
     elif page == "Reports":
         st.title("Reports")
-        report_type = st.selectbox("Select Report", [
-            "Books Master List", "Movies Master List",
-            "Members Master List", "Active Issues", "Overdue Items", "Pending Requests"
-        ])
+        report_id = st.selectbox("Select Report", list(reports.REPORTS), format_func=lambda r: reports.REPORTS[r].title)
+        report = reports.REPORTS[report_id]
+        
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            sort = st.selectbox("Sort by", report.labels, index=report.labels.index(report.sort), key=f"sort_{report_id}")
+        with col2:
+            descending = st.checkbox("Descending", value=report.descending, key=f"desc_{report_id}")
+        filters = {}
+        if report.filters:
+            for col, label in zip(st.columns(len(report.filters)), report.filters):
+                with col:
+                    value = st.text_input(f"Filter: {label}", key=f"filter_{report_id}_{label}").strip()
+                    if value:
+                        filters[label] = value
+        period = None
+        if report.period:
+            # Archived loan history is only read when the period reaches back into it
+            col1, col2 = st.columns(2)
+            with col1:
+                since = st.date_input("From", value=datetime.today() - pd.Timedelta(days=365), key=f"since_{report_id}")
+            with col2:
+                until = st.date_input("To", value=datetime.today(), key=f"until_{report_id}")
+            period = (str(since), str(until))
+        view = (report_id, sort, descending, tuple(sorted(filters.items())), period)
 
         if st.button("Generate Report"):
-            conn = get_connection()
-            if report_type == "Books Master List":
-                df = pd.read_sql_query("SELECT serial_no, name, author, category, status, cost FROM products WHERE type='Book' ORDER BY name", conn)
-            elif report_type == "Movies Master List":
-                df = pd.read_sql_query("SELECT serial_no, name, author, category, status, cost FROM products WHERE type='Movie' ORDER BY name", conn)
-            elif report_type == "Members Master List":
-                df = pd.read_sql_query("""SELECT id, first_name, last_name, contact_name, aadhar_no, start_date, end_date, status, pending_fine 
-                                          FROM members ORDER BY first_name, last_name""", conn)
-            elif report_type == "Active Issues":
-                df = pd.read_sql_query("""SELECT p.serial_no, p.name, p.type, m.first_name || ' ' || m.last_name AS member_name, 
-                                                  i.member_id, i.issue_date, i.return_date 
-                                          FROM issues i 
-                                          JOIN products p ON i.product_id = p.id 
-                                          LEFT JOIN members m ON i.member_id = m.id
-                                          WHERE i.actual_return_date IS NULL
-                                          ORDER BY i.issue_date""", conn)
-            elif report_type == "Overdue Items":
-                today = datetime.now().strftime("%Y-%m-%d")
-                df = pd.read_sql_query(f"""SELECT p.serial_no, p.name, p.type, m.first_name || ' ' || m.last_name AS member_name,
-                                                  i.member_id, i.issue_date, i.return_date,
-                                                  CAST(julianday('{today}') - julianday(i.return_date) AS INTEGER) AS days_overdue
-                                           FROM issues i 
-                                           JOIN products p ON i.product_id = p.id 
-                                           LEFT JOIN members m ON i.member_id = m.id
-                                           WHERE i.actual_return_date IS NULL AND i.return_date < '{today}'
-                                           ORDER BY i.return_date""", conn)
-            elif report_type == "Pending Requests":
-                df = pd.read_sql_query("""SELECT id, member_id, product_name, requested_date, fulfilled_date, 
-                                          CASE WHEN fulfilled_date IS NULL THEN 'Pending' ELSE 'Fulfilled' END AS status
-                                          FROM requests ORDER BY requested_date DESC""", conn)
-            
-            conn.close()
-
-            if df.empty:
+            # Keyset pagination: remember where every page starts
+            st.session_state.report_view = view
+            st.session_state.report_pages = [None]
+
+        if st.session_state.get('report_view') == view:
+            pages_seen = st.session_state.report_pages
+            rows, next_cursor = readcache.cached(readcache.tables_in("FROM " + report.source.format(loans="issues")),
+                                                 reports.fetch_page, report, sort, descending, filters,
+                                                 after=pages_seen[-1], period=period)
+            df = pd.DataFrame(rows, columns=report.labels)
+
+            if df.empty and len(pages_seen) == 1:
                 st.info("No active issues found.")
                 # Show books/movies with "Issued" status as reference
-                conn = get_connection()
-                issued_items = pd.read_sql_query("""SELECT serial_no, name, type, status FROM products WHERE status = 'Issued' ORDER BY name""", conn)
-                conn.close()
+                copies = reports.REPORTS['copies']
+                rows, _ = readcache.cached(("products",), reports.fetch_page, copies, 'name',
+                                           filters={'status': 'Issued'}, page_size=100)
+                issued_items = pd.DataFrame(rows, columns=copies.labels)
                 if not issued_items.empty:
                     st.subheader("Items marked as Issued (but no issue record):")
                     st.dataframe(issued_items)
@@ -648,16 +779,86 @@ else:
                     st.info("💡 Tip: To create active issues, go to Transactions → Issue Item. Then this report will show them.")
             else:
                 st.dataframe(df)
+                col1, col2, col3 = st.columns([1, 1, 4])
+                with col1:
+                    if len(pages_seen) > 1 and st.button("◀ Previous", key="report_prev"):
+                        pages_seen.pop()
+                        st.rerun()
+                with col2:
+                    if next_cursor is not None and st.button("Next ▶", key="report_next"):
+                        pages_seen.append(next_cursor)
+                        st.rerun()
+                with col3:
+                    st.caption(f"Page {len(pages_seen)} · {reports.PAGE_SIZE} rows per page")
 
-# Initialize DB on first run
-if __name__ == "__main__":
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM users")
-    if c.fetchone()[0] == 0:
-        c.execute("INSERT INTO users (username, password, is_admin, is_active) VALUES (?,?,1,1)",
-                  ('adm', hash_password('adm')))
-        c.execute("INSERT INTO users (username, password, is_admin, is_active) VALUES (?,?,0,1)",
-                  ('user', hash_password('user')))
-        conn.commit()
-    conn.close()
\ No newline at end of file
+                st.divider()
+                fmt = st.radio("Export all rows as", ["CSV", "Parquet"], horizontal=True, key="report_export_fmt")
+                if st.button("Prepare Export", key="report_export_btn"):
+                    ext = fmt.lower()
+                    path = os.path.join(tempfile.gettempdir(), f"library_{report_id}.{ext}")
+                    conn = get_connection()
+                    try:
+                        count = reports.export(conn, report, path, ext, sort=sort, descending=descending, filters=filters,
+                                               period=period)
+                    except RuntimeError as e:
+                        st.error(str(e))
+                    else:
+                        with open(path, "rb") as f:
+                            st.download_button(f"Download {count} rows ({fmt})", f, file_name=f"{report_id}.{ext}")
+                    finally:
+                        conn.close()
+
+    # ─── Diagnostics (Admin only) ───────────────────
+    elif page == "Diagnostics" and st.session_state.is_admin:
+        st.title("Diagnostics")
+        st.caption(f"Statements run by this app process since it started (or the last reset). "
+                   f"Executions over {instrument.SLOW_MS:g} ms are logged with their query plan.")
+        counters = instrument.snapshot()
+        if not instrument.ENABLED:
+            st.info("Instrumentation is off (LIBRARY_INSTRUMENT=0).")
+        elif not counters:
+            st.info("No statements recorded yet.")
+        else:
+            df = pd.DataFrame(counters)
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Statements", f"{df['calls'].sum():,}")
+            c2.metric("Time in SQLite", f"{df['total_ms'].sum() / 1000:,.2f} s")
+            c3.metric("Slow executions", f"{df['slow'].sum():,}")
+            st.subheader("By total time")
+            st.dataframe(df, hide_index=True, use_container_width=True)
+
+        slow = instrument.slow_queries()
+        if slow:
+            st.subheader("Slow queries")
+            for entry in slow:
+                with st.expander(f"{entry['at']} · {entry['ms']} ms · {entry['rows']} rows · {entry['statement'][:80]}"):
+                    st.code(entry['statement'], language="sql")
+                    if entry['plan']:
+                        st.text(entry['plan'])
+
+        col1, col2 = st.columns([1, 4])
+        with col1:
+            if st.button("Reset counters", key="diag_reset"):
+                instrument.reset()
+                st.rerun()
+        with col2:
+            st.download_button("Download Prometheus metrics", instrument.prometheus(), file_name="library_sql.prom",
+                               mime="text/plain")
+
+        st.subheader("Availability index")
+        conn = get_connection()
+        try:
+            st.caption("Copy statuses held in memory by this process (availability.py).")
+            st.dataframe(pd.DataFrame(sorted(availability.counts(conn).items()), columns=["status", "copies"]),
+                         hide_index=True)
+            if st.button("Check against the database", key="diag_availability"):
+                mismatches = availability.check(conn)
+                if mismatches:
+                    st.error(f"{len(mismatches)} cop(ies) differ; the index will be reloaded.")
+                    st.dataframe(pd.DataFrame(mismatches[:100], columns=["product_id", "index", "table"]).astype(str),
+                                 hide_index=True)
+                    availability.warm(conn)
+                else:
+                    st.success("The index matches the products table.")
+        finally:
+            conn.close()
@@ -1,21 +1,22 @@
+import logging
+import os
 import sqlite3
-from datetime import datetime, timedelta
-import hashlib
+import threading
+from db import get_connection, get_db_path
+from migrations import migrate, current_version, LATEST_VERSION
+from search import search_products, suggest
+import api
+from api import DEFAULT_TIER, TIERS, category_map, membership_days, hash_password, parse_date
+from reports import REPORTS, fetch_page
 
-# Category mapping for serial numbers
-category_map = {
-    'Science': 'SC',
-    'Economics': 'EC',
-    'Fiction': 'FC',
-    'Children': 'CH',
-    'Personal Development': 'PD'
-}
+log = logging.getLogger(__name__)
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+# Database files already checked by bootstrap() in this process
+_bootstrapped = set()
+_bootstrap_lock = threading.Lock()
 
 def create_db():
-    conn = sqlite3.connect('library.db')
+    conn = get_connection()
     c = conn.cursor()
     
     c.execute('''CREATE TABLE IF NOT EXISTS users
@@ -45,19 +46,50 @@ def create_db():
               ('user', hash_password('user')))
 
     conn.commit()
+    migrate(conn)
     conn.close()
 
+def _schema_ready(conn):
+    # Read-only health check: fully migrated and the default logins present
+    try:
+        if current_version(conn) < LATEST_VERSION:
+            return False
+        c = conn.execute("SELECT COUNT(*) FROM users WHERE username IN ('adm', 'user')")
+        return c.fetchone()[0] == 2
+    except sqlite3.OperationalError:   # no users table yet
+        return False
+
+def bootstrap():
+    """Run create_db() at most once per process and database file.
+
+    Returns True on the first call for the current database.  Later calls do
+    not touch the database at all, and a database that is already up to date
+    is only read, so per-request code paths (Streamlit reruns) never write.
+    """
+    path = os.path.realpath(get_db_path())
+    if path in _bootstrapped:
+        return False
+    with _bootstrap_lock:
+        if path in _bootstrapped:
+            return False
+        conn = get_connection()
+        try:
+            ready = _schema_ready(conn)
+            version = current_version(conn)
+        finally:
+            conn.close()
+        if not ready:
+            log.info("Initialising %s (schema version %d -> %d)", path, version, LATEST_VERSION)
+            create_db()
+        log.info("Database %s ready (schema version %d)", path, LATEST_VERSION)
+        _bootstrapped.add(path)
+    return True
+
 def validate_date(date_str, field_name="Date"):
-    if not date_str:
-        print(f"{field_name} is required.")
-        return None
     try:
-        dt = datetime.strptime(date_str, "%Y-%m-%d")
-        if dt.year < 2000 or dt.year > 2035:
-            raise ValueError
-        return dt
-    except ValueError:
-        print(f"Invalid {field_name}. Use YYYY-MM-DD (example: 2025-04-15)")
+        return parse_date(date_str, field_name)
+    except ValueError as e:
+        print(e)
         return None
 
 def login():
@@ -69,16 +101,12 @@ def login():
         print("Both fields required.")
         return None
     
-    hashed = hash_password(password)
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    c.execute("SELECT is_admin FROM users WHERE username = ? AND password = ? AND is_active = 1", 
-              (user_id, hashed))
-    result = c.fetchone()
+    conn = get_connection()
+    user = api.login(conn, user_id, password)
     conn.close()
     
-    if result:
-        return result[0]  # 1 = admin, 0 = user
+    if user:
+        return user.is_admin  # 1 = admin, 0 = user
     print("Invalid credentials.")
     return None
 
@@ -133,80 +161,68 @@ def add_membership():
     aadhar = input("Aadhar No: ").strip()
     start = input("Start Date (YYYY-MM-DD): ").strip()
     
-    print("1. 6 months   2. 1 year   3. 2 years")
+    durations = list(membership_days)
+    print("   ".join(f"{i}. {d}" for i, d in enumerate(durations, 1)))
     mtype = input("Membership type: ").strip()
-    days = {'1':180, '2':365, '3':730}.get(mtype)
-    if not days:
+    if mtype not in [str(i) for i in range(1, len(durations) + 1)]:
         print("Invalid type.")
         return
+    tier = DEFAULT_TIER
+    if len(TIERS) > 1:
+        print("   ".join(f"{i}. {t}" for i, t in enumerate(TIERS, 1)))
+        choice = input("Tier [1]: ").strip() or '1'
+        if choice not in [str(i) for i in range(1, len(TIERS) + 1)]:
+            print("Invalid tier.")
+            return
+        tier = TIERS[int(choice) - 1]
     
-    start_dt = validate_date(start, "Start Date")
-    if not start_dt: return
-    
-    end_date = (start_dt + timedelta(days=days)).strftime("%Y-%m-%d")
-    
-    if not all([first, last, contact, address, aadhar, start]):
-        print("All fields required.")
+    conn = get_connection()
+    try:
+        member = api.add_member(conn, first, last, contact, address, aadhar, start, durations[int(mtype) - 1], tier)
+    except ValueError as e:
+        print(e)
         return
-    
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    c.execute("""INSERT INTO members (first_name, last_name, contact_name, contact_address, aadhar_no, start_date, end_date, status)
-                 VALUES (?,?,?,?,?,?,?,'Active')""",
-              (first, last, contact, address, aadhar, start, end_date))
-    conn.commit()
-    print(f"Member added. ID = {c.lastrowid}")
-    conn.close()
+    finally:
+        conn.close()
+    print(f"Member added. ID = {member.id}")
 
 def update_membership():
     mid = input("Member ID: ").strip()
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    c.execute("SELECT end_date, status FROM members WHERE id = ?", (mid,))
-    row = c.fetchone()
-    if not row:
-        print("Member not found.")
-        conn.close()
-        return
-    
-    print(f"Current end date: {row[0]} | Status: {row[1]}")
-    action = input("1. Extend   2. Cancel membership   3. Cancel: ").strip()
-    
-    if action == '1':
-        print("1. +6 months   2. +1 year   3. +2 years")
-        ext = input("Extend by: ").strip()
-        days = {'1':180, '2':365, '3':730}.get(ext)
-        if not days:
-            print("Invalid.")
-            conn.close()
-            return
-        new_end = (datetime.strptime(row[0], "%Y-%m-%d") + timedelta(days=days)).strftime("%Y-%m-%d")
-        c.execute("UPDATE members SET end_date = ? WHERE id = ?", (new_end, mid))
-        print("Membership extended.")
-    
-    elif action == '2':
-        c.execute("UPDATE members SET status = 'Inactive' WHERE id = ?", (mid,))
-        print("Membership cancelled.")
-    
-    else:
+    conn = get_connection()
+    try:
+        member = api.get_member(conn, mid)
+        print(f"Current end date: {member.end_date} | Status: {member.status} | Tier: {member.tier or '-'}")
+        action = input("1. Extend   2. Cancel membership   3. Cancel: ").strip()
+        
+        if action == '1':
+            durations = list(membership_days)
+            print("   ".join(f"{i}. +{d}" for i, d in enumerate(durations, 1)))
+            ext = input("Extend by: ").strip()
+            if ext not in [str(i) for i in range(1, len(durations) + 1)]:
+                print("Invalid.")
+                return
+            new_end = api.extend_membership(conn, mid, durations[int(ext) - 1])
+            print(f"Membership extended to {new_end}.")
+        elif action == '2':
+            api.cancel_membership(conn, mid)
+            print("Membership cancelled.")
+    except ValueError as e:
+        print(e)
+    finally:
         conn.close()
-        return
-    
-    conn.commit()
-    conn.close()
 
 def add_product():
     print("\n--- Add Book / Movie ---")
     typ = input("1 = Book   2 = Movie: ").strip()
-    if typ == '1': ptype, code = 'Book', 'B'
-    elif typ == '2': ptype, code = 'Movie', 'M'
+    if typ == '1': ptype = 'Book'
+    elif typ == '2': ptype = 'Movie'
     else:
         print("Invalid.")
         return
     
     name = input("Title: ").strip()
     author = input("Author / Director: ").strip()
-    cat = input("Category (Science/Economics/Fiction/Children/Personal Development): ").strip()
+    cat = input(f"Category ({'/'.join(category_map)}): ").strip()
     if cat not in category_map:
         print("Invalid category.")
         return
@@ -214,53 +230,28 @@ def add_product():
     proc_date = input("Procurement Date (YYYY-MM-DD): ").strip()
     qty = input("Quantity (default 1): ").strip() or "1"
     
+    conn = get_connection()
     try:
-        qty = int(qty)
-        cost = float(cost)
-        validate_date(proc_date, "Procurement Date")
-    except:
-        print("Invalid number or date.")
+        first, last = api.add_item(conn, ptype, name, author, cat, cost, proc_date, qty)
+    except ValueError as e:
+        print(e)
         return
-    
-    if not all([name, author, proc_date]):
-        print("Required fields missing.")
-        return
-    
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    
-    # Get the highest serial number from ALL products
-    c.execute("SELECT MAX(CAST(serial_no AS INTEGER)) FROM products")
-    max_serial = c.fetchone()[0] or 0
-    
-    for i in range(qty):
-        # Generate simple unique serial numbers: 01, 02, 03, etc.
-        serial = f"{max_serial + i + 1:02d}"
-        
-        c.execute("""INSERT INTO products (type, name, author, category, cost, procurement_date, serial_no)
-                     VALUES (?,?,?,?,?,?,?)""",
-                  (ptype, name, author, cat, cost, proc_date, serial))
-    
-    conn.commit()
-    print(f"{qty} item(s) added. (Serial: {max_serial + 1:02d} to {max_serial + qty:02d})")
-    conn.close()
+    finally:
+        conn.close()
+    print(f"{qty} item(s) added. (Serial: {first} to {last})")
 
 def update_product_status():
     serial = input("Serial Number: ").strip()
-    new_status = input("New status (Available / Issued): ").strip().capitalize()
-    if new_status not in ['Available', 'Issued']:
-        print("Invalid status.")
-        return
+    new_status = input(f"New status ({' / '.join(api.ITEM_STATUSES)}): ").strip().capitalize()
     
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    c.execute("UPDATE products SET status = ? WHERE serial_no = ?", (new_status, serial))
-    if c.rowcount == 0:
-        print("Serial not found.")
-    else:
+    conn = get_connection()
+    try:
+        api.set_item_status(conn, serial, new_status)
         print("Status updated.")
-    conn.commit()
-    conn.close()
+    except ValueError as e:
+        print(e)
+    finally:
+        conn.close()
 
 # ────────────────────────────────────────────────
 # TRANSACTIONS
@@ -272,58 +263,65 @@ def transactions_menu():
         print("2. Issue book/movie")
         print("3. Return book/movie")
         print("4. Pay fine")
-        print("5. Back")
+        print("5. Batch issue (scanner)")
+        print("6. Batch return (scanner)")
+        print("7. Place hold")
+        print("8. Hold queue")
+        print("9. Back")
         ch = input("Choose: ").strip()
         if ch == '1': check_availability()
         elif ch == '2': issue_item()
         elif ch == '3': return_item()
         elif ch == '4': pay_fine()
-        elif ch == '5': break
+        elif ch == '5': batch_issue()
+        elif ch == '6': batch_return()
+        elif ch == '7': place_hold()
+        elif ch == '8': hold_queue()
+        elif ch == '9': break
         else: print("Invalid.")
 
 def check_availability():
-    name = input("Title (partial ok): ").strip()
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    c.execute("SELECT serial_no, name, author, status FROM products WHERE name LIKE ? ORDER BY name",
-              (f"%{name}%",))
-    rows = c.fetchall()
-    conn.close()
-    
+    term = input("Title / Author / Category (partial ok): ").strip()
+    conn = get_connection()
+    page = 1
+    rows, has_more = search_products(conn, term, page)
     if not rows:
-        print("No items found.")
+        hint = suggest(conn, term)
+        conn.close()
+        print("No items found." + (f" Did you mean: {hint}?" if hint else ""))
         return
-    print("\nSerial        Title                           Author                  Status")
-    print("-"*75)
-    for r in rows:
-        print(f"{r[0]:<13} {r[1]:<30} {r[2]:<22} {r[3]}")
+    
+    print("\nTitle                           Author                  Available  On the shelf")
+    print("-"*90)
+    while True:
+        for r in rows:
+            print(f"{r[0]:<31} {r[1]:<23} {f'{r[5]} of {r[4]}':<10} {r[7] or '-'}")
+        if not has_more or input("More results? (y/n): ").strip().lower() != 'y':
+            break
+        page += 1
+        rows, has_more = search_products(conn, term, page)
+    conn.close()
 
 def issue_item():
     serial = input("Serial Number: ").strip()
     member_id = input("Member ID: ").strip()
     issue_d = input("Issue Date (YYYY-MM-DD): ").strip()
-    return_d = input("Return Date (YYYY-MM-DD): ").strip()
+    return_d = input("Return Date (YYYY-MM-DD, blank for the loan policy): ").strip() or None
     remarks = input("Remarks (optional): ").strip()
     
     issue_dt = validate_date(issue_d, "Issue Date")
-    return_dt = validate_date(return_d, "Return Date")
-    if not issue_dt or not return_dt: return
+    if not issue_dt: return
+    if return_d and not validate_date(return_d, "Return Date"): return
     
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    c.execute("SELECT id, status FROM products WHERE serial_no = ?", (serial,))
-    prod = c.fetchone()
-    if not prod or prod[1] != 'Available':
-        print("Item not available or not found.")
-        conn.close()
+    conn = get_connection()
+    try:
+        name, member, due = api.issue_item(conn, serial, member_id, issue_d, return_d, remarks)
+    except ValueError as e:
+        print(e)
         return
-    
-    c.execute("INSERT INTO issues (product_id, member_id, issue_date, return_date, remarks) VALUES (?,?,?,?,?)",
-              (prod[0], member_id, issue_d, return_d, remarks))
-    c.execute("UPDATE products SET status = 'Issued' WHERE id = ?", (prod[0],))
-    conn.commit()
-    print("Item issued.")
-    conn.close()
+    finally:
+        conn.close()
+    print(f"Item issued: {name} to {member}, due {due}.")
 
 def return_item():
     serial = input("Serial Number: ").strip()
@@ -333,32 +331,79 @@ def return_item():
     ret_dt = validate_date(ret_date, "Return Date")
     if not ret_dt: return
     
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    c.execute("""SELECT i.id, i.return_date, i.member_id, p.id 
-                 FROM issues i JOIN products p ON i.product_id = p.id 
-                 WHERE p.serial_no = ? AND i.actual_return_date IS NULL""", (serial,))
-    issue = c.fetchone()
-    if not issue:
-        print("No active issue found or already returned.")
-        conn.close()
+    conn = get_connection()
+    try:
+        name, fine, billed, balance, held_for = api.return_item(conn, serial, ret_date, remarks)
+    except ValueError as e:
+        print(e)
         return
-    
-    expected = datetime.strptime(issue[1], "%Y-%m-%d")
-    actual = ret_dt
-    fine = max(0, (actual - expected).days) * 1.0  # ₹1 per day late
-    
-    c.execute("UPDATE issues SET actual_return_date = ?, fine_amount = ?, remarks = ? WHERE id = ?",
-              (ret_date, fine, remarks, issue[0]))
-    c.execute("UPDATE products SET status = 'Available' WHERE id = ?", (issue[3],))
+    finally:
+        conn.close()
     if fine > 0:
-        c.execute("UPDATE members SET pending_fine = pending_fine + ? WHERE id = ?", (fine, issue[2]))
-        print(f"Item returned. Late fine: ₹{fine:.2f}")
+        # Anything not billed now was already added by the nightly accrual
+        print(f"Item returned. Late fine: ₹{fine:.2f}"
+              + (f" (₹{fine - billed:.2f} already accrued)" if billed != fine else ""))
     else:
         print("Item returned on time.")
+    if held_for is not None:
+        print(f"Member {held_for} is waiting for {name}: keep it on the hold shelf.")
+
+def read_scans():
+    print("Scan serials (Enter after each, blank line to finish):")
+    serials = []
+    while True:
+        line = input("> ").strip()
+        if not line: break
+        serials.extend(api.parse_serials(line))
+    return serials
+
+def print_outcomes(result):
+    for serial, ok, message in result.outcomes:
+        print(f"  {'OK ' if ok else 'ERR'} {serial:<13} {message}")
+    print(result.summary())
+
+def batch_issue():
+    member_id = input("Member ID: ").strip()
+    serials = read_scans()
+    if not serials:
+        print("Nothing scanned.")
+        return
+    issue_d = input("Issue Date (YYYY-MM-DD): ").strip()
+    return_d = input("Return Date (YYYY-MM-DD, blank for each item's loan policy): ").strip() or None
+    remarks = input("Remarks (optional): ").strip()
     
-    conn.commit()
+    issue_dt = validate_date(issue_d, "Issue Date")
+    if not issue_dt: return
+    if return_d:
+        return_dt = validate_date(return_d, "Return Date")
+        if not return_dt: return
+        if return_dt <= issue_dt:
+            print("Return date must be after issue date.")
+            return
+    
+    conn = get_connection()
+    try:
+        result = api.issue_batch(conn, member_id, serials, issue_d, return_d, remarks)
+    except ValueError as e:
+        print(e)
+        return
+    finally:
+        conn.close()
+    print_outcomes(result)
+
+def batch_return():
+    serials = read_scans()
+    if not serials:
+        print("Nothing scanned.")
+        return
+    ret_date = input("Actual Return Date (YYYY-MM-DD): ").strip()
+    remarks = input("Remarks (optional): ").strip()
+    if not validate_date(ret_date, "Return Date"): return
+    
+    conn = get_connection()
+    result = api.return_batch(conn, serials, ret_date, remarks)
     conn.close()
+    print_outcomes(result)
 
 def pay_fine():
     member_id = input("Member ID: ").strip()
@@ -366,32 +411,47 @@ def pay_fine():
     
     try:
         amount = float(amount)
-        if amount <= 0:
-            raise ValueError
-    except:
+    except ValueError:
         print("Invalid amount.")
         return
     
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    c.execute("SELECT pending_fine FROM members WHERE id = ?", (member_id,))
-    row = c.fetchone()
-    if not row:
-        print("Member not found.")
-        conn.close()
+    conn = get_connection()
+    try:
+        new_fine = api.pay_fine(conn, member_id, amount)
+    except ValueError as e:
+        print(e)
         return
-    
-    current = row[0]
-    if amount > current:
-        print(f"Cannot pay more than pending (₹{current:.2f})")
+    finally:
         conn.close()
-        return
-    
-    new_fine = current - amount
-    c.execute("UPDATE members SET pending_fine = ? WHERE id = ?", (new_fine, member_id))
-    conn.commit()
     print(f"Payment accepted. Remaining fine: ₹{new_fine:.2f}")
+
+def place_hold():
+    member_id = input("Member ID: ").strip()
+    title = input("Title (exact): ").strip()
+    
+    conn = get_connection()
+    try:
+        request_id, position, serial = api.place_hold(conn, member_id, title)
+        if serial:
+            print(f"A copy is on the shelf: serial {serial} is now held for member {member_id}.")
+        else:
+            print(f"Hold #{request_id} placed: position {position} in the queue, "
+                  f"expected around {api.hold_estimate(conn, title, position) or 'unknown'}.")
+    except ValueError as e:
+        print(e)
+    finally:
+        conn.close()
+
+def hold_queue():
+    title = input("Title (exact): ").strip()
+    conn = get_connection()
+    waiting = api.hold_queue(conn, title)
     conn.close()
+    if not waiting:
+        print("Nobody is waiting for this title.")
+        return
+    for request_id, member_id, name, requested, position, eta in waiting:
+        print(f"{position:>3}. #{request_id} member {member_id} ({name}) since {requested}, expected {eta or 'unknown'}")
 
 # ────────────────────────────────────────────────
 # REPORTS
@@ -403,71 +463,85 @@ def reports_menu():
         print("2. Movies List")
         print("3. Active Issues")
         print("4. Overdue Items")
-        print("5. Back")
+        print("5. Loan History")
+        print("6. Back")
         ch = input("Choose: ").strip()
         if ch == '1': master_list('Book')
         elif ch == '2': master_list('Movie')
         elif ch == '3': active_issues()
         elif ch == '4': overdue_items()
-        elif ch == '5': break
+        elif ch == '5': loan_history()
+        elif ch == '6': break
         else: print("Invalid.")
 
+def report_pages(conn, report, period=None):
+    """Yield a report page by page, asking before fetching each next page."""
+    cursor = None
+    while True:
+        rows, cursor = fetch_page(conn, report, after=cursor, period=period)
+        yield rows
+        if cursor is None or input("More results? (y/n): ").strip().lower() != 'y':
+            return
+
 def master_list(typ):
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    c.execute("SELECT serial_no, name, author, category, status, cost FROM products WHERE type = ? ORDER BY name", (typ,))
-    rows = c.fetchall()
+    conn = get_connection()
+    for i, rows in enumerate(report_pages(conn, REPORTS['books' if typ == 'Book' else 'movies'])):
+        if i == 0:
+            if not rows:
+                print(f"No {typ.lower()}s found.")
+                break
+            print(f"\n=== {typ}s Master List ===")
+            print("Title                            Author                   Category              Copies  Avail  Issued")
+            print("-"*105)
+        for r in rows:
+            print(f"{r[0]:<32} {r[1]:<24} {r[2]:<21} {r[3]:>6} {r[4]:>6} {r[5]:>7}")
     conn.close()
-    
-    if not rows:
-        print(f"No {typ.lower()}s found.")
-        return
-    
-    print(f"\n=== {typ}s Master List ===")
-    print("Serial         Title                            Author                   Cat         Status    Cost")
-    print("-"*90)
-    for r in rows:
-        print(f"{r[0]:<14} {r[1]:<32} {r[2]:<24} {r[3]:<11} {r[4]:<9} ₹{r[5]:.2f}")
 
 def active_issues():
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    c.execute("""SELECT p.serial_no, p.name, i.member_id, i.issue_date, i.return_date 
-                 FROM issues i JOIN products p ON i.product_id = p.id 
-                 WHERE i.actual_return_date IS NULL""")
-    rows = c.fetchall()
+    conn = get_connection()
+    for i, rows in enumerate(report_pages(conn, REPORTS['active'])):
+        if i == 0:
+            if not rows:
+                print("No active issues.")
+                break
+            print("\n=== Active Issues ===")
+            print("Serial         Title                            Member   Issue       Due")
+            print("-"*70)
+        for r in rows:
+            print(f"{r[0]:<14} {r[1]:<32} {r[4]:<8} {r[5]}   {r[6]}")
     conn.close()
-    
-    if not rows:
-        print("No active issues.")
-        return
-    
-    print("\n=== Active Issues ===")
-    print("Serial         Title                            Member   Issue       Due")
-    print("-"*70)
-    for r in rows:
-        print(f"{r[0]:<14} {r[1]:<32} {r[2]:<8} {r[3]}   {r[4]}")
 
 def overdue_items():
-    today = datetime.now().strftime("%Y-%m-%d")
-    conn = sqlite3.connect('library.db')
-    c = conn.cursor()
-    c.execute("""SELECT p.serial_no, p.name, i.member_id, i.issue_date, i.return_date,
-                        (julianday(?) - julianday(i.return_date)) AS days_late
-                 FROM issues i JOIN products p ON i.product_id = p.id 
-                 WHERE i.actual_return_date IS NULL AND i.return_date < ?""", (today, today))
-    rows = c.fetchall()
+    conn = get_connection()
+    for i, rows in enumerate(report_pages(conn, REPORTS['overdue'])):
+        if i == 0:
+            if not rows:
+                print("No overdue items.")
+                break
+            print("\n=== Overdue Items ===")
+            print("Serial         Title                            Member   Issue       Due        Days late")
+            print("-"*85)
+        for r in rows:
+            print(f"{r[0]:<14} {r[1]:<32} {r[4]:<8} {r[5]}   {r[6]}   {r[7]}")
     conn.close()
-    
-    if not rows:
-        print("No overdue items.")
+
+def loan_history():
+    since = input("From date (YYYY-MM-DD, blank for all): ").strip() or None
+    until = input("To date (YYYY-MM-DD, blank for all): ").strip() or None
+    if (since and not validate_date(since, "From date")) or (until and not validate_date(until, "To date")):
         return
-    
-    print("\n=== Overdue Items ===")
-    print("Serial         Title                            Member   Issue       Due        Days late")
-    print("-"*85)
-    for r in rows:
-        print(f"{r[0]:<14} {r[1]:<32} {r[2]:<8} {r[3]}   {r[4]}   {int(r[5])}")
+    conn = get_connection()
+    for i, rows in enumerate(report_pages(conn, REPORTS['history'], (since, until))):
+        if i == 0:
+            if not rows:
+                print("No loans in that period.")
+                break
+            print("\n=== Loan History ===")
+            print("Serial         Title                            Member   Issue       Due         Returned")
+            print("-"*85)
+        for r in rows:
+            print(f"{r[0]:<14} {r[1]:<32} {r[4]!s:<8} {r[5]}   {r[6]}   {r[7] or '-'}")
+    conn.close()
 
 if __name__ == "__main__":
     create_db()
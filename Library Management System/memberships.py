@@ -0,0 +1,140 @@
+"""Membership validity: expiry, renewals and who may borrow.
+
+A membership runs to members.end_date (and its day number end_day, see
+days.py).  expire() marks every Active member whose end date has passed
+Inactive in one UPDATE over a partial index of the Active members' end
+days, so a nightly run only reads the members it changes.  renew() moves a
+set of members' end dates on and makes them Active again in set-based
+statements; renewals from a file go through the importer:
+
+    python importer.py renewals renewals.csv
+
+Whether a member may borrow is decided from one primary-key lookup
+(eligibility()): status and end day from the member row, the fine balance
+the ledger keeps in members.pending_fine, and the open loan count the
+triggers keep in member_loans (stats.py).  Nothing is counted or summed
+on the issue path.  refusal() says why a member may not borrow at all;
+the loan and fine limits depend on the item too, and are the loan
+policy's (policy.py).
+
+    python memberships.py --expire [--date D]   # deactivate lapsed members (run from cron)
+"""
+import argparse
+import sys
+from collections import namedtuple
+from datetime import datetime
+
+from codes import ACTIVE, INACTIVE, MEMBER_STATUSES, name_sql
+from days import day_number, day_sql, day_text
+from db import transaction
+
+Eligibility = namedtuple('Eligibility', 'member_id name tier status_id end_day pending_fine open_loans')
+
+
+def create_index(conn):
+    """Migration step: the Active members by end day, in place of the index of all members by end day."""
+    conn.execute("DROP INDEX IF EXISTS idx_members_end_day")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_members_active_end ON members (end_day) WHERE status_id = {ACTIVE}")
+    conn.execute("ANALYZE idx_members_active_end")
+
+
+def _today():
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+# ────────────────────────────────────────────────
+# Eligibility (run inside the caller's transaction)
+# ────────────────────────────────────────────────
+def eligibility(conn, member_id):
+    """Eligibility of member_id, or None for an unknown member."""
+    row = conn.execute(f"""SELECT m.id, m.first_name || ' ' || m.last_name, {name_sql('member_tiers', 'm.tier_id')},
+                                  m.status_id, m.end_day, COALESCE(m.pending_fine, 0), COALESCE(l.open_count, 0)
+                           FROM members m LEFT JOIN member_loans l ON l.member_id = m.id
+                           WHERE m.id = ?""", (member_id,)).fetchone()
+    return Eligibility(*row) if row else None
+
+
+def refusal(member, day):
+    """Why an Eligibility may not borrow on day number `day`, or None if it may.
+
+    Members of old databases can have no status; they are held to their end date only.
+    """
+    if member.status_id not in (ACTIVE, None):
+        return f"membership is {MEMBER_STATUSES.get(member.status_id, 'not active')}"
+    if member.end_day is not None and member.end_day < day:
+        return f"membership expired on {day_text(member.end_day)}"
+    return None
+
+
+# ────────────────────────────────────────────────
+# Expiry and renewal
+# ────────────────────────────────────────────────
+def _expire(conn, day):
+    return conn.execute(f"UPDATE members SET status_id = {INACTIVE} WHERE status_id = {ACTIVE} AND end_day < ?",
+                        (day,)).rowcount
+
+
+def expire(conn, today=None):
+    """Mark Inactive every Active member whose membership ended before today; returns how many."""
+    return transaction(conn, _expire, day_number(today or _today()))
+
+
+def renew_many(conn, renewals, today):
+    """Renew memberships inside the caller's transaction.
+
+    renewals is [(member_id, days, end_date)]: a member's membership ends on
+    end_date if it is given, else `days` after their current end date or
+    today, whichever is later.  Renewed members are Active.  A member listed
+    twice gets the later renewal.  Returns (renewed, [unknown member ids]).
+    """
+    conn.execute("""CREATE TEMP TABLE IF NOT EXISTS renewals
+                    (member_id INTEGER PRIMARY KEY, days INTEGER, end_date TEXT, end_day INTEGER)""")
+    conn.execute("DELETE FROM temp.renewals")
+    conn.executemany("INSERT OR REPLACE INTO temp.renewals (member_id, days, end_date) VALUES (?, ?, ?)", renewals)
+    conn.execute("""UPDATE temp.renewals SET end_date = date(MAX(COALESCE(m.end_date, :today), :today),
+                                                            '+' || renewals.days || ' days')
+                    FROM members m WHERE m.id = renewals.member_id AND renewals.end_date IS NULL""", {'today': today})
+    conn.execute(f"UPDATE temp.renewals SET end_day = {day_sql('end_date')}")
+    # The day numbers are written with the dates, so the days trigger has nothing to do
+    renewed = conn.execute(f"""UPDATE members SET end_date = r.end_date, end_day = r.end_day, status_id = {ACTIVE}
+                               FROM temp.renewals r WHERE members.id = r.member_id""").rowcount
+    unknown = [r[0] for r in conn.execute("""SELECT member_id FROM temp.renewals
+                                             WHERE member_id NOT IN (SELECT id FROM members)""")]
+    conn.execute("DELETE FROM temp.renewals")
+    return renewed, unknown
+
+
+def renew(conn, renewals, today=None):
+    """Renew memberships (see renew_many()) in one transaction; returns (renewed, [unknown member ids])."""
+    return transaction(conn, renew_many, renewals, today or _today())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deactivate members whose membership has ended.")
+    parser.add_argument('--expire', action='store_true', help="mark lapsed Active members Inactive")
+    parser.add_argument('--date', help="today's date (YYYY-MM-DD, default today)")
+    args = parser.parse_args(argv)
+    if not args.expire:
+        parser.error("nothing to do (use --expire; renewals are imported with importer.py renewals FILE)")
+
+    from db import get_connection
+    from api import parse_date
+    from library_management import bootstrap
+    if args.date:
+        try:
+            parse_date(args.date, "Date")
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+    bootstrap()
+    conn = get_connection()
+    try:
+        expired = expire(conn, args.date)
+    finally:
+        conn.close()
+    print(f"{expired} membership(s) lapsed and marked Inactive.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
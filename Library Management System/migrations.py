@@ -0,0 +1,147 @@
+"""Versioned schema migrations, tracked with PRAGMA user_version.
+
+Each migration runs in its own short BEGIN IMMEDIATE transaction, so an
+existing library.db is upgraded in place while readers keep working (WAL).
+Run this file directly to upgrade a database without starting either app.
+"""
+from db import get_connection, get_db_path
+import archive
+import availability
+import catalog
+import codes
+import days
+import fines
+import holds
+import memberships
+import policy
+import search
+import stats
+
+
+def _index_serial_no(conn):
+    # New databases already have the UNIQUE autoindex; older files (created
+    # before serial_no was UNIQUE) can hold duplicates, so use a plain index.
+    for row in conn.execute("PRAGMA index_list(products)"):
+        cols = conn.execute(f"PRAGMA index_info({row[1]})").fetchall()
+        if [c[2] for c in cols] == ['serial_no']:
+            return
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_serial ON products (serial_no)")
+
+
+# (version, description, steps) - a step is an SQL string or a callable(conn)
+MIGRATIONS = [
+    (1, "Indexes for circulation reports and catalog lookups", [
+        # Open loans only, ordered by due date: Active Issues, Overdue, Return flow
+        """CREATE INDEX IF NOT EXISTS idx_issues_open_due
+           ON issues (return_date, product_id, member_id, issue_date)
+           WHERE actual_return_date IS NULL""",
+        # return_item(): find the open loan of a copy
+        """CREATE INDEX IF NOT EXISTS idx_issues_open_product
+           ON issues (product_id) WHERE actual_return_date IS NULL""",
+        "CREATE INDEX IF NOT EXISTS idx_issues_member ON issues (member_id)",
+        # Master lists filter on type and sort on name
+        "CREATE INDEX IF NOT EXISTS idx_products_type_name ON products (type, name)",
+        "CREATE INDEX IF NOT EXISTS idx_products_name ON products (name)",
+        # Matches the COALESCE(status, 'Available') filter used by the Issue flow
+        """CREATE INDEX IF NOT EXISTS idx_products_status
+           ON products (COALESCE(status, 'Available'), serial_no)""",
+        _index_serial_no,
+        "CREATE INDEX IF NOT EXISTS idx_members_name ON members (first_name, last_name)",
+        "CREATE INDEX IF NOT EXISTS idx_requests_member ON requests (member_id)",
+    ]),
+    (2, "Full-text index over product title, author and category", [
+        search.create_index,
+    ]),
+    (3, "Serial number counters", [
+        catalog.create_counters,
+    ]),
+    (4, "Bulk import checkpoints", [
+        """CREATE TABLE IF NOT EXISTS import_checkpoints
+           (source TEXT PRIMARY KEY, kind TEXT, rows_done INTEGER NOT NULL DEFAULT 0,
+            inserted INTEGER NOT NULL DEFAULT 0, finished INTEGER NOT NULL DEFAULT 0, updated_at TEXT)""",
+    ]),
+    (5, "Trigger-maintained circulation summary tables", [
+        stats.create_tables,
+    ]),
+    (6, "Fine ledger and nightly accrual", [
+        fines.create_ledger,
+    ]),
+    (7, "Ledger-maintained fine balances", [
+        fines.create_balances,
+    ]),
+    (8, "Hold queue on requests", [
+        holds.create_queue,
+    ]),
+    (9, "Loan archive catalog", [
+        archive.create_catalog,
+    ]),
+    (10, "Copy status change log for the availability index", [
+        availability.create_log,
+    ]),
+    (11, "Catalog split into titles and copies behind a products view", [
+        catalog.split_products,
+        search.create_title_index,
+        stats.create_copy_triggers,
+        availability.create_copy_triggers,
+    ]),
+    (12, "Integer codes for item type, category and copy and member status", [
+        codes.create_lookups,
+        catalog.encode_columns,
+        search.create_catalog_index,
+        stats.create_coded_triggers,
+        availability.create_coded_triggers,
+        codes.encode_members,
+    ]),
+    (13, "Integer day numbers for loan and membership dates", [
+        days.create_columns,
+    ]),
+    (14, "Membership tiers for the loan policy", [
+        policy.create_tiers,
+    ]),
+    (15, "Index of Active memberships by end day for expiry", [
+        memberships.create_index,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply all pending migrations and return the versions applied."""
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if current_version(conn) >= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have applied it while we waited for the lock
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    if applied:
+        conn.execute("PRAGMA optimize")
+    return applied
+
+
+if __name__ == "__main__":
+    from library_management import create_db
+    conn = get_connection()
+    before = current_version(conn)
+    create_db()
+    print(f"{get_db_path()}: schema version {before} -> {current_version(conn)}")
+    conn.close()
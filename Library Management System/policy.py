@@ -0,0 +1,189 @@
+"""Loan and fine policy: loan length, fine rate, fine cap and borrowing limits per kind of loan.
+
+The terms of a loan depend on the item's type and category and on the
+member's tier.  They are declared as rules, each a dict of the names it
+matches (any of type, category, tier - a missing key matches anything) and
+the terms it sets (any of loan_days, fine_per_day, fine_cap, max_loans,
+max_owed - the most a member may owe in fines and still borrow):
+
+    RULES = [
+        {'type': 'Movie', 'loan_days': 7, 'fine_per_day': 5.0, 'fine_cap': 100.0},
+        {'category': 'Children', 'loan_days': 21},
+        {'tier': 'Student', 'max_loans': 3, 'max_owed': 50.0},
+    ]
+
+Every term of a loan comes from the most specific rule that matches it and
+sets that term (a later rule wins a tie), else from DEFAULTS.  None for
+fine_cap, max_loans or max_owed means no cap or limit.  LIBRARY_POLICY may
+name a JSON file holding the rule list instead.  Members can be given
+DEFAULT_TIER or any tier a rule names.
+
+The rules are compiled once, when the module loads, into a table with the
+terms of every combination of names they mention, so issue and return look
+a loan's terms up in memory (lookup()).  Set-based statements over many
+loans (the nightly fine accrual) use fine_sql(), the same rules as an SQL
+expression over the loans' type, category and tier ids.
+
+    python policy.py            # the compiled terms
+"""
+import json
+import os
+import sys
+from collections import namedtuple
+from itertools import product
+
+from codes import code, lookup_sql
+
+# Terms no rule sets: two weeks, ₹1 per day late, no fine cap, no loan or fine limit
+DEFAULTS = {'loan_days': 14, 'fine_per_day': 1.0, 'fine_cap': None, 'max_loans': None, 'max_owed': None}
+
+# Tier of members who are not given another
+DEFAULT_TIER = 'Standard'
+
+RULES = []
+
+Policy = namedtuple('Policy', 'loan_days fine_per_day fine_cap max_loans max_owed')
+
+# Terms in ₹, and those that may be None
+_MONEY = ('fine_per_day', 'fine_cap', 'max_owed')
+_OPTIONAL = ('fine_cap', 'max_loans', 'max_owed')
+
+# Rule keys matched against a loan, and the lookup table holding each one's ids
+MATCH = {'type': 'item_types', 'category': 'categories', 'tier': 'member_tiers'}
+
+
+def create_tiers(conn):
+    """Migration step: member_tiers and members.tier_id, existing members on DEFAULT_TIER."""
+    conn.execute("CREATE TABLE IF NOT EXISTS member_tiers (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+    if 'tier_id' not in [r[1] for r in conn.execute("PRAGMA table_info(members)")]:
+        conn.execute("ALTER TABLE members ADD COLUMN tier_id INTEGER")
+    conn.execute("UPDATE members SET tier_id = ? WHERE tier_id IS NULL", (code(conn, 'member_tiers', DEFAULT_TIER),))
+
+
+# ────────────────────────────────────────────────
+# Compiling the rules
+# ────────────────────────────────────────────────
+def _check(n, rule):
+    if not isinstance(rule, dict):
+        raise ValueError(f"Loan policy rule {n}: not a mapping")
+    for key, value in rule.items():
+        if key in MATCH:
+            ok = isinstance(value, str) and value
+        elif key in ('loan_days', 'max_loans'):
+            ok = (value is None and key in _OPTIONAL) or (isinstance(value, int) and value > 0)
+        elif key in _MONEY:
+            ok = (value is None and key in _OPTIONAL) or (isinstance(value, (int, float)) and value >= 0)
+        else:
+            raise ValueError(f"Loan policy rule {n}: unknown key '{key}'")
+        if not ok or isinstance(value, bool):
+            raise ValueError(f"Loan policy rule {n}: invalid {key} {value!r}")
+    # Fines are money whether the rule wrote 5 or 5.0
+    return {key: float(value) if key in _MONEY and value is not None else value
+            for key, value in rule.items()}
+
+
+def _ordered(rules):
+    # Least specific first, in file order within a level, so later entries override earlier ones
+    rules = [_check(n, rule) for n, rule in enumerate(rules, 1)]
+    return sorted(rules, key=lambda rule: sum(key in rule for key in MATCH))
+
+
+def _resolve(rules, names):
+    terms = dict(DEFAULTS)
+    for rule in rules:
+        if all(rule.get(key, value) == value for key, value in names.items()):
+            terms.update((key, value) for key, value in rule.items() if key in DEFAULTS)
+    return Policy(**terms)
+
+
+def _compile(rules):
+    # One entry per combination of the names the rules mention, None standing for any other name
+    mentioned = {key: sorted({rule[key] for rule in rules if key in rule}) for key in MATCH}
+    table = {}
+    for names in product(*(mentioned[key] + [None] for key in MATCH)):
+        table[names] = _resolve(rules, dict(zip(MATCH, names)))
+    return {key: set(values) for key, values in mentioned.items()}, table
+
+
+def _load():
+    path = os.environ.get('LIBRARY_POLICY')
+    if not path:
+        return RULES
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+_RULES = _ordered(_load())
+_MENTIONED, _TABLE = _compile(_RULES)
+
+# Tiers a member can be on
+TIERS = (DEFAULT_TIER,) + tuple(sorted(_MENTIONED['tier'] - {DEFAULT_TIER}))
+
+
+# ────────────────────────────────────────────────
+# Applying them
+# ────────────────────────────────────────────────
+def lookup(type, category, tier):
+    """Policy of a loan of an item of type and category to a member on tier (names; None for none)."""
+    return _TABLE[tuple(name if name in _MENTIONED[key] else None
+                        for key, name in zip(MATCH, (type, category, tier)))]
+
+
+def fine(policy, days_late):
+    """Late fine under policy for a loan returned days_late days after its due date (None: no due date)."""
+    amount = max(0, days_late or 0) * policy.fine_per_day
+    return amount if policy.fine_cap is None else min(amount, policy.fine_cap)
+
+
+def _quote(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+def _literal(value):
+    return "NULL" if value is None else repr(value)
+
+
+def term_sql(term, columns):
+    """SQL for one term of the loans' policy; columns maps type, category and tier to id expressions."""
+    cases, default = [], DEFAULTS[term]
+    for rule in _RULES:
+        if term not in rule:
+            continue
+        matches = [f"{columns[key]} = {lookup_sql(table, _quote(rule[key]))}" for key, table in MATCH.items()
+                   if key in rule]
+        if matches:
+            cases.append(f"WHEN {' AND '.join(matches)} THEN {_literal(rule[term])}")
+        else:
+            default = rule[term]
+    if not cases:
+        return _literal(default)
+    # Most specific rule first, as lookup() resolves them
+    return f"CASE {' '.join(reversed(cases))} ELSE {_literal(default)} END"
+
+
+def fine_sql(late, type_id, category_id, tier_id):
+    """SQL for fine() of the loans: late is an expression for the days late, the rest id expressions."""
+    columns = {'type': type_id, 'category': category_id, 'tier': tier_id}
+    amount = f"MAX(0, {late}) * {term_sql('fine_per_day', columns)}"
+    cap = term_sql('fine_cap', columns)
+    if cap == "NULL":
+        return amount
+    # MIN() with a NULL (no cap) is NULL
+    return f"COALESCE(MIN({amount}, {cap}), {amount})"
+
+
+def main(argv=None):
+    names = [f"{key} {value}" for key in MATCH for value in sorted(_MENTIONED[key])]
+    print(f"{len(_RULES)} rule(s){' naming ' + ', '.join(names) if names else ''}; tiers: {', '.join(TIERS)}")
+    # * is any name no rule mentions
+    for (ptype, category, tier), policy in sorted(_TABLE.items(), key=lambda item: [n or '~' for n in item[0]]):
+        print(f"  {ptype or '*':<12} {category or '*':<22} {tier or '*':<12} "
+              f"{policy.loan_days:>3} days  ₹{policy.fine_per_day:g}/day"
+              f"  cap {'-' if policy.fine_cap is None else f'₹{policy.fine_cap:g}'}"
+              f"  limit {'-' if policy.max_loans is None else policy.max_loans}"
+              f"  owed {'-' if policy.max_owed is None else f'₹{policy.max_owed:g}'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""In-process cache for the Streamlit app's reads.
+
+Streamlit re-runs library_app.py on every widget interaction, so the same
+tables and lists are queried again and again.  Results are cached here,
+keyed by the query, its parameters and the write version of every table it
+reads.  Writes made through the app call invalidate() for the tables they
+touch, which bumps those versions: exactly the entries that read them miss
+on the next rerun, everything else is still served from memory.
+
+Writes made by another process (the console app, the importer CLI) cannot
+invalidate this cache; entries also expire after TTL seconds to pick those
+up.  Cached values are shared between sessions - treat them as read-only.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from db import get_connection, get_db_path
+
+TTL = 30
+MAX_ENTRIES = 256
+
+# titles, copies and their lookups are versioned as "products", the view
+# over them that the app's writes invalidate; likewise member statuses
+_ALIASES = {'titles': 'products', 'copies': 'products', 'catalog_titles': 'products', 'item_types': 'products',
+            'categories': 'products', 'copy_statuses': 'products', 'member_statuses': 'members'}
+
+_versions = {}
+_entries = OrderedDict()          # key -> (expires, value), least recently used first
+_lock = threading.Lock()
+
+
+def tables_in(sql):
+    """Table names after FROM / JOIN in a query."""
+    names = re.findall(r"\b(?:FROM|JOIN)\s+(\w+)", sql, re.IGNORECASE)
+    return tuple(sorted({_ALIASES.get(name.lower(), name) for name in names}))
+
+
+def invalidate(*tables):
+    """Call after committing a write to `tables`."""
+    db = get_db_path()
+    with _lock:
+        for table in tables:
+            _versions[db, table] = _versions.get((db, table), 0) + 1
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def cached(tables, fn, *args, **kwargs):
+    """fn(conn, *args, **kwargs), reused until one of `tables` is written."""
+    db = get_db_path()
+    with _lock:
+        key = (db, fn.__module__, fn.__qualname__, repr(args), repr(sorted(kwargs.items())),
+               tuple(_versions.get((db, t), 0) for t in tables))
+        hit = _entries.get(key)
+        if hit and hit[0] > time.monotonic():
+            _entries.move_to_end(key)
+            return hit[1]
+    conn = get_connection()
+    try:
+        value = fn(conn, *args, **kwargs)
+    finally:
+        conn.close()
+    with _lock:
+        _entries[key] = (time.monotonic() + TTL, value)
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+    return value
+
+
+def _read_sql(conn, sql, params):
+    return pd.read_sql_query(sql, conn, params=params)
+
+
+def read_sql(sql, params=(), tables=None):
+    """pandas.read_sql_query through the cache (tables default to those in the query)."""
+    return cached(tables or tables_in(sql), _read_sql, sql, tuple(params))
@@ -0,0 +1,279 @@
+"""Report engine: keyset-paginated pages and streaming exports.
+
+Every report is a query spec (columns, joins, fixed conditions, sortable and
+filterable columns).  Pages are fetched with keyset pagination - the next
+page starts after the (sort value, key) of the last row shown - so page N
+costs the same as page 1 and nothing is loaded beyond the visible rows.
+Exports walk the same query with fetchmany(), using constant memory.
+
+Loan History reads closed loans too; older ones live in yearly archive
+tables (archive.py), which are unioned in only when the requested period
+reaches back into them.
+
+    python reports.py overdue --out overdue.csv
+    python reports.py books --sort copies --desc --filter category=Fiction --out books.parquet
+    python reports.py copies --filter status=Issued --out on-loan.csv
+    python reports.py history --since 2019-01-01 --until 2019-12-31 --out loans-2019.csv
+"""
+import argparse
+import csv
+import sys
+from datetime import datetime
+
+from catalog import AVAILABLE_SQL, COPIES_SQL, ISSUED_SQL
+from codes import lookup_sql
+from days import day_number
+
+PAGE_SIZE = 50
+EXPORT_CHUNK = 10000
+
+
+class Report:
+    def __init__(self, title, source, columns, key, sort, where=(), filters=(), descending=False, types=None,
+                 period=None, codes=None):
+        self.title = title
+        self.source = source              # FROM clause (with joins)
+        self.columns = columns            # [(label, SQL expression)]
+        self.key = key                    # unique tiebreaker for keyset paging
+        self.sort = sort                  # default sort label
+        self.where = list(where)          # fixed conditions, may use :today
+        self.filters = list(filters)      # labels allowed in equality filters
+        self.descending = descending
+        self.types = types or {}          # label -> 'int' / 'float' for typed exports
+        self.period = period              # date expression limited by since/until, if any
+        self.codes = codes or {}          # filter label -> (id column, lookup table): filtered by id
+
+    @property
+    def labels(self):
+        return [label for label, _ in self.columns]
+
+    def expr(self, label):
+        return dict(self.columns)[label]
+
+
+def _title_list(ptype):
+    # One row per title with its copy counts
+    type_id = lookup_sql('item_types', f"'{ptype}'")
+    return Report(
+        f"{ptype}s Master List", "catalog_titles t",
+        [('name', 't.name'), ('author', 't.author'), ('category', 't.category'),
+         ('copies', COPIES_SQL), ('available', AVAILABLE_SQL), ('issued', ISSUED_SQL)],
+        key='t.id', sort='name', where=[f"t.type_id = {type_id}"],
+        filters=['category'], codes={'category': ('t.category_id', 'categories')},
+        types={'copies': 'int', 'available': 'int', 'issued': 'int'})
+
+
+_ISSUE_SOURCE = """issues i
+                   JOIN products p ON i.product_id = p.id
+                   LEFT JOIN members m ON i.member_id = m.id"""
+
+# {loans} is issues, or issues plus the archive partitions the period needs
+_LOAN_HISTORY_SOURCE = _ISSUE_SOURCE.replace("issues i", "{loans} i", 1)
+
+_TYPE_CODE = {'type': ('p.type_id', 'item_types')}
+
+REPORTS = {
+    'books': _title_list('Book'),
+    'movies': _title_list('Movie'),
+    'copies': Report(
+        "Copies (stock list)", "products",
+        [('serial_no', 'serial_no'), ('name', 'name'), ('type', 'type'), ('category', 'category'),
+         ('status', "COALESCE(status, 'Available')"), ('cost', 'cost'), ('procurement_date', 'procurement_date')],
+        key='id', sort='serial_no', filters=['type', 'category', 'status'],
+        codes={'type': ('type_id', 'item_types'), 'category': ('category_id', 'categories'),
+               'status': ('status_id', 'copy_statuses')},
+        types={'cost': 'float'}),
+    'members': Report(
+        "Members Master List", "members",
+        [('id', 'id'), ('first_name', 'first_name'), ('last_name', 'last_name'),
+         ('contact_name', 'contact_name'), ('aadhar_no', 'aadhar_no'), ('start_date', 'start_date'),
+         ('end_date', 'end_date'), ('status', 'status'), ('pending_fine', 'pending_fine')],
+        key='id', sort='first_name', filters=['status'], codes={'status': ('status_id', 'member_statuses')},
+        types={'id': 'int', 'pending_fine': 'float'}),
+    'active': Report(
+        "Active Issues", _ISSUE_SOURCE,
+        [('serial_no', 'p.serial_no'), ('name', 'p.name'), ('type', 'p.type'),
+         ('member_name', "m.first_name || ' ' || m.last_name"), ('member_id', 'i.member_id'),
+         ('issue_date', 'i.issue_date'), ('return_date', 'i.return_date')],
+        key='i.id', sort='issue_date', where=["i.actual_return_date IS NULL"], filters=['type', 'member_id'],
+        codes=_TYPE_CODE, types={'member_id': 'int'}),
+    'overdue': Report(
+        "Overdue Items", _ISSUE_SOURCE,
+        [('serial_no', 'p.serial_no'), ('name', 'p.name'), ('type', 'p.type'),
+         ('member_name', "m.first_name || ' ' || m.last_name"), ('member_id', 'i.member_id'),
+         ('issue_date', 'i.issue_date'), ('return_date', 'i.return_date'),
+         ('days_overdue', ":today_day - i.return_day"),
+         ('fine_accrued', 'i.fine_accrued')],
+        key='i.id', sort='return_date', where=["i.actual_return_date IS NULL", "i.return_date < :today"],
+        filters=['type', 'member_id'], codes=_TYPE_CODE,
+        types={'member_id': 'int', 'days_overdue': 'int', 'fine_accrued': 'float'}),
+    'history': Report(
+        "Loan History", _LOAN_HISTORY_SOURCE,
+        [('serial_no', 'p.serial_no'), ('name', 'p.name'), ('type', 'p.type'),
+         ('member_name', "m.first_name || ' ' || m.last_name"), ('member_id', 'i.member_id'),
+         ('issue_date', 'i.issue_date'), ('return_date', 'i.return_date'),
+         ('actual_return_date', 'i.actual_return_date'), ('fine_amount', 'i.fine_amount')],
+        key='i.id', sort='issue_date', descending=True, filters=['type', 'member_id'], codes=_TYPE_CODE,
+        types={'member_id': 'int', 'fine_amount': 'float'}, period='i.issue_date'),
+    'requests': Report(
+        "Pending Requests", "requests",
+        [('id', 'id'), ('member_id', 'member_id'), ('product_name', 'product_name'),
+         ('requested_date', 'requested_date'), ('fulfilled_date', 'fulfilled_date'),
+         ('status', "CASE WHEN fulfilled_date IS NULL THEN 'Pending' ELSE 'Fulfilled' END")],
+        key='id', sort='requested_date', descending=True, filters=['member_id', 'status'],
+        types={'id': 'int', 'member_id': 'int'}),
+}
+
+
+def _after(sort_expr, key, descending, null_cursor):
+    # Rows after the cursor (sort value, key).  The row-value comparison lets
+    # SQLite seek straight to the cursor in an index on (sort column, key).
+    # NULL sort values come first ascending and last descending, as in ORDER BY.
+    if null_cursor:
+        if descending:
+            return f"{sort_expr} IS NULL AND {key} < :after_key"
+        return f"({sort_expr} IS NULL AND {key} > :after_key) OR {sort_expr} IS NOT NULL"
+    if descending:
+        return f"({sort_expr}, {key}) < (:after_sort, :after_key) OR {sort_expr} IS NULL"
+    return f"({sort_expr}, {key}) > (:after_sort, :after_key)"
+
+
+def build_query(report, sort=None, descending=None, filters=None, after=None, limit=None, today=None,
+                period=None, loans="issues"):
+    """Return (sql, params); selected columns end with the hidden sort value and key.
+
+    period is (since, until), either may be None, for reports with a period
+    column; loans replaces {loans} in the report's source.
+    """
+    sort = sort or report.sort
+    descending = report.descending if descending is None else descending
+    sort_expr = report.expr(sort)
+    params = {'today': today or datetime.now().strftime("%Y-%m-%d")}
+    params['today_day'] = day_number(params['today'])
+    where = [f"({w})" for w in report.where]
+    if report.period:
+        params['since'], params['until'] = period or (None, None)
+        where += [f"{report.period} {op} :{name}" for name, op in (('since', '>='), ('until', '<='))
+                  if params[name] is not None]
+    for i, (label, value) in enumerate((filters or {}).items()):
+        if label not in report.filters:
+            raise ValueError(f"{report.title} cannot be filtered by {label}")
+        if label in report.codes:
+            column, table = report.codes[label]
+            where.append(f"{column} = {lookup_sql(table, f':f{i}')}")
+        else:
+            where.append(f"{report.expr(label)} = :f{i}")
+        params[f"f{i}"] = value
+    if after is not None:
+        after_sort, after_key = after
+        where.append(f"({_after(sort_expr, report.key, descending, after_sort is None)})")
+        params.update(after_sort=after_sort, after_key=after_key)
+    direction = 'DESC' if descending else 'ASC'
+    sql = (f"SELECT {', '.join(f'{expr} AS {label}' for label, expr in report.columns)}, "
+           f"{sort_expr} AS _sort, {report.key} AS _key FROM {report.source.format(loans=loans)}"
+           + (f" WHERE {' AND '.join(where)}" if where else "")
+           + f" ORDER BY {sort_expr} {direction}, {report.key} {direction}")
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    return sql, params
+
+
+def _loans(conn, report, period):
+    if "{loans}" not in report.source:
+        return "issues"
+    from archive import loans_source
+    return loans_source(conn, *(period or (None, None)))
+
+
+def fetch_page(conn, report, sort=None, descending=None, filters=None, after=None, page_size=None, today=None,
+               period=None):
+    """Return (rows, next_cursor); pass next_cursor as `after` for the next page."""
+    page_size = page_size or PAGE_SIZE
+    sql, params = build_query(report, sort, descending, filters, after, limit=page_size + 1, today=today,
+                              period=period, loans=_loans(conn, report, period))
+    rows = conn.execute(sql, params).fetchall()
+    next_cursor = rows[page_size - 1][-2:] if len(rows) > page_size else None
+    return [r[:-2] for r in rows[:page_size]], next_cursor
+
+
+def iter_chunks(conn, report, sort=None, descending=None, filters=None, chunk_size=EXPORT_CHUNK, period=None):
+    """Yield the whole report as lists of at most chunk_size rows."""
+    sql, params = build_query(report, sort, descending, filters, period=period, loans=_loans(conn, report, period))
+    c = conn.execute(sql, params)
+    while True:
+        rows = c.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield [r[:-2] for r in rows]
+
+
+def export_csv(conn, report, stream, **options):
+    """Write the report as CSV to a text stream; returns the row count."""
+    w = csv.writer(stream)
+    w.writerow(report.labels)
+    count = 0
+    for rows in iter_chunks(conn, report, **options):
+        w.writerows(rows)
+        count += len(rows)
+    return count
+
+
+def export_parquet(conn, report, path, **options):
+    """Write the report as a Parquet file (needs pyarrow); returns the row count."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)") from None
+    arrow_types = {'int': pa.int64(), 'float': pa.float64()}
+    schema = pa.schema([(label, arrow_types.get(report.types.get(label), pa.string())) for label in report.labels])
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in iter_chunks(conn, report, **options):
+            columns = []
+            for field, values in zip(schema, zip(*rows)):
+                if field.type == pa.string():
+                    values = [None if v is None else str(v) for v in values]
+                columns.append(pa.array(values, type=field.type))
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            count += len(rows)
+    return count
+
+
+def export(conn, report, path, fmt='csv', **options):
+    if fmt == 'parquet':
+        return export_parquet(conn, report, path, **options)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        return export_csv(conn, report, f, **options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a library report as CSV or Parquet.")
+    parser.add_argument('report', choices=sorted(REPORTS))
+    parser.add_argument('--out', required=True, help="output file (.csv or .parquet)")
+    parser.add_argument('--sort')
+    parser.add_argument('--desc', action='store_true', default=None)
+    parser.add_argument('--filter', action='append', default=[], metavar='COLUMN=VALUE')
+    parser.add_argument('--since', help="first date of the period (history report)")
+    parser.add_argument('--until', help="last date of the period (history report)")
+    args = parser.parse_args(argv)
+
+    from db import get_connection
+    report = REPORTS[args.report]
+    filters = dict(f.split('=', 1) for f in args.filter)
+    fmt = 'parquet' if args.out.lower().endswith('.parquet') else 'csv'
+    conn = get_connection()
+    try:
+        count = export(conn, report, args.out, fmt, sort=args.sort, descending=args.desc, filters=filters,
+                       period=(args.since, args.until))
+    except (ValueError, KeyError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    print(f"{count} row(s) written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""Catalog search over titles: name, author and category.
+
+Uses an external-content FTS5 index (titles_fts, over the catalog_titles
+view, which has the category name) kept in sync by triggers, with prefix
+matching, ranking and pagination.  Results are titles, one row each however
+many copies there are, with their copy counts.  When nothing
+matches, suggest() proposes a corrected query from the index vocabulary.
+Falls back to LIKE if this SQLite build has no FTS5.
+"""
+import bisect
+import difflib
+import re
+import sqlite3
+import time
+
+from catalog import AVAILABLE_SQL, COPIES_SQL, ISSUED_SQL
+from codes import AVAILABLE
+
+PAGE_SIZE = 20
+
+# Ranking weights for a word found in name, author, category
+WEIGHTS = (10, 5, 1)
+
+# Queries with more hits than this (e.g. just a category name) are paged in
+# catalog order instead of ranked, which keeps them as fast as rare ones.
+RANK_WINDOW = 1000
+
+# Seconds a cached slice of the index vocabulary is reused by suggest()
+VOCAB_TTL = 300
+_vocab = {}
+
+# Index over the products table, before titles and copies (migration 2)
+FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+           name, author, category,
+           content='products', content_rowid='id',
+           tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts_vocab USING fts5vocab(products_fts, 'row')",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+           INSERT INTO products_fts (rowid, name, author, category)
+           VALUES (new.id, new.name, new.author, new.category);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+           INSERT INTO products_fts (products_fts, rowid, name, author, category)
+           VALUES ('delete', old.id, old.name, old.author, old.category);
+       END""",
+    # Status changes (issue/return) do not touch the index
+    """CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, author, category ON products BEGIN
+           INSERT INTO products_fts (products_fts, rowid, name, author, category)
+           VALUES ('delete', old.id, old.name, old.author, old.category);
+           INSERT INTO products_fts (rowid, name, author, category)
+           VALUES (new.id, new.name, new.author, new.category);
+       END""",
+    "INSERT INTO products_fts (products_fts) VALUES ('rebuild')",
+]
+
+
+# Index over titles with text columns (migration 11)
+TITLE_FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS titles_fts USING fts5(
+           name, author, category,
+           content='titles', content_rowid='id',
+           tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS titles_fts_vocab USING fts5vocab(titles_fts, 'row')",
+    """CREATE TRIGGER IF NOT EXISTS titles_fts_ai AFTER INSERT ON titles BEGIN
+           INSERT INTO titles_fts (rowid, name, author, category)
+           VALUES (new.id, new.name, new.author, new.category);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS titles_fts_ad AFTER DELETE ON titles BEGIN
+           INSERT INTO titles_fts (titles_fts, rowid, name, author, category)
+           VALUES ('delete', old.id, old.name, old.author, old.category);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS titles_fts_au AFTER UPDATE OF name, author, category ON titles BEGIN
+           INSERT INTO titles_fts (titles_fts, rowid, name, author, category)
+           VALUES ('delete', old.id, old.name, old.author, old.category);
+           INSERT INTO titles_fts (rowid, name, author, category)
+           VALUES (new.id, new.name, new.author, new.category);
+       END""",
+    "INSERT INTO titles_fts (titles_fts) VALUES ('rebuild')",
+]
+
+
+# Index over titles with a category id (migration 12): the content comes
+# from catalog_titles, the triggers look the category name up
+_CATEGORY = "(SELECT name FROM categories WHERE id = {0}.category_id)"
+
+CATALOG_FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS titles_fts USING fts5(
+           name, author, category,
+           content='catalog_titles', content_rowid='id',
+           tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS titles_fts_vocab USING fts5vocab(titles_fts, 'row')",
+    f"""CREATE TRIGGER IF NOT EXISTS titles_fts_ai AFTER INSERT ON titles BEGIN
+            INSERT INTO titles_fts (rowid, name, author, category)
+            VALUES (new.id, new.name, new.author, {_CATEGORY.format('new')});
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS titles_fts_ad AFTER DELETE ON titles BEGIN
+            INSERT INTO titles_fts (titles_fts, rowid, name, author, category)
+            VALUES ('delete', old.id, old.name, old.author, {_CATEGORY.format('old')});
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS titles_fts_au AFTER UPDATE OF name, author, category_id ON titles BEGIN
+            INSERT INTO titles_fts (titles_fts, rowid, name, author, category)
+            VALUES ('delete', old.id, old.name, old.author, {_CATEGORY.format('old')});
+            INSERT INTO titles_fts (rowid, name, author, category)
+            VALUES (new.id, new.name, new.author, {_CATEGORY.format('new')});
+        END""",
+    "INSERT INTO titles_fts (titles_fts) VALUES ('rebuild')",
+]
+
+
+def _create(conn, schema):
+    try:
+        conn.execute(schema[0])
+    except sqlite3.OperationalError:
+        return  # "no such module: fts5" - search_products() uses LIKE instead
+    for stmt in schema[1:]:
+        conn.execute(stmt)
+
+
+def create_index(conn):
+    """Migration step: build products_fts, skipped when FTS5 is unavailable."""
+    _create(conn, FTS_SCHEMA)
+
+
+def create_title_index(conn):
+    """Migration step: replace products_fts with titles_fts, skipped when FTS5 is unavailable."""
+    conn.execute("DROP TABLE IF EXISTS products_fts_vocab")
+    conn.execute("DROP TABLE IF EXISTS products_fts")
+    _create(conn, TITLE_FTS_SCHEMA)
+
+
+def create_catalog_index(conn):
+    """Migration step: rebuild titles_fts over catalog_titles, skipped when FTS5 is unavailable."""
+    conn.execute("DROP TABLE IF EXISTS titles_fts_vocab")
+    conn.execute("DROP TABLE IF EXISTS titles_fts")
+    _create(conn, CATALOG_FTS_SCHEMA)
+
+
+def has_index(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'titles_fts'").fetchone() is not None
+
+
+def _words(term):
+    return re.findall(r"\w+", term.lower())
+
+
+def _match_expr(words):
+    # Every word must match; the last one may still be partly typed, so it is
+    # matched as a prefix: frank herb -> "frank" "herb"*
+    # (long prefixes merge many doclists, single letters are not indexed)
+    *whole, last = words
+    return " ".join([f'"{w}"' for w in whole] + [f'"{last}"*' if len(last) > 1 else f'"{last}"'])
+
+
+# Up to SHELF_SERIALS serials of a title's copies on the shelf
+SHELF_SERIALS = 3
+_SHELF_SQL = f"""(SELECT group_concat(serial_no, ', ') FROM
+                     (SELECT c.serial_no FROM copies c
+                      WHERE c.title_id = t.id AND c.status_id = {AVAILABLE}
+                      ORDER BY c.serial_no LIMIT {SHELF_SERIALS}))"""
+
+_TITLE_ROW = f"t.name, t.author, t.category, t.type, {COPIES_SQL}, {AVAILABLE_SQL}, {ISSUED_SQL}, {_SHELF_SQL}"
+
+
+def _fetch(conn, ids, columns=_TITLE_ROW):
+    if not ids:
+        return []
+    return conn.execute(f"""SELECT {columns} FROM catalog_titles t
+                            WHERE t.id IN ({','.join('?' * len(ids))}) ORDER BY t.id""", ids).fetchall()
+
+
+def _page(conn, ids):
+    # Copy counts only for the titles shown, in the order given
+    rows = {r[0]: r[1:] for r in _fetch(conn, ids, "t.id, " + _TITLE_ROW)}
+    return [rows[i] for i in ids if i in rows]
+
+
+def _rank_key(row, words):
+    # Whole-word hits count double a prefix hit; title beats author beats category
+    score = 0
+    for text, weight in zip(row[0:3], WEIGHTS):
+        text = (text or "").lower()
+        for w in words:
+            if w in text:
+                score += 2 * weight if w in _words(text) else weight
+    return -score, row[0] or ""
+
+
+def search_products(conn, term, page=1, page_size=PAGE_SIZE):
+    """Return (rows, has_more) for one page of matching titles, best matches first.
+
+    Rows are (name, author, category, type, copies, available, issued,
+    shelf) - shelf lists serials of copies on the shelf (SHELF_SERIALS at
+    most), or is None.
+    """
+    words = _words(term)
+    offset = (page - 1) * page_size
+    if not words:
+        rows = conn.execute(f"""SELECT {_TITLE_ROW} FROM catalog_titles t
+                                ORDER BY t.name LIMIT ? OFFSET ?""", (page_size + 1, offset)).fetchall()
+    elif has_index(conn):
+        window = max(RANK_WINDOW, offset + page_size + 1)
+        hits = [r[0] for r in conn.execute(
+            "SELECT rowid FROM titles_fts WHERE titles_fts MATCH ? LIMIT ?",
+            (_match_expr(words), window + 1))]
+        if len(hits) > window:
+            rows = _fetch(conn, hits[offset:offset + page_size + 1])
+        else:
+            # Ranked on name/author/category alone
+            ranked = sorted(_fetch(conn, hits, "t.name, t.author, t.category, t.id"),
+                            key=lambda r: _rank_key(r, words))
+            rows = _page(conn, [r[3] for r in ranked[offset:offset + page_size + 1]])
+    else:
+        where = " AND ".join(["(t.name LIKE ? OR t.author LIKE ? OR t.category LIKE ?)"] * len(words))
+        params = [f"%{w}%" for w in words for _ in range(3)]
+        rows = conn.execute(f"""SELECT {_TITLE_ROW} FROM catalog_titles t
+                                WHERE {where} ORDER BY t.name LIMIT ? OFFSET ?""",
+                            params + [page_size + 1, offset]).fetchall()
+    return rows[:page_size], len(rows) > page_size
+
+
+def _vocabulary(conn, letter):
+    # Sorted index terms starting with `letter`; fts5vocab has to walk the
+    # doclists to produce them, so slices are cached per database file.
+    key = (conn.execute("PRAGMA database_list").fetchone()[2], letter)
+    cached = _vocab.get(key)
+    if cached is None or time.monotonic() - cached[0] > VOCAB_TTL:
+        terms = [r[0] for r in conn.execute(
+            "SELECT term FROM titles_fts_vocab WHERE term >= ? AND term < ?",
+            (letter, chr(ord(letter) + 1)))]
+        cached = _vocab[key] = (time.monotonic(), terms)
+    return cached[1]
+
+
+def _close_term(conn, word):
+    terms = _vocabulary(conn, word[0])
+    i = bisect.bisect_left(terms, word)
+    if i < len(terms) and terms[i] == word:
+        return word
+    close = difflib.get_close_matches(word, terms, n=1, cutoff=0.7)
+    return close[0] if close else None
+
+
+def suggest(conn, term):
+    """Corrected query ("did you mean") for a search with no hits, or None."""
+    words = _words(term)
+    if not words or not has_index(conn):
+        return None
+    corrected = []
+    for word in words:
+        close = _close_term(conn, word)
+        if close is None:
+            return None
+        corrected.append(close)
+    if corrected == words:
+        return None
+    return " ".join(corrected)
+
+
+def suggest_serials(conn, serial, limit=5):
+    """Serial numbers closest to one that was not found, via index range scans."""
+    probes = {serial}
+    if serial.isdigit():
+        probes.add(f"{int(serial):02d}")
+    found = set()
+    for probe in probes:
+        found.update(r[0] for r in conn.execute(
+            "SELECT serial_no FROM copies WHERE serial_no >= ? ORDER BY serial_no LIMIT ?", (probe, limit)))
+        found.update(r[0] for r in conn.execute(
+            "SELECT serial_no FROM copies WHERE serial_no < ? ORDER BY serial_no DESC LIMIT ?", (probe, limit)))
+    found.discard(None)
+    return sorted(found, key=lambda s: -difflib.SequenceMatcher(None, serial, s).ratio())[:limit]
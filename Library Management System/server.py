@@ -0,0 +1,385 @@
+"""Local HTTP/JSON API for self-checkout kiosks and OPAC terminals.
+
+One asyncio process serves many kiosks.  Sockets are handled on the event
+loop; every database call runs on a bounded pool of WORKERS threads, each
+keeping one pooled connection open for its lifetime.  When all workers are
+busy and QUEUE_LIMIT more calls are waiting, further requests are refused
+with 503 instead of piling up.  Latency is recorded per endpoint and served
+at /metrics.  The work itself is done by api.py, as in the other front ends.
+
+    python server.py [--host 127.0.0.1] [--port 8080] [--workers 8]
+
+    GET  /search?q=dune&page=1                 titles by name, author or category, with copy counts
+    GET  /items/<serial>                       availability of one copy
+    GET  /availability/<title>                 copies of a title on the shelf (availability.py)
+    GET  /members/<id>                         member record and fine balance (no Aadhaar number)
+    GET  /reports/<name>?sort=&desc=1&after=&page_size=&since=&until=&<column>=<value>
+                                               PUBLIC_REPORTS only (the catalog lists)
+    POST /issue   {"serial", "member_id", "issue_date"?, "return_date"?, "remarks"?}
+    POST /return  {"serial", "return_date"?, "remarks"?, "payment"?}
+    POST /pay     {"member_id", "amount"}      admin: needs "Authorization: Bearer <LIBRARY_ADMIN_TOKEN>"
+    GET  /metrics                              request counts and latency (ms) per endpoint
+    GET  /metrics/sql                          per-statement counters (Prometheus text, see instrument.py)
+
+Dates default to today and a due date to the loan policy's (policy.py).
+Errors are returned as {"error": message} with 400 (invalid input), 401
+(admin token missing or wrong), 403 (admin routes disabled), 404 (not
+found), 409 (item unavailable) or 503 (busy).
+
+Kiosks are not authenticated, so nothing they can reach shows member
+reports or Aadhaar numbers.  Admin routes take money and are refused
+unless the server was started with LIBRARY_ADMIN_TOKEN set and the request
+carries that token.  Bind to localhost or a kiosk-only network all the same.
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import api
+import availability
+import instrument
+from db import get_connection
+from errors import InvalidInput, NotFound, Unavailable
+from reports import REPORTS, fetch_page
+from search import search_products, suggest
+
+log = logging.getLogger("server")
+
+# Threads running database calls, and calls allowed to wait for one
+WORKERS = 8
+QUEUE_LIMIT = 256
+
+# Largest report page a client may ask for
+MAX_PAGE_SIZE = 500
+
+# Latest requests per endpoint kept for the latency percentiles
+LATENCY_SAMPLES = 2000
+
+MAX_BODY = 64 * 1024
+KEEPALIVE_TIMEOUT = 30
+
+SEARCH_FIELDS = ('name', 'author', 'category', 'type', 'copies', 'available', 'issued', 'shelf')
+
+# Reports any kiosk may read; the others list members and their loans
+PUBLIC_REPORTS = ('books', 'movies', 'copies')
+
+# Member fields never sent over HTTP
+PRIVATE_FIELDS = ('aadhar_no',)
+
+
+# ────────────────────────────────────────────────
+# Endpoints (run on a worker thread with its own connection)
+# ────────────────────────────────────────────────
+def _field(body, name, default=None):
+    value = body.get(name, default)
+    if value is None or value == '':
+        raise InvalidInput(f"'{name}' is required.")
+    return value
+
+
+def _today():
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def _search(conn, arg, query, body):
+    term = query.get('q', '')
+    try:
+        page = max(1, int(query.get('page', 1)))
+    except ValueError:
+        raise InvalidInput("page must be a number.") from None
+    rows, has_more = search_products(conn, term, page)
+    titles = [dict(zip(SEARCH_FIELDS, row)) for row in rows]
+    for title in titles:
+        title['shelf'] = title['shelf'].split(', ') if title['shelf'] else []
+    result = {'titles': titles, 'has_more': has_more}
+    if not rows and term:
+        result['did_you_mean'] = suggest(conn, term)
+    return result
+
+
+def _item(conn, serial, query, body):
+    item = api.get_item(conn, serial)
+    return dict(item._asdict(), available=item.status == 'Available')
+
+
+def _availability(conn, title, query, body):
+    return api.title_availability(conn, title)._asdict()
+
+
+def _member(conn, member_id, query, body):
+    member = api.get_member(conn, member_id)._asdict()
+    for field in PRIVATE_FIELDS:
+        del member[field]
+    return member
+
+
+def _report(conn, name, query, body):
+    if name not in PUBLIC_REPORTS:
+        raise NotFound(f"No report '{name}'; reports: {', '.join(sorted(PUBLIC_REPORTS))}.")
+    report = REPORTS[name]
+    options = dict(query)
+    try:
+        page_size = min(MAX_PAGE_SIZE, int(options.pop('page_size', 0)) or MAX_PAGE_SIZE)
+        after = options.pop('after', None)
+        after = tuple(json.loads(after)) if after else None
+    except (ValueError, TypeError):
+        raise InvalidInput("page_size must be a number and after a cursor from a previous page.") from None
+    sort = options.pop('sort', None)
+    if sort is not None and sort not in report.labels:
+        raise InvalidInput(f"{report.title} cannot be sorted by {sort}.")
+    desc = options.pop('desc', None)
+    descending = None if desc is None else desc.lower() in ('1', 'true', 'yes')
+    period = (options.pop('since', None), options.pop('until', None))
+    rows, cursor = fetch_page(conn, report, sort, descending, options, after, page_size, period=period)
+    return {'report': report.title, 'columns': report.labels, 'rows': rows, 'next': cursor}
+
+
+def _issue(conn, arg, query, body):
+    serial, member_id = _field(body, 'serial'), _field(body, 'member_id')
+    issue_date = body.get('issue_date') or _today()
+    issued = api.parse_date(issue_date, "issue_date")
+    return_date = body.get('return_date') or None
+    if return_date and api.parse_date(return_date, "return_date") <= issued:
+        raise InvalidInput("return_date must be after issue_date.")
+    name, member, due = api.issue_item(conn, serial, member_id, issue_date, return_date, body.get('remarks', ''))
+    return {'serial': serial, 'name': name, 'member': member, 'due': due}
+
+
+def _return(conn, arg, query, body):
+    serial = _field(body, 'serial')
+    return_date = body.get('return_date') or _today()
+    api.parse_date(return_date, "return_date")
+    # A return need not take a payment (absent, null or 0); fines.pay() checks any other amount
+    name, fine, billed, balance, held_for = api.return_item(conn, serial, return_date, body.get('remarks', ''),
+                                                            payment=body.get('payment') or 0)
+    return {'serial': serial, 'name': name, 'fine': fine, 'billed': billed, 'balance': balance,
+            'held_for': held_for}
+
+
+def _pay(conn, arg, query, body):
+    member_id = _field(body, 'member_id')
+    return {'member_id': member_id, 'balance': api.pay_fine(conn, member_id, _field(body, 'amount'))}
+
+
+# (method, first path segment) -> (handler, name of the second segment if it takes one)
+ROUTES = {
+    ('GET', 'search'): (_search, None),
+    ('GET', 'items'): (_item, 'serial'),
+    ('GET', 'availability'): (_availability, 'title'),
+    ('GET', 'members'): (_member, 'id'),
+    ('GET', 'reports'): (_report, 'name'),
+    ('POST', 'issue'): (_issue, None),
+    ('POST', 'return'): (_return, None),
+    ('POST', 'pay'): (_pay, None),
+}
+
+# Routes that need the admin token
+ADMIN_ROUTES = {('POST', 'pay')}
+
+_local = threading.local()
+
+
+def _call(handler, arg, query, body):
+    # Each worker thread borrows one connection and keeps it
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = get_connection()
+    try:
+        return handler(conn, arg, query, body)
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+
+
+# ────────────────────────────────────────────────
+# Latency metrics (updated on the event loop only)
+# ────────────────────────────────────────────────
+class Metrics:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counts = {}
+        self.errors = {}
+        self.samples = {}
+
+    def record(self, endpoint, status, seconds):
+        self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+        if status >= 500:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        self.samples.setdefault(endpoint, deque(maxlen=LATENCY_SAMPLES)).append(seconds * 1000)
+
+    def snapshot(self):
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            ms = sorted(samples)
+            endpoints[endpoint] = {
+                'count': self.counts[endpoint],
+                'errors': self.errors.get(endpoint, 0),
+                'p50_ms': round(ms[int(0.50 * (len(ms) - 1))], 3),
+                'p99_ms': round(ms[int(0.99 * (len(ms) - 1))], 3),
+                'mean_ms': round(sum(ms) / len(ms), 3),
+                'max_ms': round(ms[-1], 3),
+            }
+        return {'uptime_s': round(time.monotonic() - self.started, 1), 'endpoints': endpoints}
+
+
+# ────────────────────────────────────────────────
+# HTTP server
+# ────────────────────────────────────────────────
+class Server:
+    def __init__(self, workers=WORKERS, queue_limit=QUEUE_LIMIT, admin_token=None):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.admin_token = admin_token
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+        self.pending = 0
+        self.metrics = Metrics()
+
+    def _refuse_admin(self, headers):
+        # (status, message) if an admin route may not be called with these headers, else None
+        if not self.admin_token:
+            return 403, "Admin routes are disabled on this server."
+        scheme, _, token = headers.get('authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), self.admin_token.encode()):
+            return 401, "Admin token missing or wrong."
+        return None
+
+    async def dispatch(self, method, target, body, headers=None):
+        """(endpoint label, status, JSON payload) for one request."""
+        url = urlsplit(target)
+        parts = [unquote(p) for p in url.path.split('/') if p]
+        if method == 'GET' and parts == ['metrics']:
+            return 'GET /metrics', 200, dict(self.metrics.snapshot(), workers=self.workers, pending=self.pending)
+        if method == 'GET' and parts == ['metrics', 'sql']:
+            return 'GET /metrics/sql', 200, instrument.prometheus()
+        route = ROUTES.get((method, parts[0] if parts else ''))
+        if route is None or len(parts) != (2 if route[1] else 1):
+            return 'unmatched', 404, {'error': f"No endpoint {method} {url.path}"}
+        handler, takes_arg = route
+        endpoint = f"{method} /{parts[0]}" + (f"/<{takes_arg}>" if takes_arg else "")
+        if (method, parts[0]) in ADMIN_ROUTES:
+            refused = self._refuse_admin(headers or {})
+            if refused:
+                return endpoint, refused[0], {'error': refused[1]}
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            return endpoint, 400, {'error': "Body must be JSON."}
+        if not isinstance(payload, dict):
+            return endpoint, 400, {'error': "Body must be a JSON object."}
+        if self.pending >= self.workers + self.queue_limit:
+            return endpoint, 503, {'error': "Server busy, try again."}
+        self.pending += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.pool, _call, handler, parts[1] if takes_arg else None, dict(parse_qsl(url.query)), payload)
+        except NotFound as e:
+            return endpoint, 404, {'error': str(e)}
+        except Unavailable as e:
+            return endpoint, 409, {'error': str(e)}
+        # InvalidInput (checked by the API itself, e.g. payment amounts) and any other ValueError
+        except ValueError as e:
+            return endpoint, 400, {'error': str(e)}
+        except Exception:
+            log.exception("%s %s failed", method, target)
+            return endpoint, 500, {'error': "Internal error."}
+        finally:
+            self.pending -= 1
+        return endpoint, 200, result
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not line.strip():
+                    break
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                start = time.perf_counter()
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    await self.respond(writer, 400, {'error': "Malformed request."}, False)
+                    break
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {'error': "Body too large."}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                endpoint, status, payload = await self.dispatch(method.upper(), target, body, headers)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                await self.respond(writer, status, payload, keep_alive)
+                self.metrics.record(endpoint, status, time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        # Text payloads are Prometheus metrics; everything else is JSON
+        if isinstance(payload, str):
+            data, content_type = payload.encode(), "text/plain; version=0.0.4"
+        else:
+            data, content_type = json.dumps(payload, default=str).encode(), "application/json"
+        writer.write(f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                     f"Content-Type: {content_type}\r\nContent-Length: {len(data)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+        await writer.drain()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        log.info("Serving on %s with %d database workers", ", ".join(str(s.getsockname()) for s in server.sockets),
+                 self.workers)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the library over HTTP/JSON for kiosks and terminals.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=WORKERS, help="threads running database calls")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    from library_management import bootstrap
+    bootstrap()
+    conn = get_connection()
+    try:
+        log.info("Availability index: %d copies", availability.warm(conn))
+    finally:
+        conn.close()
+    server = Server(args.workers, admin_token=os.environ.get('LIBRARY_ADMIN_TOKEN') or None)
+    if not server.admin_token:
+        log.info("LIBRARY_ADMIN_TOKEN is not set: admin routes (POST /pay) are disabled")
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.pool.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""Circulation summary tables for the dashboard, maintained by triggers.
+
+Every write to copies, titles, issues and members adjusts a handful of small
+counter rows in the same transaction, so dashboard metrics are read from
+tables whose size does not depend on the number of copies or the length of
+the loan history:
+
+  catalog_stats       copies per type / category / status
+  open_loans_by_due   open loans per type / category / due date (overdue
+                      counts sum the buckets due before today)
+  member_loans        open loans per member
+  circulation_totals  single row: open loans, outstanding fines, members owing
+
+    python stats.py            # verify the summaries against the base tables
+    python stats.py --rebuild  # recompute them
+"""
+import sys
+from datetime import datetime
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS catalog_stats
+       (type TEXT NOT NULL, category TEXT NOT NULL, status TEXT NOT NULL, copies INTEGER NOT NULL,
+        PRIMARY KEY (type, category, status)) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS open_loans_by_due
+       (type TEXT NOT NULL, category TEXT NOT NULL, return_date TEXT NOT NULL, open_count INTEGER NOT NULL,
+        PRIMARY KEY (type, category, return_date)) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS member_loans
+       (member_id INTEGER PRIMARY KEY, open_count INTEGER NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS circulation_totals
+       (id INTEGER PRIMARY KEY CHECK (id = 1), open_loans INTEGER NOT NULL,
+        outstanding_fines REAL NOT NULL, members_owing INTEGER NOT NULL)""",
+]
+
+# Expressions shared by the triggers and rebuild(); NULLs become '' because
+# NULLs never collide in a primary key.  Legacy rows with no status count as
+# Available, as in the Issue flow.
+_STATUS = "COALESCE({0}.status, 'Available')"
+_PRODUCT_KEY = "COALESCE({0}.type, ''), COALESCE({0}.category, ''), " + _STATUS
+_LOAN_KEY = ("COALESCE((SELECT type FROM products WHERE id = {0}.product_id), ''), "
+             "COALESCE((SELECT category FROM products WHERE id = {0}.product_id), ''), "
+             "COALESCE({0}.return_date, '')")
+
+
+def _catalog_add(row, delta):
+    return f"""INSERT INTO catalog_stats (type, category, status, copies)
+               VALUES ({_PRODUCT_KEY.format(row)}, {delta})
+               ON CONFLICT (type, category, status) DO UPDATE SET copies = copies + {delta};"""
+
+
+def _loan_add(row, delta):
+    return f"""INSERT INTO open_loans_by_due (type, category, return_date, open_count)
+               VALUES ({_LOAN_KEY.format(row)}, {delta})
+               ON CONFLICT (type, category, return_date) DO UPDATE SET open_count = open_count + {delta};
+               INSERT INTO member_loans (member_id, open_count) VALUES ({row}.member_id, {delta})
+               ON CONFLICT (member_id) DO UPDATE SET open_count = open_count + {delta};
+               UPDATE circulation_totals SET open_loans = open_loans + {delta};"""
+
+
+# Buckets that drop to zero are removed so both tables only cover open loans
+_LOAN_CLEANUP = """DELETE FROM open_loans_by_due WHERE open_count <= 0;
+                   DELETE FROM member_loans WHERE open_count <= 0;"""
+
+
+# Copies take their type and category from their title
+_COPY_KEY = ("COALESCE((SELECT type FROM titles WHERE id = {0}.title_id), ''), "
+             "COALESCE((SELECT category FROM titles WHERE id = {0}.title_id), ''), " + _STATUS)
+_TITLE_NAMES = "COALESCE({0}.type, ''), COALESCE({0}.category, '')"
+
+# The same once type, category and status are lookup ids (migration 12)
+_CODED_STATUS = "COALESCE((SELECT name FROM copy_statuses WHERE id = {0}.status_id), 'Available')"
+_CODED_COPY_KEY = ("COALESCE((SELECT type FROM catalog_titles WHERE id = {0}.title_id), ''), "
+                   "COALESCE((SELECT category FROM catalog_titles WHERE id = {0}.title_id), ''), " + _CODED_STATUS)
+_CODED_TITLE_NAMES = ("COALESCE((SELECT name FROM item_types WHERE id = {0}.type_id), ''), "
+                      "COALESCE((SELECT name FROM categories WHERE id = {0}.category_id), '')")
+
+
+def _copy_add(row, delta, key=_COPY_KEY):
+    return f"""INSERT INTO catalog_stats (type, category, status, copies)
+               VALUES ({key.format(row)}, {delta})
+               ON CONFLICT (type, category, status) DO UPDATE SET copies = copies + {delta};"""
+
+
+def _title_add(row, sign, names=_TITLE_NAMES, status=_STATUS):
+    # Every copy of a title at once, one row per status
+    return f"""INSERT INTO catalog_stats (type, category, status, copies)
+               SELECT {names.format(row)}, {status.format('c')}, {sign}COUNT(*)
+               FROM copies c WHERE c.title_id = {row}.id GROUP BY 3
+               ON CONFLICT (type, category, status) DO UPDATE SET copies = copies + excluded.copies;"""
+
+
+def _fines_add(row, sign):
+    return f"""UPDATE circulation_totals
+               SET outstanding_fines = outstanding_fines {sign} COALESCE({row}.pending_fine, 0),
+                   members_owing = members_owing {sign} (COALESCE({row}.pending_fine, 0) > 0);"""
+
+
+TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS stats_products_ai AFTER INSERT ON products BEGIN
+            {_catalog_add('new', 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_products_ad AFTER DELETE ON products BEGIN
+            {_catalog_add('old', -1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_products_au AFTER UPDATE OF type, category, status ON products BEGIN
+            {_catalog_add('old', -1)}
+            {_catalog_add('new', 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_issues_ai AFTER INSERT ON issues
+        WHEN new.actual_return_date IS NULL BEGIN
+            {_loan_add('new', 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_issues_ad AFTER DELETE ON issues
+        WHEN old.actual_return_date IS NULL BEGIN
+            {_loan_add('old', -1)}
+            {_LOAN_CLEANUP}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_issues_au_old
+        AFTER UPDATE OF actual_return_date, return_date, product_id, member_id ON issues
+        WHEN old.actual_return_date IS NULL BEGIN
+            {_loan_add('old', -1)}
+            {_LOAN_CLEANUP}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_issues_au_new
+        AFTER UPDATE OF actual_return_date, return_date, product_id, member_id ON issues
+        WHEN new.actual_return_date IS NULL BEGIN
+            {_loan_add('new', 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_members_ai AFTER INSERT ON members BEGIN
+            {_fines_add('new', '+')}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_members_ad AFTER DELETE ON members BEGIN
+            {_fines_add('old', '-')}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_members_au AFTER UPDATE OF pending_fine ON members BEGIN
+            {_fines_add('old', '-')}
+            {_fines_add('new', '+')}
+        END""",
+]
+
+# The same for the catalog as titles and copies (migration 11)
+COPY_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS stats_copies_ai AFTER INSERT ON copies BEGIN
+            {_copy_add('new', 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_copies_ad AFTER DELETE ON copies BEGIN
+            {_copy_add('old', -1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_copies_au AFTER UPDATE OF title_id, status ON copies
+        WHEN old.title_id IS NOT new.title_id OR old.status IS NOT new.status BEGIN
+            {_copy_add('old', -1)}
+            {_copy_add('new', 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_titles_au AFTER UPDATE OF type, category ON titles
+        WHEN old.type IS NOT new.type OR old.category IS NOT new.category BEGIN
+            {_title_add('old', '-')}
+            {_title_add('new', '')}
+        END""",
+]
+
+# The same with lookup ids (migration 12)
+CODED_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS stats_copies_ai AFTER INSERT ON copies BEGIN
+            {_copy_add('new', 1, _CODED_COPY_KEY)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_copies_ad AFTER DELETE ON copies BEGIN
+            {_copy_add('old', -1, _CODED_COPY_KEY)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_copies_au AFTER UPDATE OF title_id, status_id ON copies
+        WHEN old.title_id IS NOT new.title_id OR old.status_id IS NOT new.status_id BEGIN
+            {_copy_add('old', -1, _CODED_COPY_KEY)}
+            {_copy_add('new', 1, _CODED_COPY_KEY)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS stats_titles_au AFTER UPDATE OF type_id, category_id ON titles
+        WHEN old.type_id IS NOT new.type_id OR old.category_id IS NOT new.category_id BEGIN
+            {_title_add('old', '-', _CODED_TITLE_NAMES, _CODED_STATUS)}
+            {_title_add('new', '', _CODED_TITLE_NAMES, _CODED_STATUS)}
+        END""",
+]
+
+# Full recomputation from the base tables (migration backfill, --rebuild, check)
+REBUILD = {
+    'catalog_stats': f"""SELECT {_PRODUCT_KEY.format('p')}, COUNT(*) FROM products p GROUP BY 1, 2, 3""",
+    'open_loans_by_due': f"""SELECT {_LOAN_KEY.format('i')}, COUNT(*) FROM issues i
+                             WHERE i.actual_return_date IS NULL GROUP BY 1, 2, 3""",
+    'member_loans': """SELECT member_id, COUNT(*) FROM issues WHERE actual_return_date IS NULL
+                       GROUP BY member_id""",
+    'circulation_totals': """SELECT 1, (SELECT COUNT(*) FROM issues WHERE actual_return_date IS NULL),
+                                    COALESCE(SUM(pending_fine), 0), COALESCE(SUM(pending_fine > 0), 0)
+                             FROM members""",
+}
+
+
+def rebuild(conn):
+    """Recompute every summary table (call inside a write transaction)."""
+    for table, select in REBUILD.items():
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} {select}")
+
+
+def create_tables(conn):
+    """Migration step: create the summary tables and triggers, then backfill."""
+    for stmt in SCHEMA + TRIGGERS:
+        conn.execute(stmt)
+    rebuild(conn)
+
+
+def create_copy_triggers(conn):
+    """Migration step: catalog_stats triggers on titles and copies."""
+    for stmt in COPY_TRIGGERS:
+        conn.execute(stmt)
+
+
+def create_coded_triggers(conn):
+    """Migration step: catalog_stats triggers on titles and copies with lookup ids."""
+    for stmt in CODED_TRIGGERS:
+        conn.execute(stmt)
+
+
+def check(conn):
+    """Return the names of summary tables that disagree with the base tables."""
+    stale = []
+    for table, select in REBUILD.items():
+        stored = conn.execute(f"SELECT * FROM {table}").fetchall()
+        if table == 'circulation_totals':
+            stored = [r[:2] + (round(r[2], 2),) + r[3:] for r in stored]
+            fresh = [r[:2] + (round(r[2], 2),) + r[3:] for r in conn.execute(select)]
+        else:
+            fresh = conn.execute(select).fetchall()
+            stored = [r for r in stored if r[-1] != 0]
+        if sorted(stored) != sorted(fresh):
+            stale.append(table)
+    return stale
+
+
+# ────────────────────────────────────────────────
+# Dashboard reads (summary tables only)
+# ────────────────────────────────────────────────
+def dashboard(conn, today=None):
+    """Metrics for the Home page: a dict of totals and per-category rows."""
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    open_loans, fines, owing = conn.execute(
+        "SELECT open_loans, outstanding_fines, members_owing FROM circulation_totals").fetchone() or (0, 0.0, 0)
+    categories = {}
+    for cat, status, copies in conn.execute(
+            "SELECT category, status, SUM(copies) FROM catalog_stats GROUP BY category, status"):
+        row = categories.setdefault(cat, {'copies': 0, 'available': 0, 'issued': 0, 'overdue': 0})
+        row['copies'] += copies
+        if status in ('Available', 'Issued'):
+            row[status.lower()] += copies
+    for cat, n in conn.execute("""SELECT category, SUM(open_count) FROM open_loans_by_due
+                                  WHERE return_date != '' AND return_date < ? GROUP BY category""", (today,)):
+        categories.setdefault(cat, {'copies': 0, 'available': 0, 'issued': 0, 'overdue': 0})['overdue'] = n
+    busiest = conn.execute("""SELECT l.member_id, m.first_name || ' ' || m.last_name, l.open_count
+                              FROM member_loans l LEFT JOIN members m ON m.id = l.member_id
+                              ORDER BY l.open_count DESC LIMIT 10""").fetchall()
+    return {
+        'copies': sum(r['copies'] for r in categories.values()),
+        'available': sum(r['available'] for r in categories.values()),
+        'open_loans': open_loans,
+        'overdue': sum(r['overdue'] for r in categories.values()),
+        'outstanding_fines': fines,
+        'members_owing': owing,
+        'categories': categories,
+        'busiest_members': busiest,
+    }
+
+
+if __name__ == "__main__":
+    from db import get_connection, transaction
+    from library_management import create_db
+    create_db()
+    conn = get_connection()
+    if '--rebuild' in sys.argv:
+        transaction(conn, rebuild)
+        print("Summary tables rebuilt.")
+    else:
+        stale = check(conn)
+        print("Summary tables are consistent." if not stale else f"Out of date: {', '.join(stale)} (run with --rebuild)")
+    conn.close()
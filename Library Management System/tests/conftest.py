@@ -0,0 +1,33 @@
+"""Fixtures for the tests: each test gets its own copy of the shipped library.db.
+
+    python -m pytest tests
+"""
+import os
+import shutil
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import db
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    """Path of a copy of library.db as shipped (schema version 0); get_connection() points at it."""
+    path = str(tmp_path / 'library.db')
+    shutil.copy(os.path.join(APP_DIR, 'library.db'), path)
+    previous = db.get_db_path()
+    db.set_db_path(path)
+    yield path
+    db.set_db_path(previous)
+
+
+@pytest.fixture
+def library(baseline_db):
+    """The copy of library.db migrated to the latest schema by bootstrap()."""
+    from library_management import bootstrap
+    bootstrap()
+    return baseline_db
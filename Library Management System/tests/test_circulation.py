@@ -0,0 +1,43 @@
+import threading
+
+import api
+from db import get_connection
+from errors import Unavailable
+
+
+def test_two_desks_issuing_one_copy(library):
+    conn = get_connection()
+    try:
+        other = api.add_member(conn, "Asha", "Rao", "Ravi Rao", "12 Park Street", "123412341234",
+                               "2026-03-01", "1 year")
+    finally:
+        conn.close()
+    start = threading.Barrier(2)
+    outcomes = {}
+
+    def desk(member_id):
+        conn = get_connection()
+        try:
+            start.wait()
+            outcomes[member_id] = api.issue_item(conn, '01', member_id, "2026-04-01")
+        except Unavailable as e:
+            outcomes[member_id] = e
+        finally:
+            conn.close()
+
+    desks = [threading.Thread(target=desk, args=(member_id,)) for member_id in (1, other.id)]
+    for t in desks:
+        t.start()
+    for t in desks:
+        t.join()
+
+    issued = [m for m, outcome in outcomes.items() if isinstance(outcome, tuple)]
+    assert len(outcomes) == 2 and len(issued) == 1
+    conn = get_connection()
+    try:
+        loans = conn.execute("""SELECT i.member_id FROM issues i JOIN products p ON p.id = i.product_id
+                                WHERE p.serial_no = '01' AND i.actual_return_date IS NULL""").fetchall()
+        assert loans == [(issued[0],)]
+        assert api.get_item(conn, '01')[5] == 'Issued'
+    finally:
+        conn.close()
@@ -0,0 +1,24 @@
+import sqlite3
+
+import availability
+import stats
+from db import get_connection
+from library_management import bootstrap
+from migrations import LATEST_VERSION, current_version
+
+
+def test_shipped_database_migrates_to_latest(baseline_db):
+    with sqlite3.connect(baseline_db) as conn:
+        assert current_version(conn) == 0
+    assert bootstrap()
+    conn = get_connection()
+    try:
+        assert current_version(conn) == LATEST_VERSION == 15
+        assert conn.execute("PRAGMA integrity_check").fetchall() == [('ok',)]
+        assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+        assert stats.check(conn) == []
+        assert availability.check(conn) == []
+        # The shipped copies are all still there, with their serials
+        assert conn.execute("SELECT COUNT(*) FROM products").fetchone()[0] == 5
+    finally:
+        conn.close()